@@ -3,13 +3,83 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import json
-from monte_carlo import geometric_brownian_motion, correlated_geometric_brownian_motion, load_simulation_data, INPUT_FILE
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
+from monte_carlo import (geometric_brownian_motion, correlated_geometric_brownian_motion, correlated_terminal_prices,
+                         correlated_gbm_blocks, correlated_model_paths, correlated_model_terminal_prices,
+                         correlated_model_at_horizons,
+                         importance_sampled_terminal_prices, terminal_prices_from_shocks,
+                         correlated_brownian_paths, standard_normals, correlated_brownian_at_horizons, gbm_from_brownian,
+                         crash_shift, load_simulation_data, INPUT_FILE,
+                         T_COPULA_DOF, JUMP_INTENSITY, JUMP_MEAN, JUMP_STD)
+from position_store import load_position_store
+from tail_stats import TailAccumulator, tail_capacity, weighted_tail_stats
+from liquidation import liquidation_book, simulate_liquidations
+from attribution import build_attribution, component_attribution, user_attribution
+from correlation_factor import correlation_factor, FACTOR_VARIANCE_KEPT
+from scenario_cache import scenario_key, cached_scenarios, CACHE_DIR as SCENARIO_CACHE_DIR
 
 # Configuration
 NUM_SIMULATIONS = 10000
+# Set to an int for reproducible runs; seeded scenario matrices are cached on disk
+# (scenario_cache.py) so re-running against new positions skips generation
+SCENARIO_SEED = None
+SCENARIO_CACHE = True
+# Also cache every chunk of seeded streaming runs (about 80MB per million 10-asset
+# scenarios, so large runs can evict everything else)
+CACHE_STREAMING_CHUNKS = False
 ACTIVE_POSITIONS_FILE = "data/active_positions.csv"
+# Columnar store written by bad_debt.py; preferred over the CSV when present
+POSITION_STORE_DIR = "data/active_positions"
 MARKET_DATA_FILE = "data/volatility_and_correlation.json"
+# Aligned daily prices written by fetch_market_data.py
+PRICE_HISTORY_FILE = "data/aligned_prices.csv"
 VAR_PERCENTILE = 99.9
+# Confidence level of the reported VaR / ES intervals
+CONFIDENCE_LEVEL = 0.95
+EVAL_BATCH_CELLS = 5_000_000
+# Value single-collateral/single-debt users from sorted insolvency price ratios
+# instead of the per-user sparse product
+USE_THRESHOLD_INDEX = True
+# 'terminal' draws the 1-year prices directly, 'paths' simulates every daily step
+SAMPLER_MODE = "terminal"
+# Runs larger than CHUNK_SIZE are generated and evaluated chunk by chunk
+CHUNK_SIZE = 50_000
+# Worker processes for streaming runs; results for a given seed do not depend on it
+N_WORKERS = 1
+# 'pseudo', 'antithetic' or 'sobol' normals for the price scenarios ('sobol' works best
+# when NUM_SIMULATIONS and CHUNK_SIZE are powers of 2)
+SAMPLING_METHOD = "pseudo"
+# 'gbm', 't_copula' (joint crashes) or 'jump' (Merton jumps); parameters in monte_carlo.py
+SAMPLER_MODEL = "gbm"
+# Print the VaR standard error of each sampling method, from independent replications
+REPORT_STANDARD_ERROR = False
+SE_REPLICATIONS = 30
+# Importance sampling: shift the shocks IS_SHIFT standard deviations towards a joint crash
+IMPORTANCE_SAMPLING = False
+IS_SHIFT = 3.0
+# 'eigen' shifts along the leading correlation eigenvector (joint crash); 'pilot' shifts
+# towards the mean shock of the worst scenarios of a small plain pilot run
+IS_SHIFT_METHOD = "pilot"
+IS_PILOT_SIMULATIONS = 2000
+IS_PILOT_PERCENTILE = 99.0
+# Effective sample sizes below this get a warning: a few draws carry most of the weight
+IS_MIN_EFFECTIVE_SAMPLE_SIZE = 1000
+# Path-aware mode: follow daily health factors and liquidate users as they cross 1,
+# instead of only checking solvency at the horizon (parameters in liquidation.py)
+PATH_LIQUIDATIONS = False
+# Daily steps generated and screened together in the path-aware mode
+LIQUIDATION_BLOCK_STEPS = 30
+# Historical replay: revalue the book under every overlapping N-day joint return
+# window of PRICE_HISTORY_FILE, next to the GBM results
+HISTORICAL_REPLAY = True
+HISTORICAL_WINDOW_DAYS = 30
+# Horizons (days) reported side by side, all read off the same draws; empty to skip.
+# Plain runs then take the headline 1-year figures from the same run's 365-day row
+HORIZONS_DAYS = [1, 7, 30, 90, 365]
+# Print Euler VaR / ES contributions by asset and by user (in-memory runs only)
+ATTRIBUTION = False
+ATTRIBUTION_TOP_USERS = 10
 
 def calculate_user_equity(user_positions, price_map):
     """
@@ -30,8 +100,163 @@ def calculate_user_equity(user_positions, price_map):
         
     return total_collateral, total_debt, total_collateral - total_debt
 
-def simulate_bad_debt(active_positions_df, market_data, num_simulations=NUM_SIMULATIONS):
+def prepare_position_book(positions, assets, threshold_index=USE_THRESHOLD_INDEX):
+    """
+    Pack active positions into sparse CSR (n_users x n_assets) collateral and debt
+    matrices, plus their signed difference `exposure` used to value every user
+    under a batch of price scenarios with one sparse-dense product.
+    `positions` is either the active positions DataFrame or a columnar store from
+    position_store.load_position_store.
+    Positions in symbols outside `assets` keep their snapshot price, as in
+    calculate_user_equity, and are folded into per-user static USD values.
+    With `threshold_index`, the book also carries build_threshold_index(book).
+    """
+    asset_index = {a: j for j, a in enumerate(assets)}
+
+    if isinstance(positions, pd.DataFrame):
+        user_ids, user_index = np.unique(positions['user_id'].to_numpy(), return_inverse=True)
+        asset_codes = positions['symbol'].map(asset_index).fillna(-1).to_numpy(dtype=int)
+        is_collateral = positions['is_collateral'].fillna(False).to_numpy(dtype=bool)
+        collateral_amount = positions['collateral_amount'].to_numpy(dtype=float)
+        debt_amount = positions['debt_amount'].to_numpy(dtype=float)
+        snapshot_price = positions['price'].to_numpy(dtype=float)
+    else:
+        user_ids = positions['user_ids']
+        user_index = positions['user_index']
+        symbol_to_asset = np.array([asset_index.get(symbol, -1) for symbol in positions['symbols']], dtype=int)
+        asset_codes = symbol_to_asset[positions['symbol_code']] if len(symbol_to_asset) else np.empty(0, dtype=int)
+        is_collateral = positions['is_collateral']
+        collateral_amount = positions['collateral_amount']
+        debt_amount = positions['debt_amount']
+        snapshot_price = positions['price']
+
+    n_users = len(user_ids)
+    n_assets = len(assets)
+    collateral_amount = np.where(is_collateral, collateral_amount, 0.0)
+
+    modeled = asset_codes >= 0
+    shape = (n_users, n_assets)
+    coords = (user_index[modeled], asset_codes[modeled])
+    # Duplicate (user, asset) entries are summed by the COO -> CSR conversion
+    collateral = sparse.coo_matrix((collateral_amount[modeled], coords), shape=shape).tocsr()
+    debt = sparse.coo_matrix((debt_amount[modeled], coords), shape=shape).tocsr()
 
+    static = ~modeled
+    static_collateral = np.bincount(user_index[static], weights=collateral_amount[static] * snapshot_price[static], minlength=n_users)
+    static_debt = np.bincount(user_index[static], weights=debt_amount[static] * snapshot_price[static], minlength=n_users)
+
+    book = {
+        'assets': list(assets),
+        'user_ids': user_ids,
+        'collateral': collateral,
+        'debt': debt,
+        'exposure': (collateral - debt).tocsr(),
+        'static_collateral': static_collateral,
+        'static_debt': static_debt
+    }
+    if threshold_index:
+        book['threshold_index'] = build_threshold_index(book)
+    return book
+
+def _row_assets(matrix):
+    # Number of non-zero entries per row, and the column of the last one
+    matrix = matrix.copy()
+    matrix.eliminate_zeros()
+    counts = np.diff(matrix.indptr)
+    last = np.full(len(counts), -1)
+    last[counts > 0] = matrix.indices[matrix.indptr[1:][counts > 0] - 1]
+    return counts, last
+
+def build_threshold_index(book):
+    """
+    Closed-form bad debt for users without static positions whose book is:
+    - debt only, or collateral and debt in the same asset: bad debt is linear in
+      the prices and folds into one weight per asset;
+    - one collateral asset a and one debt asset b: the user is insolvent exactly
+      when P_a / P_b < debt / collateral. Thresholds are sorted per (a, b) pair with
+      suffix sums of collateral and debt, so a scenario's bad debt for the whole
+      group is one binary search.
+    Every other user is kept in `complex_exposure` for the sparse product.
+    """
+    n_assets = len(book['assets'])
+    collateral_count, collateral_asset = _row_assets(book['collateral'])
+    debt_count, debt_asset = _row_assets(book['debt'])
+    collateral_amount = np.asarray(book['collateral'].sum(axis=1)).ravel()
+    debt_amount = np.asarray(book['debt'].sum(axis=1)).ravel()
+
+    no_static = (book['static_collateral'] == 0) & (book['static_debt'] == 0)
+    no_debt = no_static & (debt_count == 0)
+    debt_only = no_static & (collateral_count == 0) & (debt_count > 0)
+    one_each = no_static & (collateral_count == 1) & (debt_count == 1)
+    same_asset = one_each & (collateral_asset == debt_asset)
+    pair = one_each & ~same_asset
+
+    linear = np.asarray(book['debt'][debt_only].sum(axis=0)).ravel()
+    linear += np.bincount(collateral_asset[same_asset], weights=np.maximum(debt_amount - collateral_amount, 0)[same_asset],
+                          minlength=n_assets)
+
+    pairs = []
+    pair_users = np.flatnonzero(pair)
+    pair_codes = collateral_asset[pair_users] * n_assets + debt_asset[pair_users]
+    for code in np.unique(pair_codes):
+        users = pair_users[pair_codes == code]
+        thresholds = debt_amount[users] / collateral_amount[users]
+        order = np.argsort(thresholds)
+        # suffix[i] = total over the users from sorted position i on; suffix[n] = 0
+        suffix_collateral = np.append(np.cumsum(collateral_amount[users][order][::-1])[::-1], 0.0)
+        suffix_debt = np.append(np.cumsum(debt_amount[users][order][::-1])[::-1], 0.0)
+        pairs.append((code // n_assets, code % n_assets, thresholds[order], suffix_collateral, suffix_debt))
+
+    complex_users = ~(no_debt | debt_only | one_each)
+    return {
+        'linear': linear,
+        'pairs': pairs,
+        'complex_exposure': book['exposure'][complex_users],
+        'complex_static_net': (book['static_collateral'] - book['static_debt'])[complex_users]
+    }
+
+def evaluate_threshold_index(prices, index):
+    """
+    Bad debt per scenario of the users covered by build_threshold_index.
+    """
+    bad_debts = prices @ index['linear']
+    for a, b, thresholds, suffix_collateral, suffix_debt in index['pairs']:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = prices[:, a] / prices[:, b]
+        # Users with thresholds above the scenario's price ratio are underwater
+        i = np.searchsorted(thresholds, ratio, side='right')
+        bad_debts += prices[:, b] * suffix_debt[i] - prices[:, a] * suffix_collateral[i]
+    return bad_debts
+
+def evaluate_bad_debt(final_prices_matrix, book, batch_cells=EVAL_BATCH_CELLS):
+    """
+    Bad debt per scenario for a (n_sims x n_assets) matrix of prices.
+    Users covered by the book's threshold index are valued in closed form; the
+    rest are evaluated in batches of at most `batch_cells` scenario x user cells.
+    """
+    prices = np.asarray(final_prices_matrix, dtype=float)
+    n_sims = prices.shape[0]
+
+    index = book.get('threshold_index')
+    if index is not None:
+        bad_debts = evaluate_threshold_index(prices, index)
+        exposure = index['complex_exposure']
+        static_net = index['complex_static_net'][:, None]
+    else:
+        bad_debts = np.zeros(n_sims)
+        exposure = book['exposure']
+        static_net = (book['static_collateral'] - book['static_debt'])[:, None]
+
+    batch_size = max(1, batch_cells // max(exposure.shape[0], 1))
+    for start in range(0, n_sims, batch_size):
+        batch = prices[start:start + batch_size]
+        net_value = exposure @ batch.T
+        net_value += static_net
+        bad_debts[start:start + batch_size] -= np.minimum(net_value, 0.0, out=net_value).sum(axis=0)
+
+    return bad_debts
+
+def market_inputs(market_data):
     assets = market_data['assets']
     latest_prices = market_data['latest_prices']
     annual_vol = market_data['annual_volatility']
@@ -41,61 +266,598 @@ def simulate_bad_debt(active_positions_df, market_data, num_simulations=NUM_SIMU
     sigma_list = [annual_vol.get(a, 0) for a in assets]
     mu_list = [0.0] * len(assets)
 
-    user_groups = active_positions_df.groupby('user_id')
-    users_list = []
-    for user_id, group in user_groups:
-        positions = group.to_dict('records')
-        users_list.append(positions)
-        
+    return assets, S0_list, mu_list, sigma_list, correlation_matrix
+
+def draw_final_prices(S0_list, mu_list, sigma_list, correlation_matrix, num_simulations, mode=SAMPLER_MODE, rng=None,
+                      method=SAMPLING_METHOD, model=SAMPLER_MODEL):
+    if model != "gbm":
+        if mode == "terminal":
+            return correlated_model_terminal_prices(
+                S0_list, mu_list, sigma_list, correlation_matrix,
+                T=1.0, n_sims=num_simulations, model=model, rng=rng, method=method
+            )
+        return correlated_model_paths(
+            S0_list, mu_list, sigma_list, correlation_matrix,
+            T=1.0, n_steps=365, n_sims=num_simulations, model=model, rng=rng, method=method
+        )[-1]
+
+    if mode == "terminal":
+        return correlated_terminal_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix,
+            T=1.0, n_sims=num_simulations, rng=rng, method=method
+        )
+
     paths = correlated_geometric_brownian_motion(
         S0_list, mu_list, sigma_list, correlation_matrix, 
-        T=1.0, n_steps=365, n_sims=num_simulations
+        T=1.0, n_steps=365, n_sims=num_simulations, rng=rng, method=method
     )
+    return paths[-1]
+
+def _model_stream(model):
+    # Scenario cache stream for a price model and factor truncation; full-rank GBM keeps the plain keys
+    stream = {} if model == "gbm" else {'model': model, 'dof': T_COPULA_DOF, 'jumps': [JUMP_INTENSITY, JUMP_MEAN, JUMP_STD]}
+    if FACTOR_VARIANCE_KEPT < 1:
+        stream['factor_variance_kept'] = FACTOR_VARIANCE_KEPT
+    return json.dumps(stream) if stream else ""
+
+def seeded_final_prices(S0_list, mu_list, sigma_list, correlation_matrix, num_simulations, mode, method, seed,
+                        model=SAMPLER_MODEL):
+    """
+    draw_final_prices with np.random.default_rng(seed), served from the scenario
+    cache when SCENARIO_CACHE is on. `seed` is an int or a SeedSequence.
+    """
+    def generate():
+        return draw_final_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix, num_simulations, mode, np.random.default_rng(seed), method, model
+        )
+
+    if not SCENARIO_CACHE:
+        return generate()
+
+    key = scenario_key(S0_list, mu_list, sigma_list, correlation_matrix, 1.0, 365, num_simulations, seed, mode, method,
+                       stream=_model_stream(model))
+    return cached_scenarios(key, generate, SCENARIO_CACHE_DIR)
+
+def simulate_bad_debt(active_positions_df, market_data, num_simulations=NUM_SIMULATIONS, mode=SAMPLER_MODE,
+                      method=SAMPLING_METHOD, seed=SCENARIO_SEED, model=SAMPLER_MODEL):
+
+    assets, S0_list, mu_list, sigma_list, correlation_matrix = market_inputs(market_data)
+
+    book = prepare_position_book(active_positions_df, assets)
     
-    final_prices_matrix = paths[-1]
-    
-    simulation_bad_debts = []
+    if seed is None:
+        final_prices_matrix = draw_final_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix, num_simulations, mode, method=method, model=model
+        )
+    else:
+        final_prices_matrix = seeded_final_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix, num_simulations, mode, method, seed, model
+        )
     
-    for i in range(num_simulations):
-        if i % 100 == 0:
-            print(f"  Simulating scenario {i}/{num_simulations}...")
-        
-        price_map_scenario = {
-            assets[j]: final_prices_matrix[i, j] 
-            for j in range(len(assets))
+    return evaluate_bad_debt(final_prices_matrix, book)
+
+_worker_state = {}
+
+def _init_worker(book, inputs, mode, method, model, capacity, cache):
+    _worker_state.update(book=book, inputs=inputs, mode=mode, method=method, model=model, capacity=capacity, cache=cache)
+
+def _evaluate_chunk(task):
+    chunk_index, seed_sequence, n_chunk = task
+    S0_list, mu_list, sigma_list, correlation_matrix = _worker_state['inputs']
+
+    if _worker_state['cache']:
+        final_prices_matrix = seeded_final_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix, n_chunk, _worker_state['mode'],
+            _worker_state['method'], seed_sequence, _worker_state['model']
+        )
+    else:
+        final_prices_matrix = draw_final_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix, n_chunk, _worker_state['mode'],
+            np.random.default_rng(seed_sequence), _worker_state['method'], _worker_state['model']
+        )
+    chunk_bad_debts = evaluate_bad_debt(final_prices_matrix, _worker_state['book'])
+
+    accumulator = TailAccumulator(_worker_state['capacity'])
+    accumulator.update(chunk_bad_debts)
+    # Only the first chunk is sent back whole, as a sample for plotting
+    return accumulator, chunk_bad_debts if chunk_index == 0 else None
+
+def summarize_accumulator(accumulator, percentile=VAR_PERCENTILE, confidence=CONFIDENCE_LEVEL):
+    """
+    VaR, ES, their `confidence` intervals, mean and max from a TailAccumulator.
+    """
+    return {
+        'var': accumulator.percentile(percentile),
+        'var_ci': accumulator.var_confidence_interval(percentile, confidence),
+        'es': accumulator.expected_shortfall(percentile),
+        'es_ci': accumulator.es_confidence_interval(percentile, confidence),
+        'mean': accumulator.mean(),
+        'max': accumulator.max,
+        'num_simulations': accumulator.count
+    }
+
+def summarize_bad_debt(bad_debts, percentile=VAR_PERCENTILE, confidence=CONFIDENCE_LEVEL):
+    accumulator = TailAccumulator(tail_capacity(len(bad_debts), percentile, confidence))
+    accumulator.update(bad_debts)
+    return summarize_accumulator(accumulator, percentile, confidence)
+
+def map_chunks(evaluate_chunk, num_simulations, chunk_size=CHUNK_SIZE, seed=SCENARIO_SEED, executor=None):
+    """
+    Split a run of `num_simulations` scenarios into chunks of at most `chunk_size`,
+    each drawing from its own SeedSequence child of `seed`, and yield
+    evaluate_chunk((chunk index, SeedSequence, chunk size)) in chunk order. Every
+    chunked mode goes through here, so a given seed and chunk_size draw the same
+    scenarios in every mode. With `executor` the chunks are mapped across its workers.
+    """
+    chunk_sizes = [min(chunk_size, num_simulations - start) for start in range(0, num_simulations, chunk_size)]
+    tasks = list(zip(range(len(chunk_sizes)), np.random.SeedSequence(seed).spawn(len(chunk_sizes)), chunk_sizes))
+
+    results = map(evaluate_chunk, tasks) if executor is None else executor.map(evaluate_chunk, tasks)
+    for i, result in enumerate(results):
+        if len(tasks) > 1:
+            print(f"  Evaluated chunk {i + 1}/{len(tasks)}...")
+        yield result
+
+def simulate_bad_debt_streaming(active_positions_df, market_data, num_simulations=NUM_SIMULATIONS,
+                                chunk_size=CHUNK_SIZE, mode=SAMPLER_MODE, seed=SCENARIO_SEED, percentile=VAR_PERCENTILE,
+                                n_workers=N_WORKERS, method=SAMPLING_METHOD, confidence=CONFIDENCE_LEVEL,
+                                model=SAMPLER_MODEL, cache_chunks=CACHE_STREAMING_CHUNKS):
+    """
+    Generate and evaluate scenarios in chunks of `chunk_size`, keeping only running
+    statistics, the upper tail needed for the VaR / ES and their confidence
+    intervals, and a quantile sketch of the rest (tail_stats.TailAccumulator).
+    Peak memory is set by chunk_size, not num_simulations.
+
+    Every chunk draws from its own SeedSequence child of `seed`, and chunk results
+    are merged in chunk order, so a given seed gives bit-identical results for any
+    n_workers. With n_workers > 1 chunks are spread across a process pool.
+    With `cache_chunks` the chunks of a seeded run go through the scenario cache.
+    Returns: dict from summarize_accumulator plus the first chunk as a sample
+    """
+    assets, S0_list, mu_list, sigma_list, correlation_matrix = market_inputs(market_data)
+
+    book = prepare_position_book(active_positions_df, assets)
+
+    capacity = tail_capacity(num_simulations, percentile, confidence)
+    # Chunks of an unseeded run are never drawn again, so they are not cached
+    initargs = (book, (S0_list, mu_list, sigma_list, correlation_matrix), mode, method, model, capacity,
+                cache_chunks and seed is not None)
+
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=initargs)
+    else:
+        executor = None
+        _init_worker(*initargs)
+
+    accumulator = TailAccumulator(capacity)
+    sample = None
+    try:
+        for chunk_accumulator, chunk_sample in map_chunks(_evaluate_chunk, num_simulations, chunk_size, seed, executor):
+            accumulator.merge(chunk_accumulator)
+            if chunk_sample is not None:
+                sample = chunk_sample
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return dict(summarize_accumulator(accumulator, percentile, confidence), sample=sample)
+
+def pilot_shift(book, S0_list, mu_list, sigma_list, correlation_matrix, n_pilot=IS_PILOT_SIMULATIONS,
+                percentile=IS_PILOT_PERCENTILE, rng=None):
+    """
+    Mean uncorrelated shock of the scenarios at or beyond `percentile` of a small plain pilot run.
+    Unlike the eigenvector shift, this follows whatever moves drive the book's tail
+    (e.g. an LST depeg against its underlying, or a rally in borrowed assets).
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    L = correlation_factor(correlation_matrix)
+
+    Z_uncorr = rng.normal(0, 1, size=(n_pilot, L.shape[1]))
+    bad_debts = evaluate_bad_debt(terminal_prices_from_shocks(S0_list, mu_list, sigma_list, L, 1.0, Z_uncorr), book)
+
+    tail = bad_debts >= np.percentile(bad_debts, percentile)
+    return Z_uncorr[tail].mean(axis=0)
+
+def simulate_bad_debt_importance(active_positions_df, market_data, num_simulations=NUM_SIMULATIONS, shift_magnitude=IS_SHIFT,
+                                 seed=None, method=SAMPLING_METHOD, percentile=VAR_PERCENTILE, shift_method=IS_SHIFT_METHOD,
+                                 model=SAMPLER_MODEL):
+    """
+    Importance-sampled bad-debt simulation. Terminal shocks are shifted towards the
+    scenarios that drive the tail (see IS_SHIFT_METHOD) and every scenario carries
+    its likelihood-ratio weight, so VaR and expected shortfall come from weighted
+    quantiles with most scenarios landing in the tail.
+    `shift_magnitude` only applies to the 'eigen' shift. The likelihood ratios are
+    those of shifted GBM shocks, so only model='gbm' is supported.
+    Returns: dict with var, es, mean, max, effective_sample_size, bad_debts and weights;
+    max is the largest of the shifted draws, which over-represent the tail
+    """
+    if model != "gbm":
+        raise ValueError(f"Importance sampling only supports the 'gbm' model, not '{model}'")
+
+    assets, S0_list, mu_list, sigma_list, correlation_matrix = market_inputs(market_data)
+
+    book = prepare_position_book(active_positions_df, assets)
+    rng = np.random.default_rng(seed)
+
+    if shift_method == "pilot":
+        shift = pilot_shift(book, S0_list, mu_list, sigma_list, correlation_matrix, rng=rng)
+    else:
+        shift = crash_shift(correlation_matrix, shift_magnitude)
+
+    final_prices_matrix, weights = importance_sampled_terminal_prices(
+        S0_list, mu_list, sigma_list, correlation_matrix,
+        T=1.0, n_sims=num_simulations, shift=shift, rng=rng, method=method
+    )
+    bad_debts = evaluate_bad_debt(final_prices_matrix, book)
+
+    var, expected_shortfall = weighted_tail_stats(bad_debts, weights, percentile)
+
+    return {
+        'var': var,
+        'es': expected_shortfall,
+        'mean': np.mean(weights * bad_debts),
+        'max': np.max(bad_debts),
+        'effective_sample_size': weights.sum()**2 / np.sum(weights**2),
+        'bad_debts': bad_debts,
+        'weights': weights
+    }
+
+def attribute_bad_debt(active_positions_df, market_data, num_simulations=NUM_SIMULATIONS, seed=SCENARIO_SEED,
+                       method=SAMPLING_METHOD, percentile=VAR_PERCENTILE):
+    """
+    Simulate terminal bad debt and cache the worst scenarios for attribution and
+    what-if questions (see attribution.py), e.g.
+    component_attribution(cache) or what_if_remove_users(cache, [user_id]).
+    Returns: (bad_debts, attribution cache)
+    """
+    assets, S0_list, mu_list, sigma_list, correlation_matrix = market_inputs(market_data)
+
+    book = prepare_position_book(active_positions_df, assets)
+
+    if seed is None:
+        final_prices_matrix = draw_final_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix, num_simulations, "terminal",
+            np.random.default_rng(), method
+        )
+    else:
+        final_prices_matrix = seeded_final_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix, num_simulations, "terminal", method, seed
+        )
+    bad_debts = evaluate_bad_debt(final_prices_matrix, book)
+
+    return bad_debts, build_attribution(book, final_prices_matrix, bad_debts, percentile)
+
+def simulate_bad_debt_liquidations(active_positions_df, market_data, num_simulations=NUM_SIMULATIONS, chunk_size=CHUNK_SIZE,
+                                   seed=None, method=SAMPLING_METHOD, block_steps=LIQUIDATION_BLOCK_STEPS,
+                                   model=SAMPLER_MODEL):
+    """
+    Path-dependent bad debt with liquidations along daily paths (see
+    liquidation.simulate_liquidations). Scenarios are run chunk by chunk, each
+    from its own SeedSequence child of `seed`.
+    Returns: dict with bad_debts and liquidations (per scenario)
+    """
+    assets, S0_list, mu_list, sigma_list, correlation_matrix = market_inputs(market_data)
+
+    book = liquidation_book(prepare_position_book(active_positions_df, assets))
+
+    def evaluate_chunk(task):
+        _, seed_sequence, n_chunk = task
+        price_blocks = correlated_gbm_blocks(
+            S0_list, mu_list, sigma_list, correlation_matrix,
+            T=1.0, n_steps=365, n_sims=n_chunk, block_steps=block_steps,
+            rng=np.random.default_rng(seed_sequence), method=method, model=model
+        )
+        return simulate_liquidations(book, price_blocks, n_chunk)
+
+    bad_debts, liquidations = zip(*map_chunks(evaluate_chunk, num_simulations, chunk_size, seed))
+
+    return {
+        'bad_debts': np.concatenate(bad_debts),
+        'liquidations': np.concatenate(liquidations)
+    }
+
+def simulate_bad_debt_horizons(active_positions_df, market_data, horizons_days=HORIZONS_DAYS,
+                               num_simulations=NUM_SIMULATIONS, chunk_size=CHUNK_SIZE, mode=SAMPLER_MODE,
+                               method=SAMPLING_METHOD, seed=SCENARIO_SEED, percentile=VAR_PERCENTILE,
+                               confidence=CONFIDENCE_LEVEL, model=SAMPLER_MODEL):
+    """
+    Asset VaR and protocol bad debt at every horizon in `horizons_days` from one
+    set of draws. Each chunk generates its increments once (one per gap
+    between horizons in 'terminal' mode, daily in 'paths' mode) and every horizon
+    reads its prices off the same paths, so the horizons are consistent with
+    each other. Models other than 'gbm' go through log_increments. Asset VaR is
+    the price loss (share of the current price) at the (100 - percentile) price quantile.
+    Returns: dict with `table`, a DataFrame with one row per horizon, and `summaries`,
+    the summarize_accumulator of every horizon's bad debt (plus the first chunk's
+    bad debts as `sample`) keyed by horizon in days
+    """
+    assets, S0_list, mu_list, sigma_list, correlation_matrix = market_inputs(market_data)
+
+    book = prepare_position_book(active_positions_df, assets)
+
+    days = np.array(sorted(set(horizons_days)))
+    times = (days / 365.0)[:, None, None]
+    S0 = np.asarray(S0_list, dtype=float)
+    mu = np.asarray(mu_list, dtype=float)
+    sigma = np.asarray(sigma_list, dtype=float)
+
+    capacity = tail_capacity(num_simulations, percentile, confidence)
+    bad_debt_accumulators = [TailAccumulator(capacity) for _ in days]
+    loss_accumulators = [[TailAccumulator(capacity) for _ in assets] for _ in days]
+
+    def evaluate_chunk(task):
+        _, seed_sequence, n_chunk = task
+        rng = np.random.default_rng(seed_sequence)
+        if model != "gbm":
+            if mode == "terminal":
+                return correlated_model_at_horizons(S0, mu, sigma, correlation_matrix, days / 365.0, n_chunk, model, rng,
+                                                    method)
+            return correlated_model_paths(S0, mu, sigma, correlation_matrix, days[-1] / 365.0, days[-1], n_chunk, model,
+                                          rng, method)[days]
+
+        if mode == "terminal":
+            W = correlated_brownian_at_horizons(correlation_matrix, days / 365.0, n_chunk, rng, method)
+        else:
+            W = correlated_brownian_paths(correlation_matrix, days[-1] / 365.0, days[-1], n_chunk, rng, method)[days]
+        return gbm_from_brownian(S0, mu, sigma, times, W)
+
+    samples = [None] * len(days)
+    for prices in map_chunks(evaluate_chunk, num_simulations, chunk_size, seed):
+        for h in range(len(days)):
+            bad_debts = evaluate_bad_debt(prices[h], book)
+            bad_debt_accumulators[h].update(bad_debts)
+            if samples[h] is None:
+                samples[h] = bad_debts
+            losses = 1 - prices[h] / S0
+            for a in range(len(assets)):
+                loss_accumulators[h][a].update(losses[:, a])
+
+    rows = []
+    summaries = {}
+    for h, horizon in enumerate(days):
+        summary = summarize_accumulator(bad_debt_accumulators[h], percentile, confidence)
+        summaries[int(horizon)] = dict(summary, sample=samples[h])
+        row = {
+            'horizon_days': horizon,
+            'bad_debt_var': summary['var'],
+            'bad_debt_es': summary['es'],
+            'mean_bad_debt': summary['mean']
         }
-        
-        total_bad_debt_scenario = 0.0
-        
-        for user_positions in users_list:
-            collateral, debt, net_value = calculate_user_equity(user_positions, price_map_scenario)
-            
-            if net_value < 0:
-                total_bad_debt_scenario += abs(net_value)
-                
-        simulation_bad_debts.append(total_bad_debt_scenario)
-    
-    return simulation_bad_debts
+        for a, asset in enumerate(assets):
+            row[f'{asset}_var'] = loss_accumulators[h][a].percentile(percentile)
+        rows.append(row)
+    return {'table': pd.DataFrame(rows), 'summaries': summaries}
+
+def stressed_market_data(market_data, vol_scale=1.0, correlation_blend=0.0):
+    """
+    Copy of `market_data` with every volatility scaled by `vol_scale` and the
+    correlation matrix blended towards all-ones by `correlation_blend` (0 keeps
+    it, 1 moves every asset together), for vol / correlation regime grids.
+    """
+    correlation_matrix = np.array(market_data['correlation_matrix'])
+    correlation_matrix = (1 - correlation_blend) * correlation_matrix + correlation_blend * np.ones_like(correlation_matrix)
+    np.fill_diagonal(correlation_matrix, 1.0)
+
+    return dict(
+        market_data,
+        annual_volatility={asset: vol * vol_scale for asset, vol in market_data['annual_volatility'].items()},
+        correlation_matrix=correlation_matrix.tolist()
+    )
+
+def shared_shocks(n_assets, num_simulations, mode=SAMPLER_MODE, rng=None, method=SAMPLING_METHOD):
+    """
+    Uncorrelated standard normal shocks behind the 1-year terminal prices. In 'paths'
+    mode they are the normalised sum of the daily shocks, i.e. where a daily path
+    with the same draws ends; the correlation is applied afterwards, so one set of
+    shocks can serve any correlation matrix (a reduced-rank factor uses the leading
+    L.shape[1] columns).
+    Returns: (num_simulations x n_assets)
+    """
+    if mode == "terminal":
+        return standard_normals((num_simulations, n_assets), rng=rng, method=method)
+    return standard_normals((365, num_simulations, n_assets), sim_axis=1, rng=rng, method=method).sum(axis=0) / np.sqrt(365)
+
+def _aligned_inputs(market_data, assets):
+    # market_inputs reordered to the book's assets
+    snapshot_assets, S0_list, mu_list, sigma_list, correlation_matrix = market_inputs(market_data)
+    missing = [asset for asset in assets if asset not in snapshot_assets]
+    if missing:
+        raise ValueError(f"Market data is missing the book's assets: {missing}")
+
+    order = [snapshot_assets.index(asset) for asset in assets]
+    return (np.asarray(S0_list, dtype=float)[order], np.asarray(mu_list, dtype=float)[order],
+            np.asarray(sigma_list, dtype=float)[order], correlation_matrix[np.ix_(order, order)])
+
+def revalue_market_grid(book, market_data_grid, labels=None, num_simulations=NUM_SIMULATIONS, chunk_size=CHUNK_SIZE,
+                        mode=SAMPLER_MODE, method=SAMPLING_METHOD, seed=SCENARIO_SEED, percentile=VAR_PERCENTILE,
+                        confidence=CONFIDENCE_LEVEL, model=SAMPLER_MODEL):
+    """
+    Bad debt of one position book (from prepare_position_book) under every market
+    input in `market_data_grid`: dicts shaped like MARKET_DATA_FILE, e.g. historical
+    stress days or regimes from stressed_market_data. All inputs share the same
+    uncorrelated shocks (common random numbers), so differences between rows
+    come from the inputs rather than sampling noise, and each chunk's scenarios
+    for the whole grid are stacked and evaluated in one pass. The shared shocks are
+    Gaussian, so only model='gbm' is supported.
+    Returns: DataFrame with one row per input
+    """
+    if model != "gbm":
+        raise ValueError(f"Market grids only support the 'gbm' model, not '{model}'")
+
+    assets = book['assets']
+    inputs = [_aligned_inputs(market_data, assets) for market_data in market_data_grid]
+    factors = [correlation_factor(correlation_matrix) for _, _, _, correlation_matrix in inputs]
+    labels = list(range(len(inputs))) if labels is None else list(labels)
+
+    capacity = tail_capacity(num_simulations, percentile, confidence)
+    accumulators = [TailAccumulator(capacity) for _ in inputs]
+
+    def evaluate_chunk(task):
+        _, seed_sequence, n_chunk = task
+        Z_uncorr = shared_shocks(len(assets), n_chunk, mode, np.random.default_rng(seed_sequence), method)
+
+        final_prices = np.concatenate([
+            terminal_prices_from_shocks(S0, mu, sigma, L, 1.0, Z_uncorr[:, :L.shape[1]])
+            for (S0, mu, sigma, _), L in zip(inputs, factors)
+        ])
+        return evaluate_bad_debt(final_prices, book).reshape(len(inputs), n_chunk)
+
+    for bad_debts in map_chunks(evaluate_chunk, num_simulations, chunk_size, seed):
+        for accumulator, input_bad_debts in zip(accumulators, bad_debts):
+            accumulator.update(input_bad_debts)
+
+    rows = []
+    for label, accumulator in zip(labels, accumulators):
+        summary = summarize_accumulator(accumulator, percentile, confidence)
+        rows.append({
+            'label': label,
+            'var': summary['var'],
+            'var_lower': summary['var_ci'][0],
+            'var_upper': summary['var_ci'][1],
+            'es': summary['es'],
+            'es_lower': summary['es_ci'][0],
+            'es_upper': summary['es_ci'][1],
+            'mean': summary['mean'],
+            'max': summary['max']
+        })
+    return pd.DataFrame(rows)
+
+def load_price_history(path=PRICE_HISTORY_FILE):
+    return pd.read_csv(path, index_col='date', parse_dates=['date'])
+
+def historical_scenarios(price_history, assets, S0_list, window_days=HISTORICAL_WINDOW_DAYS):
+    """
+    Current prices moved by every overlapping `window_days` joint return window of
+    `price_history` (one row per day): S0 * P[t + window_days] / P[t] for each start t.
+    Returns: (scenario prices (n_windows x n_assets), window start dates)
+    """
+    missing = [asset for asset in assets if asset not in price_history.columns]
+    if missing:
+        raise ValueError(f"Price history is missing the book's assets: {missing}")
+    if not 0 < window_days < len(price_history):
+        raise ValueError(f"Window of {window_days} days needs more than {window_days} days of price history, "
+                         f"got {len(price_history)}")
+
+    prices = price_history[assets].to_numpy(dtype=float)
+    returns = prices[window_days:] / prices[:-window_days]
+    return np.asarray(S0_list, dtype=float) * returns, price_history.index[:-window_days]
+
+def simulate_bad_debt_historical(active_positions_df, market_data, price_history, window_days=HISTORICAL_WINDOW_DAYS,
+                                 percentile=VAR_PERCENTILE):
+    """
+    Empirical bad debt: the current book revalued under every historical
+    `window_days` window (historical_scenarios), all in one evaluate_bad_debt pass.
+    Windows overlap, so the confidence intervals of summarize_bad_debt do not apply.
+    Returns: dict with var, es, mean, max, bad_debts, window_starts and worst_window (start date)
+    """
+    assets, S0_list, mu_list, sigma_list, correlation_matrix = market_inputs(market_data)
+
+    book = prepare_position_book(active_positions_df, assets)
+
+    scenarios, window_starts = historical_scenarios(price_history, assets, S0_list, window_days)
+    bad_debts = evaluate_bad_debt(scenarios, book)
+    summary = summarize_bad_debt(bad_debts, percentile)
+
+    return {
+        'var': summary['var'],
+        'es': summary['es'],
+        'mean': summary['mean'],
+        'max': summary['max'],
+        'bad_debts': bad_debts,
+        'window_starts': window_starts,
+        'worst_window': window_starts[np.argmax(bad_debts)]
+    }
+
+def var_standard_error(active_positions_df, market_data, num_simulations=NUM_SIMULATIONS, method=SAMPLING_METHOD,
+                       n_replications=SE_REPLICATIONS, mode=SAMPLER_MODE, seed=None, percentile=VAR_PERCENTILE):
+    """
+    Standard error of the VaR estimate at `num_simulations`, measured from
+    independent replications (independent scrambles for Sobol).
+    Returns: (mean VaR across replications, standard error of a single run)
+    """
+    assets, S0_list, mu_list, sigma_list, correlation_matrix = market_inputs(market_data)
+
+    book = prepare_position_book(active_positions_df, assets)
+
+    estimates = []
+    for seed_sequence in np.random.SeedSequence(seed).spawn(n_replications):
+        rng = np.random.default_rng(seed_sequence)
+        final_prices_matrix = draw_final_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix, num_simulations, mode, rng, method
+        )
+        estimates.append(np.percentile(evaluate_bad_debt(final_prices_matrix, book), percentile))
+
+    return np.mean(estimates), np.std(estimates, ddof=1)
+
+def compare_variance_reduction(active_positions_df, market_data, num_simulations=NUM_SIMULATIONS,
+                               methods=("pseudo", "antithetic", "sobol"), n_replications=SE_REPLICATIONS, seed=None):
+    """
+    VaR standard error of each sampling method relative to plain pseudo-random draws.
+    `sims_factor` is how many times fewer scenarios a method needs for the same precision.
+    """
+    rows = []
+    for method in methods:
+        mean_var, std_error = var_standard_error(
+            active_positions_df, market_data, num_simulations, method, n_replications, seed=seed
+        )
+        rows.append({'method': method, 'var_mean': mean_var, 'var_std_error': std_error})
+
+    df = pd.DataFrame(rows)
+    baseline = df.loc[df['method'] == 'pseudo', 'var_std_error']
+    if not baseline.empty:
+        df['se_ratio'] = df['var_std_error'] / baseline.iloc[0]
+        df['sims_factor'] = 1.0 / df['se_ratio']**2
+    return df
 
 def main():
-    if not os.path.exists(ACTIVE_POSITIONS_FILE):
-        print(f"Error: {ACTIVE_POSITIONS_FILE} not found. Run bad_debt.py first.")
+    if not os.path.exists(POSITION_STORE_DIR) and not os.path.exists(ACTIVE_POSITIONS_FILE):
+        print(f"Error: {POSITION_STORE_DIR} not found. Run bad_debt.py first.")
         return
         
     if not os.path.exists(MARKET_DATA_FILE):
         print(f"Error: {MARKET_DATA_FILE} not found. Run fetch_market_data.py first.")
         return
 
-    active_df = pd.read_csv(ACTIVE_POSITIONS_FILE)
+    if os.path.exists(POSITION_STORE_DIR):
+        positions = load_position_store(POSITION_STORE_DIR)
+    else:
+        positions = pd.read_csv(ACTIVE_POSITIONS_FILE)
     
     with open(MARKET_DATA_FILE, 'r') as f:
         market_data = json.load(f)
         
-    bad_debt_distribution = simulate_bad_debt(active_df, market_data, NUM_SIMULATIONS)
+    bad_debt_weights = None
+    horizons = None
+    if IMPORTANCE_SAMPLING:
+        results = simulate_bad_debt_importance(positions, market_data, NUM_SIMULATIONS, seed=SCENARIO_SEED)
+        bad_debt_distribution = results['bad_debts']
+        # Shifted draws only describe the real loss distribution through their weights
+        bad_debt_weights = results['weights']
+    elif ATTRIBUTION:
+        bad_debt_distribution, attribution = attribute_bad_debt(positions, market_data, NUM_SIMULATIONS, seed=SCENARIO_SEED)
+        results = summarize_bad_debt(bad_debt_distribution)
+    elif PATH_LIQUIDATIONS:
+        liquidation_results = simulate_bad_debt_liquidations(positions, market_data, NUM_SIMULATIONS, seed=SCENARIO_SEED)
+        bad_debt_distribution = liquidation_results['bad_debts']
+        results = summarize_bad_debt(bad_debt_distribution)
+        print(f"Average liquidations per scenario: {liquidation_results['liquidations'].mean():,.1f}")
+    elif HORIZONS_DAYS:
+        # One run for the headline and the horizon table, so the 365-day row is the headline
+        horizon_results = simulate_bad_debt_horizons(positions, market_data, set(HORIZONS_DAYS) | {365}, NUM_SIMULATIONS,
+                                                     seed=SCENARIO_SEED)
+        horizons = horizon_results['table']
+        results = horizon_results['summaries'][365]
+        bad_debt_distribution = results['sample']
+    elif NUM_SIMULATIONS > CHUNK_SIZE or N_WORKERS > 1:
+        results = simulate_bad_debt_streaming(positions, market_data, NUM_SIMULATIONS, CHUNK_SIZE, seed=SCENARIO_SEED,
+                                              n_workers=N_WORKERS)
+        bad_debt_distribution = results['sample']
+    else:
+        bad_debt_distribution = simulate_bad_debt(positions, market_data, NUM_SIMULATIONS, method=SAMPLING_METHOD,
+                                                  seed=SCENARIO_SEED)
+        results = summarize_bad_debt(bad_debt_distribution)
     
-    bad_debt_var = np.percentile(bad_debt_distribution, VAR_PERCENTILE)
-    average_bad_debt = np.mean(bad_debt_distribution)
-    max_bad_debt = np.max(bad_debt_distribution)
+    bad_debt_var = results['var']
     
     print("\n" + "="*50)
     print("AAVE VaR ANALYSIS RESULTS (CORRELATED)")
@@ -105,12 +867,54 @@ def main():
     print(f"Time Horizon: 1 Year (365 Days)")
     print("-" * 30)
     print(f"VaR (99.9%): ${bad_debt_var:,.2f}")
-    print(f"Average Bad Debt: ${average_bad_debt:,.2f}")
-    print(f"Max Bad Debt observed: ${max_bad_debt:,.2f}")
+    if 'var_ci' in results:
+        print(f"  {CONFIDENCE_LEVEL:.0%} interval: ${results['var_ci'][0]:,.2f} - ${results['var_ci'][1]:,.2f}")
+    print(f"Expected Shortfall (99.9%): ${results['es']:,.2f}")
+    if 'es_ci' in results:
+        print(f"  {CONFIDENCE_LEVEL:.0%} interval: ${results['es_ci'][0]:,.2f} - ${results['es_ci'][1]:,.2f}")
+    print(f"Average Bad Debt: ${results['mean']:,.2f}")
+    if IMPORTANCE_SAMPLING:
+        print(f"Max Bad Debt in the shifted draws (not the real distribution): ${results['max']:,.2f}")
+        print(f"Effective sample size: {results['effective_sample_size']:,.0f}")
+        if results['effective_sample_size'] < IS_MIN_EFFECTIVE_SAMPLE_SIZE:
+            print(f"Warning: effective sample size is below {IS_MIN_EFFECTIVE_SAMPLE_SIZE:,}, so a few draws carry "
+                  f"most of the weight and the VaR / ES above cannot be trusted. Lower IS_SHIFT or use "
+                  f"IS_SHIFT_METHOD = 'pilot'.")
+    else:
+        print(f"Max Bad Debt observed: ${results['max']:,.2f}")
     print("="*50)
     
+    if ATTRIBUTION:
+        print("\nVaR / ES contributions by asset:")
+        print(component_attribution(attribution).to_string(index=False, float_format=lambda x: f"{x:,.0f}"))
+        print(f"\nTop {ATTRIBUTION_TOP_USERS} users by ES contribution:")
+        print(user_attribution(attribution, ATTRIBUTION_TOP_USERS).to_string(index=False, float_format=lambda x: f"{x:,.0f}"))
+    
+    if HISTORICAL_REPLAY:
+        if os.path.exists(PRICE_HISTORY_FILE):
+            historical = simulate_bad_debt_historical(positions, market_data, load_price_history(), HISTORICAL_WINDOW_DAYS)
+            print(f"\nHistorical replay ({len(historical['bad_debts'])} overlapping {HISTORICAL_WINDOW_DAYS}-day windows):")
+            print(f"Empirical VaR ({VAR_PERCENTILE}%): ${historical['var']:,.2f}")
+            print(f"Empirical ES ({VAR_PERCENTILE}%): ${historical['es']:,.2f}")
+            print(f"Worst window: ${historical['max']:,.2f} starting {historical['worst_window'].date()}")
+        else:
+            print(f"\nSkipping historical replay: {PRICE_HISTORY_FILE} not found. Run fetch_market_data.py first.")
+    
+    if HORIZONS_DAYS:
+        print("\nBad debt and asset VaR (price loss) by horizon, from one set of draws:")
+        if horizons is None:
+            horizons = simulate_bad_debt_horizons(positions, market_data, HORIZONS_DAYS, NUM_SIMULATIONS,
+                                                  seed=SCENARIO_SEED)['table']
+        asset_columns = [column for column in horizons.columns if column.endswith('_var') and column != 'bad_debt_var']
+        print(horizons.to_string(index=False, formatters={column: '{:.1%}'.format for column in asset_columns},
+                                 float_format=lambda x: f"{x:,.0f}"))
+    
+    if REPORT_STANDARD_ERROR:
+        print("\nVaR standard error by sampling method:")
+        print(compare_variance_reduction(positions, market_data, min(NUM_SIMULATIONS, CHUNK_SIZE)).to_string(index=False))
+    
     plt.figure(figsize=(10, 6))
-    plt.hist(bad_debt_distribution, bins=50, color='royalblue', alpha=0.7)
+    plt.hist(bad_debt_distribution, bins=50, weights=bad_debt_weights, color='royalblue', alpha=0.7)
     plt.axvline(bad_debt_var, color='red', linestyle='dashed', linewidth=2, label=f'VaR 99.9%: ${bad_debt_var:,.0f}')
     plt.title('Distribution of Protocol Bad Debt (Correlated Monte Carlo)')
     plt.xlabel('Bad Debt ($)')
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from tail_stats import tail_capacity
+
+# Share of the worst scenarios kept for attribution and what-if questions
+CACHE_FRACTION = 0.05
+# Order statistics on each side of the VaR scenario averaged for the VaR contributions
+VAR_WINDOW = 5
+EVAL_BATCH_CELLS = 5_000_000
+
+def build_attribution(book, prices, bad_debts, percentile, cache_fraction=CACHE_FRACTION, batch_cells=EVAL_BATCH_CELLS):
+    """
+    Cache the worst scenarios of a simulation with everything needed to attribute
+    their bad debt: a sparse (scenario x user) shortfall matrix and, per scenario,
+    the debt and collateral value of the underwater users in every asset.
+    A scenario's bad debt is exactly
+    sum(debt_contribution) - sum(collateral_contribution) + static_contribution,
+    and also the sum of its user shortfalls, so VaR and ES split into assets and
+    users without re-simulating. `book` comes from analyze_var.prepare_position_book.
+    Returns: dict (see the keys below)
+    """
+    bad_debts = np.asarray(bad_debts, dtype=float)
+    n = bad_debts.size
+    m = min(n, max(tail_capacity(n, percentile) + VAR_WINDOW, int(np.ceil(cache_fraction * n))))
+
+    order = np.argsort(bad_debts, kind='stable')[::-1]
+    cached = order[:m]
+    cached_prices = np.asarray(prices, dtype=float)[cached]
+
+    static_net = (book['static_collateral'] - book['static_debt'])[:, None]
+    batch_size = max(1, batch_cells // max(len(book['user_ids']), 1))
+
+    shortfall_batches = []
+    for start in range(0, m, batch_size):
+        net_value = book['exposure'] @ cached_prices[start:start + batch_size].T
+        net_value += static_net
+        shortfall_batches.append(sparse.csr_matrix(-np.minimum(net_value, 0.0, out=net_value).T))
+    shortfall = sparse.vstack(shortfall_batches).tocsr()
+
+    underwater = (shortfall > 0).astype(float)
+
+    return {
+        'assets': book['assets'],
+        'user_ids': book['user_ids'],
+        'num_simulations': n,
+        'percentile': percentile,
+        'scenarios': cached,
+        'bad_debts': bad_debts[cached],
+        # No scenario outside the cache has more bad debt than this
+        'floor': bad_debts[order[m]] if m < n else 0.0,
+        'shortfall': shortfall,
+        'debt_contribution': (underwater @ book['debt']).toarray() * cached_prices,
+        'collateral_contribution': (underwater @ book['collateral']).toarray() * cached_prices,
+        'static_contribution': underwater @ (book['static_debt'] - book['static_collateral'])
+    }
+
+def _tail_positions(n, percentile):
+    # Positions (in descending order) of the two order statistics np.percentile interpolates
+    # between, their interpolation weight, and the number of scenarios in the ES tail
+    h = (n - 1) * percentile / 100.0
+    lo = int(np.floor(h))
+    hi = min(lo + 1, n - 1)
+    n_tail = max(1, int(np.ceil(n * (1 - percentile / 100.0))))
+    return n - 1 - lo, n - 1 - hi, h - lo, n_tail
+
+def tail_stats(losses, n, percentile, floor=0.0):
+    """
+    VaR (as np.percentile) and ES (mean of the worst ceil(n * (1 - q)) scenarios)
+    from the cached losses of the worst scenarios of n.
+    Raises ValueError if the tail could include scenarios outside the cache,
+    i.e. the tail reaches down to `floor`.
+    """
+    losses = np.sort(np.asarray(losses, dtype=float))[::-1]
+    i_lo, i_hi, frac, n_tail = _tail_positions(n, percentile)
+
+    if max(i_lo, n_tail - 1) >= losses.size or (losses.size < n and losses[max(i_lo, n_tail - 1)] < floor):
+        raise ValueError("The tail is not covered by the cached scenarios; raise CACHE_FRACTION")
+
+    var = losses[i_lo] + frac * (losses[i_hi] - losses[i_lo])
+    return var, losses[:n_tail].mean()
+
+def _var_window(cache):
+    # Scenarios around the VaR order statistic, and the factor that rescales their mean
+    # loss to the VaR: contributions are E[component | loss ~ VaR], adding up to the VaR
+    i_lo, i_hi, frac, n_tail = _tail_positions(cache['num_simulations'], cache['percentile'])
+    var, _ = tail_stats(cache['bad_debts'], cache['num_simulations'], cache['percentile'], cache['floor'])
+
+    window = np.arange(max(0, i_hi - VAR_WINDOW), i_lo + VAR_WINDOW + 1)
+    window_loss = cache['bad_debts'][window].mean()
+    return window, (var / window_loss if window_loss > 0 else 0.0), n_tail
+
+def component_attribution(cache):
+    """
+    Euler (component) VaR and ES attribution by asset. For each asset, `debt` is
+    the value of the debt of underwater users and `collateral` the value of their
+    collateral (a negative contribution); `net` sums to the total VaR / ES
+    together with the `static` row (positions outside the modeled assets).
+    """
+    values = np.hstack([
+        cache['debt_contribution'],
+        -cache['collateral_contribution'],
+        cache['static_contribution'][:, None]
+    ])
+    window, var_scale, n_tail = _var_window(cache)
+    var_contribution = values[window].mean(axis=0) * var_scale
+    es_contribution = values[:n_tail].mean(axis=0)
+
+    n_assets = len(cache['assets'])
+    rows = []
+    for j, asset in enumerate(cache['assets']):
+        rows.append({
+            'asset': asset,
+            'var_debt': var_contribution[j],
+            'var_collateral': var_contribution[n_assets + j],
+            'var_net': var_contribution[j] + var_contribution[n_assets + j],
+            'es_debt': es_contribution[j],
+            'es_collateral': es_contribution[n_assets + j],
+            'es_net': es_contribution[j] + es_contribution[n_assets + j]
+        })
+    rows.append({
+        'asset': 'static',
+        'var_debt': 0.0, 'var_collateral': 0.0, 'var_net': var_contribution[-1],
+        'es_debt': 0.0, 'es_collateral': 0.0, 'es_net': es_contribution[-1]
+    })
+    return pd.DataFrame(rows)
+
+def user_attribution(cache, top=20):
+    """
+    Euler VaR and ES contributions of the `top` users by ES contribution.
+    A user's contribution is their shortfall (debt - collateral when underwater).
+    """
+    window, var_scale, n_tail = _var_window(cache)
+    shortfall = cache['shortfall']
+    var_contribution = np.asarray(shortfall[window].mean(axis=0)).ravel() * var_scale
+    es_contribution = np.asarray(shortfall[:n_tail].mean(axis=0)).ravel()
+
+    users = np.argsort(es_contribution)[::-1][:top]
+    return pd.DataFrame({
+        'user_id': np.asarray(cache['user_ids'])[users].astype(str),
+        'var_contribution': var_contribution[users],
+        'es_contribution': es_contribution[users]
+    })
+
+def what_if_remove_users(cache, remove_ids):
+    """
+    VaR and ES with the given users removed from the book. Exact: every cached
+    scenario loses exactly those users' shortfalls, and scenarios outside the
+    cache can only lose bad debt too.
+    Returns: (var, es)
+    """
+    columns = np.flatnonzero(np.isin(np.asarray(cache['user_ids']).astype(str), np.asarray(remove_ids).astype(str)))
+    removed = np.asarray(cache['shortfall'][:, columns].sum(axis=1)).ravel()
+    return tail_stats(cache['bad_debts'] - removed, cache['num_simulations'], cache['percentile'], cache['floor'])
+
+def what_if_scale_asset(cache, asset, collateral_factor=1.0, debt_factor=1.0):
+    """
+    First-order VaR and ES after scaling every position's collateral and/or debt
+    in `asset`. Each cached scenario's bad debt moves by the Euler derivative,
+    i.e. the asset's collateral and debt contribution of the users already
+    underwater; users crossing the solvency line are ignored, so this is meant
+    for small changes.
+    Returns: (var, es)
+    """
+    j = cache['assets'].index(asset)
+    losses = (
+        cache['bad_debts']
+        - (collateral_factor - 1.0) * cache['collateral_contribution'][:, j]
+        + (debt_factor - 1.0) * cache['debt_contribution'][:, j]
+    )
+    # Scenarios outside the cache are not revalued, so only the cached order is used
+    return tail_stats(np.maximum(losses, 0.0), cache['num_simulations'], cache['percentile'])
@@ -1,8 +1,17 @@
-import requests
 import pandas as pd
+import numpy as np
 from dotenv import load_dotenv
 import os
-from io import StringIO
+import json
+import time
+import shutil
+import asyncio
+import threading
+import queue
+import requests
+from price_cache import get_price_history, fetch_price_histories
+from position_store import PositionStoreWriter
+from http_client import make_session, request_with_backoff, backoff_delay, gather_limited
 
 load_dotenv()
 
@@ -11,6 +20,73 @@ API_KEY = os.getenv("GRAPH_API_KEY")
 SUBGRAPH_ID = "Cd2gEDVeqnjBn1hSeqFMitw8Q1iiyV9FYUZkLNRcL87g"
 URL = f"https://gateway.thegraph.com/api/{API_KEY}/subgraphs/id/{SUBGRAPH_ID}"
 OUTPUT_FILE = "data/active_positions.csv"
+# Columnar position store read by analyze_var.py; the CSV copy is optional
+POSITION_STORE_DIR = "data/active_positions"
+WRITE_CSV = False
+POSITION_COLUMNS = ["user_id", "symbol", "collateral_amount", "debt_amount", "is_collateral", "price"]
+# 10**decimals as exact floats (10**22 is the largest), indexed by reserve decimals
+DECIMAL_SCALES = 10.0 ** np.arange(0, 23)
+# Raw user pages and the crawl checkpoint
+SNAPSHOT_DIR = "data/user_snapshot"
+PAGE_SIZE = 1000
+GRAPH_MAX_RETRIES = 5
+# Only re-pull users changed since the last complete snapshot
+INCREMENTAL = False
+# The user keyspace is split into N_PARTITIONS id-prefix ranges (a power of 16)
+N_PARTITIONS = 16
+MAX_PARTITION_CONCURRENCY = 8
+# Pages buffered between the crawl and the position writer
+PAGE_QUEUE_SIZE = 16
+# Positions are appended to the output once this many rows are buffered
+WRITE_BATCH_ROWS = 50_000
+
+USER_FIELDS = """
+    id
+    reserves {
+      id
+      reserve {
+        symbol
+        decimals
+        underlyingAsset
+      }
+      currentATokenBalance
+      currentVariableDebt
+      currentStableDebt
+      currentTotalDebt
+      usageAsCollateralEnabledOnUser
+    }
+"""
+
+USERS_QUERY = """
+query GetUsers($lastId: String!, $lower: String!, $upper: String!, $first: Int!) {
+  users(
+    first: $first
+    where: { id_gt: $lastId, id_gte: $lower, id_lt: $upper }
+    orderBy: id
+    orderDirection: asc
+  ) {%s}
+}
+""" % USER_FIELDS
+
+USERS_BY_ID_QUERY = """
+query GetUsersById($ids: [String!]!, $first: Int!) {
+  users(first: $first, where: { id_in: $ids }) {%s}
+}
+""" % USER_FIELDS
+
+CHANGED_RESERVES_QUERY = """
+query GetChangedReserves($lastId: String!, $since: Int!, $first: Int!) {
+  userReserves(
+    first: $first
+    where: { id_gt: $lastId, lastUpdateTimestamp_gt: $since }
+    orderBy: id
+    orderDirection: asc
+  ) {
+    id
+    user { id }
+  }
+}
+"""
 
 # Target symbols
 TARGET_SYMBOLS = [
@@ -26,207 +102,600 @@ TARGET_SYMBOLS = [
     {"symbol": "RLUSD", "name": "RLUSD", "coingecko_id": "ripple-usd", "supply": 0.599}
 ]
 
-def fetch_coingecko_csv(coin_id, currency="usd"):
-    url = f"https://www.coingecko.com/price_charts/export/{coin_id}/{currency}.csv"
-    
-    headers = {
-        "User-Agent": "Mozilla/5.0"
-    }
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            csv_data = StringIO(response.text)
-            df = pd.read_csv(csv_data)
-            return df
-        else:
-            print(f"Failed to fetch CSV for {coin_id}. Status: {response.status_code}")
-            return None
-    except Exception as e:
-        print(f"Error fetching {coin_id}: {e}")
-        return None
-
 def get_latest_eth_price():
-    df = fetch_coingecko_csv("ethereum", "usd")
+    series = get_price_history("ethereum", "usd")
     
-    if df is not None and not df.empty:
-        latest_price = df.iloc[-1]['price'] if 'price' in df.columns else df.iloc[-1][1]
-        return float(latest_price)
+    if series is not None and not series.empty:
+        return float(series.iloc[-1])
     
     return None
 
 def fetch_all_token_prices():
     prices = {}
     
+    histories = fetch_price_histories((token["coingecko_id"] for token in TARGET_SYMBOLS), "usd")
+    
     for token in TARGET_SYMBOLS:
         coin_id = token["coingecko_id"]
-        df = fetch_coingecko_csv(coin_id, "usd")
+        series = histories[coin_id]
         
-        if df is not None and not df.empty:
-            latest_price = df.iloc[-1]['price'] if 'price' in df.columns else df.iloc[-1][1]
+        if series is not None and not series.empty:
+            latest_price = series.iloc[-1]
             prices[token["symbol"]] = float(latest_price)
             print(f"  {token['symbol']}: ${latest_price:,.2f}")
     
     return prices
 
-def fetch_all_user_data():
-    all_users = {}
-    last_id = ""
+class SubgraphError(RuntimeError):
+    pass
 
-    while True:
-        query = """
-        query GetUsers($lastId: String!) {
-          users(
-            first: 1000
-            where: { id_gt: $lastId }
-            orderBy: id
-            orderDirection: asc
-          ) {
-            id
-            reserves {
-              id
-              reserve {
-                symbol
-                decimals
-                underlyingAsset
-              }
-              currentATokenBalance
-              currentVariableDebt
-              currentStableDebt
-              currentTotalDebt
-              usageAsCollateralEnabledOnUser
-            }
-          }
-        }
-        """
-        
-        response = requests.post(
-            URL,
-            json={"query": query, "variables": {"lastId": last_id}},
-            headers={"Content-Type": "application/json"}
-        )
-        
-        if response.status_code != 200:
-            print(f"Error: {response.status_code} - {response.text}")
-            break
-        
-        data = response.json()
+def post_query(query, variables, url=URL, session=None, max_retries=GRAPH_MAX_RETRIES):
+    """
+    Run a GraphQL query, retrying HTTP rate limits, request errors (timeouts,
+    dropped connections), responses that are not JSON and transient GraphQL errors.
+    Raises SubgraphError when the query still fails after the retries.
+    """
+    session = session if session is not None else make_session()
+    
+    for attempt in range(max_retries + 1):
+        try:
+            response = request_with_backoff(
+                session, "POST", url,
+                json={"query": query, "variables": variables},
+                headers={"Content-Type": "application/json"},
+                timeout=60
+            )
+            
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code} - {response.text[:200]}"
+            else:
+                data = response.json()
+                if "errors" not in data:
+                    return data.get("data", {})
+                error = f"GraphQL Error: {data['errors']}"
+        except requests.RequestException as e:
+            error = f"{type(e).__name__}: {e}"
+        except ValueError:
+            error = f"Invalid JSON response - {response.text[:200]}"
         
-        if "errors" in data:
-            print(f"GraphQL Error: {data['errors']}")
-            break
+        if attempt < max_retries:
+            delay = backoff_delay(attempt)
+            print(f"  {error}; retrying in {delay:.1f}s...")
+            time.sleep(delay)
+    
+    raise SubgraphError(error)
+
+def _write_json(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def load_checkpoint(snapshot_dir=SNAPSHOT_DIR):
+    path = os.path.join(snapshot_dir, "checkpoint.json")
+    return _read_json(path) if os.path.exists(path) else None
+
+def save_checkpoint(checkpoint, snapshot_dir=SNAPSHOT_DIR):
+    _write_json(os.path.join(snapshot_dir, "checkpoint.json"), checkpoint)
+
+def _page_path(snapshot_dir, kind, page_name):
+    return os.path.join(snapshot_dir, kind, f"{page_name}.json")
+
+def _crawl_page_path(snapshot_dir, partition_index, page):
+    return _page_path(snapshot_dir, "pages", f"{partition_index:03d}_{page:06d}")
+
+def keyspace_partitions(n_partitions):
+    """
+    Split the hex user-id keyspace into `n_partitions` (1, 16, 256, ...) ranges by
+    id prefix. Returns a list of (lower, upper) bounds for id_gte / id_lt;
+    "0x" and "0y" bracket every address.
+    """
+    digits = 0
+    while 16**digits < n_partitions:
+        digits += 1
+    if 16**digits != n_partitions:
+        raise ValueError(f"n_partitions must be a power of 16, got {n_partitions}")
+    
+    if digits == 0:
+        return [("0x", "0y")]
+    
+    prefixes = ["0x" + format(i, f"0{digits}x") for i in range(n_partitions)]
+    lowers = ["0x"] + prefixes[1:]
+    uppers = prefixes[1:] + ["0y"]
+    return list(zip(lowers, uppers))
+
+def crawl_users(snapshot_dir=SNAPSHOT_DIR, url=URL, session=None, page_size=PAGE_SIZE,
+                n_partitions=N_PARTITIONS, max_concurrency=MAX_PARTITION_CONCURRENCY, on_page=None):
+    """
+    Page through every user, with the id keyspace split into `n_partitions` prefix
+    ranges that are crawled concurrently over one pooled session. Each partition
+    pages with its own `id_gt` cursor inside its [id_gte, id_lt) bounds, writes each
+    page to <snapshot_dir>/pages as it arrives and checkpoints its cursor.
+    Page files are named by (partition, page), so reading them back in that numeric
+    order merges the partitions deterministically in id order.
+    `on_page(index, users)` is called with every page of partition `index` once it
+    is on disk, and with an empty list once the partition is exhausted.
+    An interrupted crawl resumes every partition from its checkpointed cursor; a
+    completed one is started over as a full refresh.
+    """
+    checkpoint = load_checkpoint(snapshot_dir)
+    
+    if checkpoint is None or checkpoint.get("complete"):
+        for kind in ("pages", "updates"):
+            shutil.rmtree(os.path.join(snapshot_dir, kind), ignore_errors=True)
+        checkpoint = {
+            "complete": False,
+            "started_at": int(time.time()),
+            "partitions": [
+                {"lower": lower, "upper": upper, "last_id": "", "next_page": 0, "complete": False}
+                for lower, upper in keyspace_partitions(n_partitions)
+            ]
+        }
+        save_checkpoint(checkpoint, snapshot_dir)
+    else:
+        pending = sum(not p["complete"] for p in checkpoint["partitions"])
+        print(f"  Resuming user crawl ({pending}/{len(checkpoint['partitions'])} partitions pending)")
+    
+    session = session if session is not None else make_session(max_concurrency)
+    lock = threading.Lock()
+    
+    def crawl_partition(index):
+        partition = checkpoint["partitions"][index]
         
-        users = data.get("data", {}).get("users", [])
+        try:
+            fetch_partition(partition, index)
+        except SubgraphError as e:
+            return e
+    
+    def fetch_partition(partition, index):
+        while not partition["complete"]:
+            variables = {
+                "lastId": partition["last_id"],
+                "lower": partition["lower"],
+                "upper": partition["upper"],
+                "first": page_size
+            }
+            users = post_query(USERS_QUERY, variables, url, session).get("users", [])
+            
+            with lock:
+                if users:
+                    _write_json(_crawl_page_path(snapshot_dir, index, partition["next_page"]), users)
+                    partition["last_id"] = users[-1]["id"]
+                    partition["next_page"] += 1
+                else:
+                    partition["complete"] = True
+                save_checkpoint(checkpoint, snapshot_dir)
+            
+            if on_page is not None:
+                on_page(index, users)
+    
+    pending = [i for i, p in enumerate(checkpoint["partitions"]) if not p["complete"]]
+    # Every partition runs until it completes or fails, so the checkpoint is settled before raising
+    errors = [e for e in asyncio.run(gather_limited(crawl_partition, pending, max_concurrency)) if e is not None]
+    if errors:
+        raise errors[0]
+    
+    checkpoint["complete"] = True
+    checkpoint["snapshot_time"] = checkpoint["started_at"]
+    save_checkpoint(checkpoint, snapshot_dir)
+
+def crawl_changed_users(snapshot_dir=SNAPSHOT_DIR, url=URL, session=None, page_size=PAGE_SIZE):
+    """
+    Re-pull only the users with a reserve updated since the last snapshot and
+    store them in <snapshot_dir>/updates, where they override the snapshot pages.
+    Interest accrued without a user action does not bump lastUpdateTimestamp, so
+    balances of untouched users keep their snapshot values until the next full crawl.
+    """
+    checkpoint = load_checkpoint(snapshot_dir)
+    session = session if session is not None else make_session()
+    started_at = int(time.time())
+    
+    changed_ids = set()
+    last_id = ""
+    while True:
+        data = post_query(CHANGED_RESERVES_QUERY, {"lastId": last_id, "since": checkpoint["snapshot_time"], "first": page_size}, url, session)
+        reserves = data.get("userReserves", [])
         
-        if not users:
+        if not reserves:
             break
         
+        changed_ids.update(r["user"]["id"] for r in reserves)
+        last_id = reserves[-1]["id"]
+    
+    print(f"  {len(changed_ids)} users changed since the last snapshot")
+    
+    changed_ids = sorted(changed_ids)
+    next_update = len(os.listdir(os.path.join(snapshot_dir, "updates"))) if os.path.isdir(os.path.join(snapshot_dir, "updates")) else 0
+    
+    for start in range(0, len(changed_ids), page_size):
+        batch = changed_ids[start:start + page_size]
+        data = post_query(USERS_BY_ID_QUERY, {"ids": batch, "first": page_size}, url, session)
+        _write_json(_page_path(snapshot_dir, "updates", f"{next_update:06d}"), data.get("users", []))
+        next_update += 1
+    
+    checkpoint["snapshot_time"] = started_at
+    save_checkpoint(checkpoint, snapshot_dir)
+
+def _page_order(name):
+    # (partition, page) numbers of a page file, so 4096 partitions or a million pages still sort in crawl order
+    return tuple(int(part) for part in name[:-len(".json")].split("_"))
+
+def _list_pages(snapshot_dir, kind):
+    kind_dir = os.path.join(snapshot_dir, kind)
+    if not os.path.isdir(kind_dir):
+        return []
+    names = [name for name in os.listdir(kind_dir) if name.endswith(".json")]
+    return [os.path.join(kind_dir, name) for name in sorted(names, key=_page_order)]
+
+def iter_snapshot_pages(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Yield the stored pages of users in crawl order. Users re-pulled by an
+    incremental update are skipped in the snapshot pages and yielded, in their
+    latest version, as a final page.
+    """
+    updated = {}
+    for path in _list_pages(snapshot_dir, "updates"):
+        for user in _read_json(path):
+            updated[user["id"]] = user
+    
+    for path in _list_pages(snapshot_dir, "pages"):
+        users = _read_json(path)
+        if updated:
+            users = [user for user in users if user["id"] not in updated]
+        yield users
+    
+    if updated:
+        yield [updated[user_id] for user_id in sorted(updated)]
+
+def iter_user_pages(incremental=False, snapshot_dir=SNAPSHOT_DIR, url=URL, session=None):
+    """
+    Yield pages of users while the crawl is still running, in the same (partition,
+    page) order as iter_snapshot_pages whatever order the partitions' pages
+    arrive in, so the output is identical from run to run. Each page is read back
+    from disk once all earlier partitions are done; later partitions wait on disk,
+    not in memory. Pages left by an interrupted crawl are picked up the same way.
+    Incremental runs fetch the (small) set of changed users first and then stream
+    the updated snapshot from disk.
+    Raises SubgraphError if the crawl fails; rerunning resumes from the checkpoint.
+    """
+    checkpoint = load_checkpoint(snapshot_dir)
+    
+    if incremental and checkpoint is not None and checkpoint.get("complete"):
+        crawl_changed_users(snapshot_dir, url, session)
+        yield from iter_snapshot_pages(snapshot_dir)
+        return
+    
+    # Pages on disk and finished partitions, as crawl_users will start from them
+    if checkpoint is None or checkpoint.get("complete"):
+        available = [0] * N_PARTITIONS
+        done = [False] * N_PARTITIONS
+    else:
+        available = [p["next_page"] for p in checkpoint["partitions"]]
+        done = [p["complete"] for p in checkpoint["partitions"]]
+    
+    events = queue.Queue(maxsize=PAGE_QUEUE_SIZE)
+    
+    def on_page(index, users):
+        events.put((index, bool(users)))
+    
+    def run():
+        try:
+            crawl_users(snapshot_dir, url, session, n_partitions=len(available), on_page=on_page)
+        except Exception as e:
+            events.put(e)
+    
+    threading.Thread(target=run, daemon=True).start()
+    
+    current, page = 0, 0
+    while current < len(available):
+        if page < available[current]:
+            yield _read_json(_crawl_page_path(snapshot_dir, current, page))
+            page += 1
+        elif done[current]:
+            current, page = current + 1, 0
+        else:
+            item = events.get()
+            if isinstance(item, Exception):
+                raise item
+            index, has_users = item
+            if has_users:
+                available[index] += 1
+            else:
+                done[index] = True
+
+def fetch_all_user_data(incremental=False, snapshot_dir=SNAPSHOT_DIR, url=URL, session=None):
+    """
+    Bring the on-disk user snapshot up to date and return it as {user_id: user}.
+    incremental=True only re-pulls users changed since the last complete snapshot.
+    Raises SubgraphError if the crawl fails; rerunning resumes from the checkpoint.
+    """
+    checkpoint = load_checkpoint(snapshot_dir)
+    
+    if incremental and checkpoint is not None and checkpoint.get("complete"):
+        crawl_changed_users(snapshot_dir, url, session)
+    else:
+        crawl_users(snapshot_dir, url, session)
+    
+    all_users = {}
+    for users in iter_snapshot_pages(snapshot_dir):
         for user in users:
             all_users[user["id"]] = user
-        
-        last_id = users[-1]["id"]
     return all_users
 
+def _two_sum(a, b):
+    # a + b as an unevaluated sum s + e, exactly
+    s = a + b
+    b_virtual = s - a
+    return s, (a - (s - b_virtual)) + (b - b_virtual)
+
+def _split(a):
+    # Dekker split of a into two halves of at most 26 significant bits each
+    t = 134217729.0 * a
+    high = t - (t - a)
+    return high, a - high
+
+def _two_product(a, b):
+    # a * b as an unevaluated sum p + e, exactly (no FMA needed)
+    p = a * b
+    a_high, a_low = _split(a)
+    b_high, b_low = _split(b)
+    return p, ((a_high * b_high - p) + a_high * b_low + a_low * b_high) + a_low * b_low
+
+def _divide_split_integers(high, low, scale):
+    """
+    (high * 10**18 + low) / scale for int64 high, low < 10**18 and exact float scales,
+    correctly rounded. The dividend is carried as a double-double (about 106 bits),
+    so the float quotient and its residual decide the rounding; quotients within
+    2**-90 of a rounding midpoint are flagged as ambiguous.
+    Returns: (quotients, ambiguous mask)
+    """
+    high_f = high.astype(float)
+    low_f = low.astype(float)
+    # What the int64 -> float conversions rounded away; exact, and small enough to stay exact below
+    high_r = (high - high_f.astype(np.int64)).astype(float)
+    low_r = (low - low_f.astype(np.int64)).astype(float)
+    
+    product, product_error = _two_product(high_f, 1e18)
+    dividend, dividend_low = _two_sum(product, low_f)
+    dividend_low += product_error + high_r * 1e18 + low_r
+    dividend, dividend_low = _two_sum(dividend, dividend_low)
+    
+    quotient = dividend / scale
+    back, back_error = _two_product(quotient, scale)
+    correction = (((dividend - back) - back_error) + dividend_low) / scale
+    result = quotient + correction
+    
+    # Distance from the result to the exact quotient, against half the gap to the neighbour on that side
+    offset = (quotient - result) + correction
+    gap = np.where(offset >= 0, np.nextafter(result, np.inf) - result, result - np.nextafter(result, -np.inf))
+    ambiguous = np.abs(offset) >= gap / 2 - 2.0**-90 * np.abs(result)
+    return result, ambiguous
+
+def scale_balances(raw_balances, decimals):
+    """
+    Convert raw integer balance strings to token amounts (raw / 10**decimals) for a
+    whole batch at once, correctly rounded. Balances of up to 36 digits with up to 22
+    decimals (every realistic one) are left-padded and read as two int64 halves of
+    18 digits, and divided in floating point with an exact residual check; only the
+    rest, and the vanishingly rare quotients sitting on a rounding midpoint, use
+    Python's correctly rounded int / int division.
+    """
+    raw = np.asarray(raw_balances, dtype=bytes)
+    decimals = np.asarray(decimals, dtype=int)
+    amounts = np.empty(len(raw))
+    if len(raw) == 0:
+        return amounts
+    
+    fits = decimals < len(DECIMAL_SCALES)
+    if raw.dtype.itemsize > 36:
+        fits &= np.char.str_len(raw) <= 36
+    rows = np.flatnonzero(fits)
+    slow = np.ones(len(raw), dtype=bool)
+    
+    if len(rows):
+        # Left-padded to 36 digits; columns k and k + 18 are digit k of the high and low halves.
+        # Horner runs on the ASCII codes, and the '0' offsets (48 * 11...1) come off at the end
+        padded = np.char.rjust(raw[rows].astype("S36"), 36, fillchar=b"0")
+        codes = padded.view(np.uint8).reshape(-1, 36)
+        halves = np.zeros((2, len(rows)), dtype=np.int64)
+        for k in range(18):
+            halves *= 10
+            halves += codes[:, k::18].T
+        halves -= ord("0") * (10**18 - 1) // 9
+        amounts[rows], ambiguous = _divide_split_integers(halves[0], halves[1], DECIMAL_SCALES[decimals[rows]])
+        slow[rows[~ambiguous]] = False
+    
+    for d in np.unique(decimals[slow]):
+        slow_rows = slow & (decimals == d)
+        scale = 10**int(d)
+        amounts[slow_rows] = [int(r) / scale for r in raw[slow_rows].tolist()]
+    
+    return amounts
+
+def parse_page(users, token_prices):
+    """
+    Flatten a page of raw users into one row per reserve, converting every balance
+    of the page in one batched pass.
+    Returns: DataFrame with POSITION_COLUMNS plus user_index (position of the user
+    in `users`), collateral_usd and debt_usd
+    """
+    user_reserves = [user.get("reserves", []) for user in users]
+    counts = [len(reserves) for reserves in user_reserves]
+    reserves = [reserve for reserves in user_reserves for reserve in reserves]
+    
+    user_index = np.repeat(np.arange(len(users)), counts)
+    user_ids = np.repeat(np.array([user["id"] for user in users], dtype=object), counts)
+    symbols = np.array([reserve["reserve"]["symbol"] for reserve in reserves], dtype=object)
+    decimals = np.array([reserve["reserve"]["decimals"] for reserve in reserves], dtype=int)
+    is_collateral = np.array([reserve["usageAsCollateralEnabledOnUser"] for reserve in reserves], dtype=bool)
+    raw_collateral = [reserve["currentATokenBalance"] for reserve in reserves]
+    raw_debt = [reserve["currentTotalDebt"] for reserve in reserves]
+    
+    symbol_codes, unique_symbols = pd.factorize(symbols)
+    price = np.array([token_prices.get(symbol, 0.0) for symbol in unique_symbols], dtype=float)[symbol_codes]
+    
+    # Collateral and debt balances are scaled together in one pass
+    amounts = scale_balances(raw_collateral + raw_debt, np.concatenate([decimals, decimals]))
+    collateral_amount, debt_amount = amounts[:len(reserves)], amounts[len(reserves):]
+    
+    return pd.DataFrame({
+        "user_id": user_ids,
+        "symbol": symbols,
+        "collateral_amount": collateral_amount,
+        "debt_amount": debt_amount,
+        "is_collateral": is_collateral,
+        "price": price,
+        "user_index": user_index,
+        "collateral_usd": np.where(is_collateral, collateral_amount * price, 0.0),
+        "debt_usd": debt_amount * price
+    })
+
+def _user_totals(reserves, n_users):
+    user_index = reserves["user_index"].to_numpy()
+    total_collateral_usd = np.bincount(user_index, weights=reserves["collateral_usd"].to_numpy(), minlength=n_users)
+    total_debt_usd = np.bincount(user_index, weights=reserves["debt_usd"].to_numpy(), minlength=n_users)
+    return total_collateral_usd, total_debt_usd
+
+def _active_rows(reserves, total_debt_usd):
+    # Non-empty positions of users with debt
+    has_debt = total_debt_usd[reserves["user_index"].to_numpy()] > 0
+    non_empty = (reserves["collateral_amount"] > 0) | (reserves["debt_amount"] > 0)
+    return has_debt & non_empty.to_numpy()
+
 def calculate_bad_debt(users_data, token_prices, target_symbols):
     
     symbol_list = [s["symbol"] for s in target_symbols]
-    target_decimals = {s["symbol"]: 0 for s in target_symbols} 
     
     bad_debt_by_symbol = {symbol: 0.0 for symbol in symbol_list}
     users_with_bad_debt_by_symbol = {symbol: 0 for symbol in symbol_list}
     user_details_by_symbol = {symbol: [] for symbol in symbol_list}
     
-    all_active_positions = []
+    users = list(users_data.values())
+    reserves = parse_page(users, token_prices)
+    total_collateral_usd, total_debt_usd = _user_totals(reserves, len(users))
     
-    processed = 0
-    for user_id, user_data in users_data.items():
-        reserves = user_data.get("reserves", [])
-        
-        if not reserves:
-            continue
-        
-        processed += 1
-        if processed % 1000 == 0:
-            print(f"  Processed {processed} users...")
-        
-        total_collateral_usd = 0.0
-        total_debt_usd = 0.0
-        debt_by_symbol = {}
+    active = reserves.loc[_active_rows(reserves, total_debt_usd), POSITION_COLUMNS]
+    all_active_positions = [dict(zip(POSITION_COLUMNS, row)) for row in zip(*(active[c].tolist() for c in POSITION_COLUMNS))]
+    
+    user_bad_debt = total_debt_usd - total_collateral_usd
+    
+    bad_debt_rows = (
+        reserves["symbol"].isin(symbol_list).to_numpy()
+        & (reserves["debt_usd"] > 0).to_numpy()
+        & (user_bad_debt[reserves["user_index"].to_numpy()] > 0)
+    )
+    debt_by_user_symbol = reserves[bad_debt_rows].groupby(["user_index", "symbol"], sort=False)["debt_usd"].sum()
+    
+    total_collateral_usd = total_collateral_usd.tolist()
+    total_debt_usd = total_debt_usd.tolist()
+    user_bad_debt = user_bad_debt.tolist()
+    
+    for (i, symbol), debt_amount in zip(debt_by_user_symbol.index.tolist(), debt_by_user_symbol.tolist()):
+        proportion = debt_amount / total_debt_usd[i]
+        symbol_bad_debt = user_bad_debt[i] * proportion
         
-        user_positions = []
+        bad_debt_by_symbol[symbol] += symbol_bad_debt
+        users_with_bad_debt_by_symbol[symbol] += 1
         
-        for reserve in reserves:
-            symbol = reserve["reserve"]["symbol"]
-            decimals = int(reserve["reserve"]["decimals"])
-            
-            price_usd = token_prices.get(symbol, 0.0)
-            
-            collateral_balance = float(reserve["currentATokenBalance"]) / (10 ** decimals)
-            collateral_usd = 0.0
-            if reserve["usageAsCollateralEnabledOnUser"]:
-                collateral_usd = collateral_balance * price_usd
-                total_collateral_usd += collateral_usd
-            
-            debt_balance = float(reserve["currentTotalDebt"]) / (10 ** decimals)
-            debt_usd = debt_balance * price_usd
-            total_debt_usd += debt_usd
-            
-            if symbol in symbol_list and debt_usd > 0:
-                if symbol not in debt_by_symbol:
-                    debt_by_symbol[symbol] = 0.0
-                debt_by_symbol[symbol] += debt_usd
-            
-            if collateral_balance > 0 or debt_balance > 0:
-                user_positions.append({
-                    "user_id": user_id,
-                    "symbol": symbol,
-                    "collateral_amount": collateral_balance,
-                    "debt_amount": debt_balance,
-                    "is_collateral": reserve["usageAsCollateralEnabledOnUser"],
-                    "price": price_usd
-                })
-        
-        if total_debt_usd > 0:
-             all_active_positions.extend(user_positions)
+        user_details_by_symbol[symbol].append({
+            "user_id": users[i]["id"],
+            "total_debt": total_debt_usd[i],
+            "total_collateral": total_collateral_usd[i],
+            "bad_debt": user_bad_debt[i],
+            "symbol_debt": debt_amount,
+            "symbol_bad_debt": symbol_bad_debt
+        })
+    
+    return bad_debt_by_symbol, users_with_bad_debt_by_symbol, user_details_by_symbol, all_active_positions
+
+def iter_active_positions(pages, token_prices):
+    """
+    Parse pages of raw users into the positions of users with debt, one
+    DataFrame per page, without holding more than a page at a time.
+    """
+    for users in pages:
+        reserves = parse_page(users, token_prices)
+        _, total_debt_usd = _user_totals(reserves, len(users))
+        yield reserves.loc[_active_rows(reserves, total_debt_usd), POSITION_COLUMNS]
 
-        user_bad_debt = total_debt_usd - total_collateral_usd
+def write_active_positions(position_batches, output_file=OUTPUT_FILE, store_dir=POSITION_STORE_DIR, batch_rows=WRITE_BATCH_ROWS):
+    """
+    Append position records in batches of about `batch_rows` rows to the columnar
+    store in `store_dir` and, if `output_file` is set, to a CSV copy.
+    Both are built next to their final path and only replace it once every batch
+    is written, so a failed crawl never leaves a truncated output.
+    Returns: number of rows written
+    """
+    writer = PositionStoreWriter(store_dir) if store_dir else None
+    csv_file = open(output_file + ".partial", 'w', newline='') if output_file else None
+    buffer = []
+    n_buffered = 0
+    n_rows = 0
+    
+    def flush():
+        nonlocal n_buffered
+        batch = pd.concat(buffer, ignore_index=True) if buffer else pd.DataFrame(columns=POSITION_COLUMNS)
+        if writer is not None:
+            writer.append(batch)
+        if csv_file is not None:
+            batch.to_csv(csv_file, header=False, index=False)
+            csv_file.flush()
+        buffer.clear()
+        n_buffered = 0
+        return len(batch)
+    
+    try:
+        if csv_file is not None:
+            pd.DataFrame(columns=POSITION_COLUMNS).to_csv(csv_file, index=False)
+        
+        for batch in position_batches:
+            buffer.append(batch)
+            n_buffered += len(batch)
+            if n_buffered >= batch_rows:
+                n_rows += flush()
+                print(f"  Wrote {n_rows} positions...")
         
-        if user_bad_debt > 0:
-            for symbol, debt_amount in debt_by_symbol.items():
-                if symbol in symbol_list:
-                    proportion = debt_amount / total_debt_usd if total_debt_usd > 0 else 0
-                    symbol_bad_debt = user_bad_debt * proportion
-                    
-                    bad_debt_by_symbol[symbol] += symbol_bad_debt
-                    users_with_bad_debt_by_symbol[symbol] += 1
-                    
-                    user_details_by_symbol[symbol].append({
-                        "user_id": user_id,
-                        "total_debt": total_debt_usd,
-                        "total_collateral": total_collateral_usd,
-                        "bad_debt": user_bad_debt,
-                        "symbol_debt": debt_amount,
-                        "symbol_bad_debt": symbol_bad_debt
-                    })
+        n_rows += flush()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        if csv_file is not None:
+            csv_file.close()
+        raise
     
-    return bad_debt_by_symbol, users_with_bad_debt_by_symbol, user_details_by_symbol, all_active_positions
+    if writer is not None:
+        writer.close()
+    if csv_file is not None:
+        csv_file.close()
+        os.replace(output_file + ".partial", output_file)
+    return n_rows
 
 def main():    
     token_prices = fetch_all_token_prices()
     
-    users_data = fetch_all_user_data()
+    pages = iter_user_pages(incremental=INCREMENTAL)
     
-    if not users_data:
+    try:
+        n_rows = write_active_positions(
+            iter_active_positions(pages, token_prices),
+            OUTPUT_FILE if WRITE_CSV else None,
+            POSITION_STORE_DIR
+        )
+    except SubgraphError as e:
+        print(f"User crawl failed: {e}")
+        print("Rerun to resume from the last checkpoint.")
+        return
+    
+    if n_rows == 0:
         print("No user data fetched")
         return
     
-    bad_debt_by_symbol, users_with_bad_debt, user_details, all_active_positions = calculate_bad_debt(
-        users_data, 
-        token_prices, 
-        TARGET_SYMBOLS
-    )
-
-    active_df = pd.DataFrame(all_active_positions)
-    active_df.to_csv(OUTPUT_FILE, index=False)
+    print(f"Saved {n_rows} active positions to {POSITION_STORE_DIR}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
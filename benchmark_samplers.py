@@ -0,0 +1,97 @@
+import pandas as pd
+import numpy as np
+import json
+import os
+import time
+from monte_carlo import correlated_model_paths, correlated_model_terminal_prices, correlated_gbm_blocks
+
+MARKET_DATA_FILE = "data/volatility_and_correlation.json"
+MODELS = ["gbm", "t_copula", "jump"]
+TERMINAL_SIMULATIONS = 200_000
+PATH_SIMULATIONS = 10_000
+N_STEPS = 365
+BLOCK_STEPS = 30
+# Best of N_REPEATS runs is reported
+N_REPEATS = 3
+SEED = 0
+# Lower percentile of the equal-weight portfolio return reported for each model
+TAIL_PERCENTILE = 0.1
+# Lower-tail dependence is reported for this pair (the two most volatile assets if missing)
+TAIL_PAIR = ("WETH", "WBTC")
+
+def load_inputs(market_data_file=MARKET_DATA_FILE):
+    if not os.path.exists(market_data_file):
+        print(f"Error: {market_data_file} not found. Run fetch_market_data.py first.")
+        return None
+
+    with open(market_data_file, 'r') as f:
+        market_data = json.load(f)
+
+    assets = market_data['assets']
+    S0_list = [market_data['latest_prices'].get(a, 0) for a in assets]
+    sigma_list = [market_data['annual_volatility'].get(a, 0) for a in assets]
+    return assets, S0_list, [0.0] * len(assets), sigma_list, np.array(market_data['correlation_matrix'])
+
+def final_prices(model, mode, S0_list, mu_list, sigma_list, correlation_matrix, rng):
+    if mode == "terminal":
+        return correlated_model_terminal_prices(
+            S0_list, mu_list, sigma_list, correlation_matrix, T=1.0, n_sims=TERMINAL_SIMULATIONS, model=model, rng=rng
+        )
+    if mode == "paths":
+        return correlated_model_paths(
+            S0_list, mu_list, sigma_list, correlation_matrix, T=1.0, n_steps=N_STEPS, n_sims=PATH_SIMULATIONS,
+            model=model, rng=rng
+        )[-1]
+
+    for block in correlated_gbm_blocks(S0_list, mu_list, sigma_list, correlation_matrix, T=1.0, n_steps=N_STEPS,
+                                       n_sims=PATH_SIMULATIONS, block_steps=BLOCK_STEPS, rng=rng, model=model):
+        prices = block[-1]
+    return prices
+
+def tail_dependence(log_returns, i, j, q=0.01):
+    # P(both assets in their own lower q tail) / q: q under independence, 1 under comonotonicity
+    both = (log_returns[:, i] < np.quantile(log_returns[:, i], q)) & (log_returns[:, j] < np.quantile(log_returns[:, j], q))
+    return both.mean() / q
+
+def main():
+    inputs = load_inputs()
+    if inputs is None:
+        return
+    assets, S0_list, mu_list, sigma_list, correlation_matrix = inputs
+
+    if all(asset in assets for asset in TAIL_PAIR):
+        i, j = (assets.index(asset) for asset in TAIL_PAIR)
+    else:
+        i, j = np.argsort(sigma_list)[::-1][:2]
+
+    rows = []
+    for mode in ["terminal", "paths", "blocks"]:
+        n_sims = TERMINAL_SIMULATIONS if mode == "terminal" else PATH_SIMULATIONS
+        for model in MODELS:
+            best = np.inf
+            for repeat in range(N_REPEATS):
+                rng = np.random.default_rng([SEED, repeat])
+                start = time.perf_counter()
+                prices = final_prices(model, mode, S0_list, mu_list, sigma_list, correlation_matrix, rng)
+                best = min(best, time.perf_counter() - start)
+
+            log_returns = np.log(prices / np.asarray(S0_list))
+            rows.append({
+                'mode': mode,
+                'model': model,
+                'seconds': best,
+                'scenarios_per_second': n_sims / best,
+                f'portfolio_q{TAIL_PERCENTILE}%': np.percentile(np.expm1(log_returns).mean(axis=1), TAIL_PERCENTILE),
+                f'tail_dependence_{assets[i]}_{assets[j]}': tail_dependence(log_returns, i, j)
+            })
+            print(f"  {mode:8s} {model:8s} {best:.3f}s")
+
+    results = pd.DataFrame(rows)
+    results['vs_gbm'] = results['seconds'] / results.groupby('mode')['seconds'].transform('first')
+
+    print("\nSampler throughput (1-year horizon, best of "
+          f"{N_REPEATS}; {TERMINAL_SIMULATIONS:,} terminal / {PATH_SIMULATIONS:,} path scenarios):")
+    print(results.to_string(index=False, float_format=lambda x: f"{x:,.3f}"))
+
+if __name__ == "__main__":
+    main()
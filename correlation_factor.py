@@ -0,0 +1,104 @@
+import numpy as np
+import hashlib
+from collections import OrderedDict
+
+# Share of the total correlation variance kept by the factor; below 1 the matrix is
+# approximated by its leading eigenvectors, so fewer shocks are drawn per scenario
+FACTOR_VARIANCE_KEPT = 1.0
+# Eigenvalues below this fraction of the largest are dropped from eigen factors
+RANK_TOLERANCE = 1e-10
+# Higham nearest-correlation iterations and relative convergence tolerance
+NEAREST_MAX_ITER = 200
+NEAREST_TOLERANCE = 1e-9
+# Factors of the most recently used matrices kept in memory
+FACTOR_CACHE_SIZE = 32
+
+_factor_cache = OrderedDict()
+
+def _psd_projection(matrix):
+    eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+    return (eigenvectors * np.maximum(eigenvalues, 0.0)) @ eigenvectors.T
+
+def nearest_correlation(corr_matrix, max_iter=NEAREST_MAX_ITER, tol=NEAREST_TOLERANCE):
+    """
+    Nearest (Frobenius norm) positive semidefinite matrix with unit diagonal to a
+    symmetric matrix, by Higham's alternating projections with Dykstra's correction.
+    Pairwise correlations over assets with different histories are often slightly
+    indefinite; this moves them as little as possible.
+    """
+    Y = np.array(corr_matrix, dtype=float)
+    correction = np.zeros_like(Y)
+
+    for _ in range(max_iter):
+        R = Y - correction
+        X = _psd_projection(R)
+        correction = X - R
+
+        previous = Y
+        Y = X.copy()
+        np.fill_diagonal(Y, 1.0)
+        if np.linalg.norm(Y - previous) <= tol * np.linalg.norm(Y):
+            break
+    return Y
+
+def eigen_factor(corr_matrix, variance_kept=1.0, rank_tolerance=RANK_TOLERANCE):
+    """
+    Factor L (n_assets x k) with L @ L.T ~ corr_matrix from the leading eigenvectors:
+    the fewest that explain `variance_kept` of the trace, without the numerically
+    zero ones. Rows are rescaled to unit length so every asset keeps unit variance;
+    only the correlations are approximated.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(corr_matrix)
+    eigenvalues, eigenvectors = eigenvalues[::-1], eigenvectors[:, ::-1]
+
+    eigenvalues = np.maximum(eigenvalues, 0.0)
+    rank = int(np.sum(eigenvalues > rank_tolerance * eigenvalues[0]))
+    if variance_kept < 1:
+        explained = np.cumsum(eigenvalues) / eigenvalues.sum()
+        rank = min(rank, int(np.searchsorted(explained, variance_kept)) + 1)
+
+    L = eigenvectors[:, :rank] * np.sqrt(eigenvalues[:rank])
+    return L / np.linalg.norm(L, axis=1, keepdims=True)
+
+def _factor_key(corr_matrix, variance_kept):
+    digest = hashlib.sha256()
+    digest.update(str(corr_matrix.shape).encode())
+    digest.update(corr_matrix.tobytes())
+    digest.update(repr(float(variance_kept)).encode())
+    return digest.hexdigest()
+
+def correlation_factor(corr_matrix, variance_kept=FACTOR_VARIANCE_KEPT):
+    """
+    Factor L with L @ L.T = corr_matrix for correlating standard normal shocks
+    (Z_corr = Z_uncorr @ L.T, with Z_uncorr drawn L.shape[1] wide).
+    The Cholesky factor (square) when the matrix is positive definite. Otherwise the
+    matrix is repaired with nearest_correlation and a reduced-rank eigen_factor is
+    returned. With variance_kept < 1 the eigen_factor is truncated to the leading
+    factors that explain that share of the variance.
+    Factors are cached by a hash of the matrix, so chunked and repeated calls do
+    not refactor; the returned array is read-only.
+    """
+    corr_matrix = np.ascontiguousarray(corr_matrix, dtype='<f8')
+    key = _factor_key(corr_matrix, variance_kept)
+    if key in _factor_cache:
+        _factor_cache.move_to_end(key)
+        return _factor_cache[key]
+
+    symmetric = (corr_matrix + corr_matrix.T) / 2
+    L = None
+    if variance_kept >= 1:
+        try:
+            L = np.linalg.cholesky(symmetric)
+        except np.linalg.LinAlgError:
+            pass
+
+    if L is None:
+        if np.linalg.eigvalsh(symmetric)[0] < 0:
+            symmetric = nearest_correlation(symmetric)
+        L = eigen_factor(symmetric, variance_kept)
+
+    L.flags.writeable = False
+    _factor_cache[key] = L
+    if len(_factor_cache) > FACTOR_CACHE_SIZE:
+        _factor_cache.popitem(last=False)
+    return L
@@ -1,10 +1,9 @@
 import pandas as pd
 import numpy as np
-import requests
-import time
 import os
-from io import StringIO
-from datetime import datetime, timedelta
+from datetime import timedelta
+from price_cache import get_price_history, fetch_price_histories
+from rolling_stats import updated_moments, STATE_DIR
 
 TOP_ASSETS = [
     {"symbol": "WETH", "name": "Wrapped Ether", "coingecko_id": "weth", "supply": 9.17},
@@ -20,72 +19,10 @@ TOP_ASSETS = [
 ]
 
 OUTPUT_FILE = "data/aave_var_results.csv"
-
-def fetch_coingecko_csv(coin_id, currency="usd"):
-    url = f"https://www.coingecko.com/price_charts/export/{coin_id}/{currency}.csv"
-    
-    headers = {
-        "User-Agent": "Mozilla/5.0"
-    }
-
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            csv_data = StringIO(response.text)
-            df = pd.read_csv(csv_data)
-            return df
-        else:
-            print(f"Failed to fetch CSV for {coin_id}. Status: {response.status_code}")
-            return None
-    except Exception as e:
-        print(f"Error fetching {coin_id}: {e}")
-        return None
-
-def fetch_coingecko_api(coin_id, days=365):
-    url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart"
-    params = {
-        "vs_currency": "usd",
-        "days": days,
-        "interval": "daily"
-    }
-    
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if 'prices' not in data: 
-                return None
-            
-            prices = data['prices']
-            df = pd.DataFrame(prices, columns=["snapped_at", "price"])
-            df['snapped_at'] = pd.to_datetime(df['snapped_at'], unit='ms')
-            return df
-        else:
-            print(f"API failed for {coin_id}. Status: {response.status_code}")
-            return None
-    except Exception as e:
-        print(f"API Error {coin_id}: {e}")
-        return None
+PERIODS = [(30, "Short"), (90, "Mid"), (365, "Long")]
 
 def get_historical_data(coin_id):
-    df = fetch_coingecko_csv(coin_id)
-    
-    if df is None or df.empty:
-        time.sleep(2)
-        df = fetch_coingecko_api(coin_id)
-        
-    if df is not None:
-        df.columns = [c.lower() for c in df.columns]
-        if 'snapped_at' in df.columns:
-            df['date'] = pd.to_datetime(df['snapped_at'])
-        elif 'timestamp' in df.columns:
-             df['date'] = pd.to_datetime(df['timestamp'])
-             
-        df.set_index('date', inplace=True)
-        df.sort_index(inplace=True)
-        return df['price']
-    
-    return None
+    return get_price_history(coin_id)
 
 def calculate_metrics(prices_series, window_days):
     if len(prices_series) < window_days:
@@ -110,15 +47,35 @@ def calculate_metrics(prices_series, window_days):
         "var_99_9_1d_pct": var_99_9_1d_pct
     }
 
+def rolling_metrics(moments, window_days):
+    """
+    calculate_metrics from incrementally maintained statistics (rolling_stats.RollingMoments
+    over 'simple' returns, with `window_days` among its windows) instead of a rescan of the series.
+    """
+    if moments.count + 1 < window_days:
+        return None
+
+    daily_vol = moments.volatility(window_days, periods_per_year=1)[0]
+    if np.isnan(daily_vol):
+        return None
+
+    Z_99_9 = 3.090
+    return {
+        "annual_vol": daily_vol * np.sqrt(365),
+        "var_99_9_1d_pct": Z_99_9 * daily_vol
+    }
+
 if __name__ == "__main__":
     results = []
     
+    histories = fetch_price_histories(asset['coingecko_id'] for asset in TOP_ASSETS)
+    
     for asset in TOP_ASSETS:
         symbol = asset['symbol']
         coin_id = asset['coingecko_id']
         supply_b = asset['supply']
         
-        prices = get_historical_data(coin_id)
+        prices = histories[coin_id]
         
         if prices is None:
             print(f"Skipping {symbol} (No data)")
@@ -131,8 +88,11 @@ if __name__ == "__main__":
         else:
             metrics['latest_price'] = np.nan
 
-        for period, label in [(30, "Short"), (90, "Mid"), (365, "Long")]:
-            m = calculate_metrics(prices, period)
+        moments = updated_moments(prices.to_frame(symbol), os.path.join(STATE_DIR, f"{coin_id}.npz"),
+                                  windows=[period for period, _ in PERIODS], kind="simple")
+
+        for period, label in PERIODS:
+            m = rolling_metrics(moments, period)
             if m:
                 metrics[f"vol_{label}"] = m['annual_vol']
                 metrics[f"var99.9_{label}"] = m['var_99_9_1d_pct']
@@ -145,7 +105,6 @@ if __name__ == "__main__":
         metrics['supply_B'] = supply_b
         results.append(metrics)
         
-        time.sleep(1)
     
     df_res = pd.DataFrame(results)
     
@@ -1,14 +1,15 @@
 import pandas as pd
-import numpy as np
-import requests
-import time
 import json
 import os
-from io import StringIO
-from datetime import datetime, timedelta
+from price_cache import get_price_history, fetch_price_histories
+from rolling_stats import updated_moments, STATE_DIR
 
 
 OUTPUT_FILE = "data/volatility_and_correlation.json"
+# Aligned daily closes of every asset, replayed by analyze_var.py's historical mode
+PRICE_HISTORY_FILE = "data/aligned_prices.csv"
+# Full-history return sums and cross-products, updated with new days only
+MOMENTS_FILE = os.path.join(STATE_DIR, "market_data.npz")
 
 ASSET_MAP = {
     "WETH": "weth",
@@ -27,52 +28,20 @@ ASSET_MAP = {
 STABLECOINS = ["USDT", "USDC", "RLUSD"]
 
 def fetch_coingecko_price_history(coin_id, currency="usd"):
-    url = f"https://www.coingecko.com/price_charts/export/{coin_id}/{currency}.csv"
-    headers = {
-        "User-Agent": "Mozilla/5.0"
-    }
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code == 200:
-            csv_data = StringIO(response.text)
-            try:
-                df = pd.read_csv(csv_data)
-            except pd.errors.ParserError:
-                print(f"  Error parsing CSV for {coin_id}")
-                return None
-            
-            if df.empty:
-                return None
-                
-            if 'snapped_at' in df.columns:
-                 df['timestamp'] = pd.to_datetime(df['snapped_at'])
-            elif 'timestamp' in df.columns:
-                 df['timestamp'] = pd.to_datetime(df['timestamp'])
-            else:
-                print(f"  Unknown columns for {coin_id}: {df.columns}")
-                return None
-            
-            df.set_index('timestamp', inplace=True)
-            df = df.resample('D').last()
-            return df['price']
-            
-        elif response.status_code == 429:
-            print("  Rate limited! Waiting 30s...")
-            time.sleep(30)
-            return fetch_coingecko_price_history(coin_id, currency)
-        else:
-            print(f"  Failed: {response.status_code}")
-            return None
-    except Exception as e:
-        print(f"  Error: {e}")
-        return None
+    return get_price_history(coin_id, currency)
 
-def main():
+def load_aligned_prices(asset_map=ASSET_MAP):
+    """
+    Daily prices of every asset in `asset_map` on the dates they all cover
+    (gaps forward-filled), from the local price cache.
+    Returns: DataFrame indexed by date with one column per symbol (empty if they never overlap)
+    """
     all_prices = pd.DataFrame()
     
-    for symbol, coin_id in ASSET_MAP.items():
-        series = fetch_coingecko_price_history(coin_id)
+    histories = fetch_price_histories(asset_map.values())
+    
+    for symbol, coin_id in asset_map.items():
+        series = histories[coin_id]
         
         if series is not None and not series.empty:
             series.name = symbol
@@ -82,25 +51,25 @@ def main():
             else:
                 all_prices = all_prices.join(series, how='outer')
         
-        time.sleep(1.5)
     
     all_prices.ffill(inplace=True)
     all_prices.dropna(inplace=True)
-    all_prices.dropna(inplace=True)
-    
+    return all_prices
+
+def main():
+    all_prices = load_aligned_prices()
 
     if all_prices.empty:
         print("Error: No overlapping price data found.")
         return
 
-    log_returns = np.log(all_prices / all_prices.shift(1)).dropna()
+    moments = updated_moments(all_prices, MOMENTS_FILE, windows=(), kind="log")
     
-    correlation_matrix = log_returns.corr()
+    correlation_matrix = moments.correlation()
     
-    covariance_matrix = log_returns.cov() * 365
+    covariance_matrix = moments.covariance() * 365
     
-    daily_vol = log_returns.std()
-    annual_vol = daily_vol * np.sqrt(365)
+    annual_vol = pd.Series(moments.volatility(), index=moments.assets)
     
     latest_prices = all_prices.iloc[-1]
     
@@ -108,14 +77,16 @@ def main():
         "assets": list(all_prices.columns),
         "latest_prices": latest_prices.to_dict(),
         "annual_volatility": annual_vol.to_dict(),
-        "correlation_matrix": correlation_matrix.values.tolist(),
-        "covariance_matrix": covariance_matrix.values.tolist(),
+        "correlation_matrix": correlation_matrix.tolist(),
+        "covariance_matrix": covariance_matrix.tolist(),
         "data_start": str(all_prices.index[0]),
         "data_end": str(all_prices.index[-1])
     }
     
     with open(OUTPUT_FILE, 'w') as f:
         json.dump(output_data, f, indent=2)
+
+    all_prices.rename_axis('date').to_csv(PRICE_HISTORY_FILE)
         
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+import asyncio
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes that are retried with exponential backoff
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+MAX_RETRIES = 5
+BACKOFF_BASE = 2.0
+MAX_BACKOFF = 60.0
+# Request errors that retrying cannot fix; every other requests.RequestException
+# (connection resets, timeouts, truncated bodies) is retried with backoff
+NON_RETRYABLE_ERRORS = (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+                        requests.exceptions.InvalidSchema, requests.exceptions.InvalidHeader,
+                        requests.exceptions.URLRequired, requests.exceptions.TooManyRedirects,
+                        requests.exceptions.HTTPError)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` requests per second on average,
+    with bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self):
+        # Take a token now (possibly going negative) and return how long to wait for it
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1.0
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+def make_session(pool_size=10):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def backoff_delay(attempt, response=None):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after is not None:
+        try:
+            return min(MAX_BACKOFF, float(retry_after))
+        except ValueError:
+            pass
+    return min(MAX_BACKOFF, BACKOFF_BASE * 2**attempt) * (0.5 + random.random() / 2)
+
+def request_with_backoff(session, method, url, limiter=None, max_retries=MAX_RETRIES, **kwargs):
+    """
+    Send a request through `session`, waiting on `limiter` before every attempt and
+    retrying rate-limit and gateway errors with bounded exponential backoff.
+    Request errors (connection errors, timeouts, broken chunked bodies) are retried
+    the same way and the last one is re-raised; NON_RETRYABLE_ERRORS are raised at once.
+    Returns: the last response (which may still be an error status)
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+
+        try:
+            response = session.request(method, url, **kwargs)
+        except NON_RETRYABLE_ERRORS:
+            raise
+        except requests.RequestException as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"  {type(e).__name__} from {url}, retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            continue
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+            return response
+
+        delay = backoff_delay(attempt, response)
+        print(f"  HTTP {response.status_code} from {url}, retrying in {delay:.1f}s...")
+        time.sleep(delay)
+
+    return response
+
+async def gather_limited(func, items, concurrency):
+    """
+    Run the blocking `func(item)` for every item on worker threads, at most
+    `concurrency` at a time. Results are returned in the order of `items`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item):
+        async with semaphore:
+            return await asyncio.to_thread(func, item)
+
+    return await asyncio.gather(*(run(item) for item in items))
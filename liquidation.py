@@ -0,0 +1,232 @@
+import numpy as np
+from scipy import sparse
+
+# Approximate Aave v3 Ethereum market parameters; check governance for current values
+LIQUIDATION_THRESHOLDS = {
+    "WETH": 0.83,
+    "wstETH": 0.81,
+    "weETH": 0.80,
+    "WBTC": 0.78,
+    "cbBTC": 0.78,
+    "USDC": 0.78,
+    "USDT": 0.78,
+    "sUSDe": 0.77,
+    "USDe": 0.77,
+    "RLUSD": 0.75
+}
+# Used for symbols missing above, including positions outside the modeled assets
+DEFAULT_LIQUIDATION_THRESHOLD = 0.75
+# Share of the debt a liquidator may repay in one liquidation
+CLOSE_FACTOR = 0.5
+# Extra collateral the liquidator receives, as a share of the debt repaid
+LIQUIDATION_BONUS = 0.05
+EVAL_BATCH_CELLS = 5_000_000
+# Closed positions are dropped from the pairs followed in a block once they make up this share
+COMPACT_FRACTION = 0.25
+
+def liquidation_book(book, thresholds=LIQUIDATION_THRESHOLDS, default_threshold=DEFAULT_LIQUIDATION_THRESHOLD):
+    """
+    Add liquidation-threshold weighted collateral to a position book from
+    analyze_var.prepare_position_book. Static collateral (symbols outside the
+    modeled assets) is weighted with `default_threshold`.
+    """
+    lt = np.array([thresholds.get(asset, default_threshold) for asset in book['assets']])
+    return dict(
+        book,
+        lt_collateral=(book['collateral'] @ sparse.diags(lt)).tocsr(),
+        static_lt_collateral=book['static_collateral'] * default_threshold
+    )
+
+def _pair_entries(matrix, users, scenarios, n_assets):
+    # Stored entries of the selected user rows, with their flat index into a (n_sims x n_assets) price matrix
+    rows = matrix[users]
+    entry_pair = np.repeat(np.arange(len(users)), np.diff(rows.indptr))
+    return entry_pair, scenarios[entry_pair] * n_assets + rows.indices, rows.data
+
+def _pair_values(entries, static, prices):
+    # Value of each selected user row at the prices of its own scenario
+    entry_pair, flat_index, data = entries
+    return static + np.bincount(entry_pair, weights=data * prices.ravel()[flat_index], minlength=len(static))
+
+def _compact_entries(entries, keep):
+    entry_pair, flat_index, data = entries
+    kept = keep[entry_pair]
+    return (np.cumsum(keep)[entry_pair[kept]] - 1), flat_index[kept], data[kept]
+
+def _lookup_state(state, keys):
+    # Collateral and debt scale of (scenario, user) pair keys; 1.0 for pairs never liquidated
+    coll_scale = np.ones(len(keys))
+    debt_scale = np.ones(len(keys))
+    if len(state['keys']) and len(keys):
+        idx = np.minimum(np.searchsorted(state['keys'], keys), len(state['keys']) - 1)
+        found = state['keys'][idx] == keys
+        coll_scale[found] = state['coll_scale'][idx[found]]
+        debt_scale[found] = state['debt_scale'][idx[found]]
+    return coll_scale, debt_scale
+
+def _update_state(state, keys, coll_scale, debt_scale):
+    # Merge sorted pair keys into the state, replacing the scales of pairs already there
+    replaced = np.zeros(len(state['keys']), dtype=bool)
+    if len(keys):
+        idx = np.minimum(np.searchsorted(keys, state['keys']), len(keys) - 1)
+        replaced = keys[idx] == state['keys']
+
+    # Both runs are sorted, so the stable (merge) sort is close to linear
+    merged_keys = np.concatenate([state['keys'][~replaced], keys])
+    order = np.argsort(merged_keys, kind='stable')
+    state['keys'] = merged_keys[order]
+    state['coll_scale'] = np.concatenate([state['coll_scale'][~replaced], coll_scale])[order]
+    state['debt_scale'] = np.concatenate([state['debt_scale'][~replaced], debt_scale])[order]
+
+def _apply_state(values, state, n_users, start, stop, scale_name):
+    # Scale a dense (batch x n_users) value matrix by the state of liquidated pairs in the batch.
+    # Pair keys are scenario * n_users + user, i.e. flat indices into the full (n_sims x n_users) matrix.
+    lo, hi = np.searchsorted(state['keys'], [start * n_users, stop * n_users])
+    values.ravel()[state['keys'][lo:hi] - start * n_users] *= state[scale_name][lo:hi]
+
+def _scenario_values(matrix, static, prices):
+    # (batch x n_users) values of every user under a batch of price scenarios
+    values = np.ascontiguousarray((matrix @ prices.T).T)
+    values += static
+    return values
+
+def screen_pairs(book, state, low_prices, high_prices, batch_cells=EVAL_BATCH_CELLS):
+    """
+    (user, scenario) pairs whose health factor could fall below 1 during a block of
+    steps. Over the block, threshold-weighted collateral is at least its value at
+    each asset's lowest price and debt at most its value at each asset's highest
+    price, so pairs where that bound stays >= 1 cannot be liquidated in the block.
+    Returns: (users, scenarios) index arrays, ordered by scenario
+    """
+    n_sims = low_prices.shape[0]
+    n_users = len(book['user_ids'])
+    batch_size = max(1, batch_cells // max(n_users, 1))
+
+    users = []
+    scenarios = []
+    for start in range(0, n_sims, batch_size):
+        stop = min(start + batch_size, n_sims)
+
+        lt_collateral = _scenario_values(book['lt_collateral'], book['static_lt_collateral'], low_prices[start:stop])
+        debt = _scenario_values(book['debt'], book['static_debt'], high_prices[start:stop])
+
+        _apply_state(lt_collateral, state, n_users, start, stop, 'coll_scale')
+        _apply_state(debt, state, n_users, start, stop, 'debt_scale')
+
+        scenario_offset, user = np.nonzero((lt_collateral < debt) & (debt > 0))
+        users.append(user)
+        scenarios.append(scenario_offset + start)
+
+    return np.concatenate(users), np.concatenate(scenarios)
+
+def simulate_liquidations(book, price_blocks, n_sims, close_factor=CLOSE_FACTOR, bonus=LIQUIDATION_BONUS,
+                          batch_cells=EVAL_BATCH_CELLS):
+    """
+    Path-dependent bad debt. Every step, users whose health factor
+    (threshold-weighted collateral / debt) is below 1 are liquidated: a liquidator
+    repays `close_factor` of their debt and seizes collateral worth the repayment
+    plus `bonus`, pro rata across assets. When the collateral cannot cover that,
+    it is all seized and the unpaid debt is recorded as realised bad debt and the
+    position is closed. Positions still open at the horizon add max(0, debt - collateral).
+
+    Only pairs flagged by screen_pairs are followed step by step within a block,
+    and closed positions are dropped as soon as they resolve, so the per-step
+    work scales with the number of positions at risk rather than the whole book.
+    `price_blocks` yields (k x n_sims x n_assets) blocks, e.g. monte_carlo.correlated_gbm_blocks.
+    `book` must come from liquidation_book.
+    Returns: (bad debt per scenario, number of liquidations per scenario)
+    """
+    n_users = len(book['user_ids'])
+    n_assets = len(book['assets'])
+    state = {'keys': np.empty(0, dtype=np.int64), 'coll_scale': np.empty(0), 'debt_scale': np.empty(0)}
+    realised = np.zeros(n_sims)
+    liquidations = np.zeros(n_sims, dtype=int)
+    prices = None
+
+    for block in price_blocks:
+        users, scenarios = screen_pairs(book, state, block.min(axis=0), block.max(axis=0), batch_cells)
+        keys = scenarios.astype(np.int64) * n_users + users
+        coll_scale, debt_scale = _lookup_state(state, keys)
+        changed = np.zeros(len(keys), dtype=bool)
+        closed = []
+        n_closed = 0
+
+        lt_entries = _pair_entries(book['lt_collateral'], users, scenarios, n_assets)
+        collateral_entries = _pair_entries(book['collateral'], users, scenarios, n_assets)
+        debt_entries = _pair_entries(book['debt'], users, scenarios, n_assets)
+        static_lt = book['static_lt_collateral'][users]
+        static_collateral = book['static_collateral'][users]
+        static_debt = book['static_debt'][users]
+
+        for prices in block:
+            lt_value = coll_scale * _pair_values(lt_entries, static_lt, prices)
+            debt_value = debt_scale * _pair_values(debt_entries, static_debt, prices)
+
+            liquidate = lt_value < debt_value
+            if not liquidate.any():
+                continue
+
+            idx = np.flatnonzero(liquidate)
+            collateral_value = coll_scale[idx] * _pair_values(collateral_entries, static_collateral, prices)[idx]
+            seized = close_factor * debt_value[idx] * (1 + bonus)
+            exhausted = seized >= collateral_value
+
+            partial = idx[~exhausted]
+            coll_scale[partial] *= 1 - seized[~exhausted] / collateral_value[~exhausted]
+            debt_scale[partial] *= 1 - close_factor
+
+            # All collateral goes to repay collateral / (1 + bonus) of the debt; the rest is unrecoverable
+            gone = idx[exhausted]
+            realised += np.bincount(scenarios[gone], weights=debt_value[gone] - collateral_value[exhausted] / (1 + bonus),
+                                    minlength=n_sims)
+            coll_scale[gone] = 0.0
+            debt_scale[gone] = 0.0
+
+            liquidations += np.bincount(scenarios[idx], minlength=n_sims)
+            changed[idx] = True
+
+            # Closed positions stay inert (zero scales) until they are worth dropping
+            n_closed += len(gone)
+            if n_closed > COMPACT_FRACTION * len(keys):
+                keep = debt_scale > 0
+                closed.append(keys[~keep])
+                n_closed = 0
+                users, scenarios, keys = users[keep], scenarios[keep], keys[keep]
+                coll_scale, debt_scale, changed = coll_scale[keep], debt_scale[keep], changed[keep]
+                static_lt, static_collateral, static_debt = static_lt[keep], static_collateral[keep], static_debt[keep]
+                lt_entries = _compact_entries(lt_entries, keep)
+                collateral_entries = _compact_entries(collateral_entries, keep)
+                debt_entries = _compact_entries(debt_entries, keep)
+
+        closed = np.concatenate(closed) if closed else np.empty(0, dtype=np.int64)
+        update_keys = np.concatenate([keys[changed], closed])
+        order = np.argsort(update_keys)
+        _update_state(
+            state,
+            update_keys[order],
+            np.concatenate([coll_scale[changed], np.zeros(len(closed))])[order],
+            np.concatenate([debt_scale[changed], np.zeros(len(closed))])[order]
+        )
+
+    return realised + _horizon_bad_debt(book, state, prices, batch_cells), liquidations
+
+def _horizon_bad_debt(book, state, prices, batch_cells):
+    # max(0, debt - collateral) at the final prices, with liquidated pairs at their scaled amounts
+    n_sims = prices.shape[0]
+    n_users = len(book['user_ids'])
+    batch_size = max(1, batch_cells // max(n_users, 1))
+
+    bad_debts = np.empty(n_sims)
+    for start in range(0, n_sims, batch_size):
+        stop = min(start + batch_size, n_sims)
+
+        collateral = _scenario_values(book['collateral'], book['static_collateral'], prices[start:stop])
+        debt = _scenario_values(book['debt'], book['static_debt'], prices[start:stop])
+
+        _apply_state(collateral, state, n_users, start, stop, 'coll_scale')
+        _apply_state(debt, state, n_users, start, stop, 'debt_scale')
+
+        collateral -= debt
+        bad_debts[start:stop] = -np.minimum(collateral, 0.0, out=collateral).sum(axis=1)
+
+    return bad_debts
@@ -3,10 +3,29 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import math
+from scipy.stats import norm, qmc
+from scipy.special import ndtri, stdtr
+from correlation_factor import correlation_factor
 
 NUM_SIMULATIONS = 10000
 INPUT_FILE = "data/aave_var_results.csv"
 OUTPUT_FILE = "results/monte_carlo_matrix.png"
+# 'paths' simulates full daily trajectories, 'terminal' draws only the horizon price
+SAMPLER_MODE = "paths"
+# 'pseudo' (plain), 'antithetic' or 'sobol' (scrambled quasi-Monte Carlo) normals
+SAMPLING_METHOD = "pseudo"
+# Degrees of freedom of the Student-t copula model; lower means more joint crashes
+T_COPULA_DOF = 4
+# Merton jump model: expected market-wide jumps per year, and the mean / std of each
+# asset's log jump size in units of its annual volatility
+JUMP_INTENSITY = 2.0
+JUMP_MEAN = -0.25
+JUMP_STD = 0.15
+# Uniform grid of the interpolated t -> normal map of the t copula; draws beyond it are mapped exactly
+COPULA_GRID_LIMIT = 60.0
+COPULA_GRID_POINTS = 24001
+
+_copula_tables = {}
 
 TERMS = {
     'Short': {'days': 30, 'col_vol': 'vol_Short'},
@@ -20,9 +39,39 @@ def load_simulation_data(input_file=INPUT_FILE):
         return None
     return pd.read_csv(input_file)
 
-def geometric_brownian_motion(S0, mu, sigma, T, n_steps, n_sims):
+def standard_normals(shape, sim_axis=0, rng=None, method="pseudo"):
+    """
+    Standard normal draws of `shape`, with scenarios along `sim_axis`.
+    method: 'pseudo' plain draws, 'antithetic' mirrors the first half of the scenarios
+    into the second, 'sobol' maps scrambled Sobol points (one dimension per
+    non-scenario entry) through the normal inverse CDF; scenario counts that are
+    powers of 2 keep the full balance of the Sobol points.
+    """
+    rng = np.random if rng is None else rng
+    if method == "pseudo":
+        return rng.normal(0, 1, size=shape)
+
+    n_sims = shape[sim_axis]
+    dims = tuple(d for i, d in enumerate(shape) if i != sim_axis)
+
+    if method == "antithetic":
+        half = rng.normal(0, 1, size=((n_sims + 1) // 2,) + dims)
+        Z = np.concatenate([half, -half])[:n_sims]
+    elif method == "sobol":
+        seed = rng if isinstance(rng, np.random.Generator) else np.random.randint(0, 2**31)
+        # Sobol points are only balanced in power-of-2 blocks, so the next one up is drawn and truncated
+        m = math.ceil(math.log2(max(n_sims, 1)))
+        U = qmc.Sobol(d=int(np.prod(dims)), scramble=True, seed=seed).random_base2(m)[:n_sims]
+        U = np.clip(U, 1e-12, 1 - 1e-12)
+        Z = norm.ppf(U).reshape((n_sims,) + dims)
+    else:
+        raise ValueError(f"Unknown sampling method: {method}")
+
+    return np.moveaxis(Z, 0, sim_axis)
+
+def geometric_brownian_motion(S0, mu, sigma, T, n_steps, n_sims, rng=None, method="pseudo"):
     dt = T / n_steps
-    Z = np.random.normal(0, 1, size=(n_steps, n_sims))
+    Z = standard_normals((n_steps, n_sims), sim_axis=1, rng=rng, method=method)
     paths = np.zeros((n_steps + 1, n_sims))
     paths[0] = S0
     drift = (mu - 0.5 * sigma**2) * dt
@@ -32,24 +81,22 @@ def geometric_brownian_motion(S0, mu, sigma, T, n_steps, n_sims):
     paths[1:] = S0 * np.exp(accumulated_returns)
     return paths
 
-def correlated_geometric_brownian_motion(S0_list, mu_list, sigma_list, corr_matrix, T, n_steps, n_sims):
+def correlated_geometric_brownian_motion(S0_list, mu_list, sigma_list, corr_matrix, T, n_steps, n_sims, rng=None, method="pseudo"):
     """
     Generate correlated GBM paths for multiple assets.
     S0_list: list of initial prices
     mu_list: list of drift rates (usually 0)
     sigma_list: list of volatilities
     corr_matrix: correlation matrix (n_assets x n_assets)
+    rng: optional np.random.Generator (defaults to the global np.random state)
+    method: 'pseudo', 'antithetic' or 'sobol' (see standard_normals)
     """
     n_assets = len(S0_list)
     dt = T / n_steps
     
+    L = correlation_factor(corr_matrix)
 
-    try:
-        L = np.linalg.cholesky(corr_matrix)
-    except np.linalg.LinAlgError:
-        L = np.linalg.cholesky(corr_matrix + np.eye(n_assets) * 1e-5)
-
-    Z_uncorr = np.random.normal(0, 1, size=(n_steps, n_sims, n_assets))
+    Z_uncorr = standard_normals((n_steps, n_sims, L.shape[1]), sim_axis=1, rng=rng, method=method)
     
     Z_corr = np.dot(Z_uncorr, L.T)
     paths = np.zeros((n_steps + 1, n_sims, n_assets))
@@ -70,6 +117,293 @@ def correlated_geometric_brownian_motion(S0_list, mu_list, sigma_list, corr_matr
         
     return paths
 
+def correlated_gbm_blocks(S0_list, mu_list, sigma_list, corr_matrix, T, n_steps, n_sims, block_steps, rng=None, method="pseudo",
+                          model="gbm", **model_params):
+    """
+    Correlated GBM paths (or another model of log_increments) generated
+    `block_steps` steps at a time.
+    Yields (k x n_sims x n_assets) price blocks in time order (S0 excluded). Only the
+    last prices (and, for the t copula, its per-scenario state) are carried between
+    blocks, so memory is O(block_steps x n_sims x n_assets) whatever n_steps is.
+    """
+    dt = T / n_steps
+
+    L = correlation_factor(corr_matrix)
+    if model == "t_copula" and model_params.get('state') is None:
+        model_params = dict(model_params, state=copula_state(n_sims, len(L), model_params.get('dof', T_COPULA_DOF), rng))
+
+    with np.errstate(divide='ignore'):
+        log_prices = np.tile(np.log(np.asarray(S0_list, dtype=float)), (n_sims, 1))
+
+    for start in range(0, n_steps, block_steps):
+        k = min(block_steps, n_steps - start)
+        increments = log_increments(mu_list, sigma_list, L, dt, k, n_sims, model, rng, method, **model_params)
+
+        log_block = log_prices + np.cumsum(increments, axis=0)
+        log_prices = log_block[-1]
+        yield np.exp(log_block)
+
+def _exact_t_to_normal(x, dof):
+    # Through the lower tail, where stdtr keeps its precision far from the centre
+    return np.sign(x) * -ndtri(stdtr(dof, -np.abs(x)))
+
+def t_to_normal(x, dof):
+    """
+    ndtri(stdtr(dof, x)): Student-t draws mapped to the standard normals with the
+    same quantile. The exact special functions cost several times a whole GBM
+    step, so the map is interpolated from a uniform grid cached per `dof`
+    (error below 1e-6 for dof >= 2).
+    """
+    if dof not in _copula_tables:
+        grid = np.linspace(-COPULA_GRID_LIMIT, COPULA_GRID_LIMIT, COPULA_GRID_POINTS)
+        # Clipped where stdtr underflows, i.e. for draws no t distribution with this dof produces
+        _copula_tables[dof] = np.clip(_exact_t_to_normal(grid, dof), -40.0, 40.0)
+    table = _copula_tables[dof]
+
+    last = COPULA_GRID_POINTS - 1
+    position = x * (last / (2 * COPULA_GRID_LIMIT))
+    position += last / 2
+    np.clip(position, 0, last, out=position)
+    index = position.astype(np.intp)
+    np.minimum(index, last - 1, out=index)
+    position -= index
+
+    normals = table[index]
+    step = table[1:][index]
+    step -= normals
+    step *= position
+    normals += step
+
+    if x.max() > COPULA_GRID_LIMIT or x.min() < -COPULA_GRID_LIMIT:
+        outside = np.abs(x) > COPULA_GRID_LIMIT
+        normals[outside] = _exact_t_to_normal(x[outside], dof)
+    return normals
+
+def copula_state(n_sims, n_assets, dof=T_COPULA_DOF, rng=None):
+    """
+    What the t copula carries along a path: one chi-square / dof mixing variable
+    per scenario, shared by every step, and the correlated Brownian motion, time
+    and copula level reached so far.
+    """
+    rng = np.random if rng is None else rng
+    return {
+        'mixing': rng.chisquare(dof, size=(n_sims, 1)) / dof,
+        'brownian': np.zeros((n_sims, n_assets)),
+        't': 0.0,
+        'level': 0.0
+    }
+
+def log_increments(mu_list, sigma_list, L, dt, n_steps, n_sims, model="gbm", rng=None, method="pseudo",
+                   dof=T_COPULA_DOF, state=None, jump_intensity=JUMP_INTENSITY, jump_mean=JUMP_MEAN,
+                   jump_std=JUMP_STD):
+    """
+    Correlated log-price increments over `n_steps` steps of length `dt` (years).
+    model: 'gbm' Gaussian shocks;
+      't_copula' Gaussian marginals joined by a Student-t copula with `dof` degrees of
+      freedom at every step: the correlated Brownian motion B_t divided by
+      sqrt(mixing * t), with one chi-square mixing variable per scenario (see
+      copula_state), is multivariate t, and is mapped back to normal marginals.
+      Large moves coincide without changing each asset's volatility, and whole paths
+      end with the same joint distribution as a single step to the horizon. Paths
+      generated in pieces pass the same `state` to every piece;
+      'jump' Merton jump-diffusion: market-wide jumps arrive as a Poisson process with
+      `jump_intensity` per year, and each asset's log jump is
+      sigma * N(jump_mean, jump_std^2), correlated by L. The diffusion volatility is
+      lowered so total variance stays sigma^2, and the drift is compensated so
+      E[S_T] is unchanged.
+    The Gaussian shocks come from standard_normals (`method`); the mixing and jump
+    draws always use `rng`.
+    Returns: (n_steps x n_sims x n_assets)
+    """
+    mu = np.asarray(mu_list, dtype=float)
+    sigma = np.asarray(sigma_list, dtype=float)
+
+    # Drawn ahead of the shocks, as in correlated_gbm_blocks, so blocks reproduce whole paths
+    if model == "t_copula" and state is None:
+        state = copula_state(n_sims, len(L), dof, rng)
+
+    Z_corr = standard_normals((n_steps, n_sims, L.shape[1]), sim_axis=1, rng=rng, method=method) @ L.T
+    rng = np.random if rng is None else rng
+
+    if model == "gbm":
+        return (mu - 0.5 * sigma**2) * dt + sigma * np.sqrt(dt) * Z_corr
+
+    if model == "t_copula":
+        Z_corr *= np.sqrt(dt)
+        brownian = np.cumsum(Z_corr, axis=0, out=Z_corr)
+        if state['t'] > 0:
+            brownian += state['brownian']
+        t = state['t'] + dt * np.arange(1, n_steps + 1)[:, None, None]
+        state.update(brownian=brownian[-1].copy(), t=float(t[-1, 0, 0]))
+
+        # sqrt(t) * N(0, 1) level of the copula at every step; its increments drive the prices
+        brownian /= np.sqrt(state['mixing'] * t)
+        levels = t_to_normal(brownian, dof)
+        levels *= np.sqrt(t)
+        level_start, state['level'] = state['level'], levels[-1].copy()
+        levels[1:] -= levels[:-1]
+        levels[0] -= level_start
+        levels *= sigma
+        levels += (mu - 0.5 * sigma**2) * dt
+        return levels
+
+    if model == "jump":
+        jump_variance = jump_intensity * (jump_mean**2 + jump_std**2)
+        if jump_variance >= 1:
+            raise ValueError("Jump variance exceeds the asset variance; lower the jump intensity or sizes")
+
+        diffusion_sigma = sigma * np.sqrt(1 - jump_variance)
+        compensator = jump_intensity * (np.exp(sigma * jump_mean + 0.5 * (sigma * jump_std)**2) - 1)
+
+        # Given the number of jumps in a step, the diffusion and the jump sizes are both
+        # sigma-proportional normals correlated by L, so one shock with their combined
+        # variance is exact and no separate jump shocks are needed
+        n_jumps = rng.poisson(jump_intensity * dt, size=(n_steps, n_sims, 1))
+        scale = np.sqrt((1 - jump_variance) * dt + n_jumps * jump_std**2)
+        return (mu - 0.5 * diffusion_sigma**2 - compensator) * dt + sigma * (n_jumps * jump_mean + scale * Z_corr)
+
+    raise ValueError(f"Unknown price model: {model}")
+
+def correlated_model_paths(S0_list, mu_list, sigma_list, corr_matrix, T, n_steps, n_sims, model="gbm", rng=None,
+                           method="pseudo", **model_params):
+    """
+    correlated_geometric_brownian_motion for any model of log_increments.
+    Returns: ((n_steps + 1) x n_sims x n_assets) prices
+    """
+    L = correlation_factor(corr_matrix)
+
+    increments = log_increments(mu_list, sigma_list, L, T / n_steps, n_steps, n_sims, model, rng, method, **model_params)
+
+    paths = np.empty((n_steps + 1, n_sims, len(S0_list)))
+    paths[0] = S0_list
+    np.cumsum(increments, axis=0, out=paths[1:])
+    np.exp(paths[1:], out=paths[1:])
+    paths[1:] *= np.asarray(S0_list, dtype=float)
+    return paths
+
+def correlated_model_terminal_prices(S0_list, mu_list, sigma_list, corr_matrix, T, n_sims, model="gbm", rng=None,
+                                     method="pseudo", **model_params):
+    """
+    Prices at the horizon T from a single step of log_increments; for every model
+    this is the joint distribution whole paths end with.
+    Returns: (n_sims x n_assets) matrix of prices
+    """
+    L = correlation_factor(corr_matrix)
+
+    increments = log_increments(mu_list, sigma_list, L, T, 1, n_sims, model, rng, method, **model_params)[0]
+    return np.asarray(S0_list, dtype=float) * np.exp(increments)
+
+def correlated_model_at_horizons(S0_list, mu_list, sigma_list, corr_matrix, horizons, n_sims, model="gbm", rng=None,
+                                 method="pseudo", **model_params):
+    """
+    Prices at increasing times `horizons` (in years) from one step of
+    log_increments per gap between consecutive horizons, so every horizon extends
+    the same scenarios (the t copula carries its state across the gaps).
+    Returns: (n_horizons x n_sims x n_assets)
+    """
+    L = correlation_factor(corr_matrix)
+    if model == "t_copula" and model_params.get('state') is None:
+        model_params = dict(model_params, state=copula_state(n_sims, len(L), model_params.get('dof', T_COPULA_DOF), rng))
+
+    gaps = np.diff(np.r_[0.0, np.asarray(horizons, dtype=float)])
+    log_returns = np.cumsum([
+        log_increments(mu_list, sigma_list, L, gap, 1, n_sims, model, rng, method, **model_params)[0] for gap in gaps
+    ], axis=0)
+    return np.asarray(S0_list, dtype=float) * np.exp(log_returns)
+
+def correlated_terminal_prices(S0_list, mu_list, sigma_list, corr_matrix, T, n_sims, rng=None, method="pseudo"):
+    """
+    Draw correlated GBM prices at the horizon T directly.
+    Same terminal distribution as correlated_geometric_brownian_motion(...)[-1],
+    but memory is O(n_sims x n_assets) instead of O(n_steps x n_sims x n_assets).
+    Returns: (n_sims x n_assets) matrix of prices
+    """
+    L = correlation_factor(corr_matrix)
+
+    Z_uncorr = standard_normals((n_sims, L.shape[1]), rng=rng, method=method)
+    return terminal_prices_from_shocks(S0_list, mu_list, sigma_list, L, T, Z_uncorr)
+
+def terminal_prices_from_shocks(S0_list, mu_list, sigma_list, L, T, Z_uncorr):
+    """
+    Map (n_sims x k) uncorrelated standard normal shocks to terminal prices
+    using the (n_assets x k) correlation factor L.
+    """
+    S0 = np.asarray(S0_list, dtype=float)
+    mu = np.asarray(mu_list, dtype=float)
+    sigma = np.asarray(sigma_list, dtype=float)
+
+    Z_corr = np.dot(Z_uncorr, L.T)
+
+    log_returns = (mu - 0.5 * sigma**2) * T + sigma * np.sqrt(T) * Z_corr
+    return S0 * np.exp(log_returns)
+
+def correlated_brownian_paths(corr_matrix, T, n_steps, n_sims, rng=None, method="pseudo"):
+    """
+    Correlated standard Brownian motion at every step of [0, T].
+    Returns: ((n_steps + 1) x n_sims x n_assets), with W[0] = 0
+    """
+    L = correlation_factor(corr_matrix)
+
+    Z_uncorr = standard_normals((n_steps, n_sims, L.shape[1]), sim_axis=1, rng=rng, method=method)
+
+    W = np.zeros((n_steps + 1, n_sims, len(L)))
+    np.cumsum(np.sqrt(T / n_steps) * (Z_uncorr @ L.T), axis=0, out=W[1:])
+    return W
+
+def correlated_brownian_at_horizons(corr_matrix, horizons, n_sims, rng=None, method="pseudo"):
+    """
+    Correlated standard Brownian motion at increasing times `horizons` (in years),
+    built from one independent increment per gap between consecutive horizons.
+    Prices at every horizon come from the same draws (see gbm_from_brownian), so
+    the horizons are consistent with each other.
+    Returns: (n_horizons x n_sims x n_assets)
+    """
+    L = correlation_factor(corr_matrix)
+    gaps = np.diff(np.r_[0.0, np.asarray(horizons, dtype=float)])
+
+    Z_uncorr = standard_normals((len(gaps), n_sims, L.shape[1]), sim_axis=1, rng=rng, method=method)
+    return np.cumsum(np.sqrt(gaps)[:, None, None] * (Z_uncorr @ L.T), axis=0)
+
+def gbm_from_brownian(S0, mu, sigma, t, W):
+    """
+    GBM prices S0 * exp((mu - sigma^2 / 2) * t + sigma * W) from standard Brownian
+    values W at times t (in years). All arguments broadcast, so one W can be
+    read at several horizons, or with a different sigma per horizon.
+    """
+    return S0 * np.exp((mu - 0.5 * sigma**2) * t + sigma * W)
+
+def crash_shift(corr_matrix, magnitude):
+    """
+    Mean shift for the uncorrelated shocks that moves the correlated shocks along the
+    leading eigenvector of the correlation matrix, in the direction of a joint fall.
+    A shift of `magnitude` standard deviations is the smallest one that moves the
+    correlated shocks by sqrt(lambda_max) * magnitude along that eigenvector.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(corr_matrix)
+    direction = eigenvectors[:, -1]
+    if direction.sum() > 0:
+        direction = -direction
+
+    L = correlation_factor(corr_matrix)
+    shift = L.T @ direction
+    return magnitude * shift / np.linalg.norm(shift)
+
+def importance_sampled_terminal_prices(S0_list, mu_list, sigma_list, corr_matrix, T, n_sims, shift, rng=None, method="pseudo"):
+    """
+    Correlated terminal prices with the uncorrelated shocks drawn from N(shift, I)
+    instead of N(0, I); `shift` has one entry per column of correlation_factor.
+    Returns: (prices, weights) where weights are the likelihood ratios that make
+    weighted averages over the scenarios unbiased under the original model.
+    """
+    shift = np.asarray(shift, dtype=float)
+
+    L = correlation_factor(corr_matrix)
+
+    Z_uncorr = standard_normals((n_sims, L.shape[1]), rng=rng, method=method) + shift
+    weights = np.exp(-Z_uncorr @ shift + 0.5 * shift @ shift)
+
+    return terminal_prices_from_shocks(S0_list, mu_list, sigma_list, L, T, Z_uncorr), weights
+
 def main():
     df = load_simulation_data()
     if df is None:
@@ -80,6 +414,9 @@ def main():
     
     terms_list = [('Short', 30, 'vol_Short'), ('Mid', 90, 'vol_Mid'), ('Long', 365, 'vol_Long')]
     n_terms = len(terms_list)
+    horizons = np.array([days for _, days, _ in terms_list])
+    max_days = horizons.max()
+    n_plot_paths = min(100, NUM_SIMULATIONS)
     
     fig, axes = plt.subplots(nrows=n_assets, ncols=n_terms, figsize=(18, 4 * n_assets))
     
@@ -87,6 +424,15 @@ def main():
 
     for i, asset in enumerate(assets):
         row_data = df[df['symbol'] == asset].iloc[0]
+
+        # One Brownian draw per asset serves every term: shorter terms read the
+        # start of the longest path, each with its own volatility
+        if SAMPLER_MODE == "terminal":
+            W_terminal = correlated_brownian_at_horizons([[1.0]], horizons / 365.0, NUM_SIMULATIONS, method=SAMPLING_METHOD)[:, :, 0]
+            W_paths = correlated_brownian_paths([[1.0]], max_days / 365.0, max_days, n_plot_paths)[:, :, 0]
+        else:
+            W_paths = correlated_brownian_paths([[1.0]], max_days / 365.0, max_days, NUM_SIMULATIONS, method=SAMPLING_METHOD)[:, :, 0]
+            W_terminal = W_paths[horizons]
         
         for j, (term_name, days, col_vol) in enumerate(terms_list):
             ax = axes[i, j]
@@ -104,17 +450,14 @@ def main():
                 S0 = 1.0
                 
             mu = 0.0
-            T_years = days / 365.0
-            n_steps = days
-            
-            paths = geometric_brownian_motion(S0, mu, vol, T_years, n_steps, NUM_SIMULATIONS)
-            final_prices = paths[-1]
+            t_grid = np.arange(days + 1)[:, None] / 365.0
+            paths = gbm_from_brownian(S0, mu, vol, t_grid, W_paths[:days + 1, :n_plot_paths])
+            final_prices = gbm_from_brownian(S0, mu, vol, days / 365.0, W_terminal[j])
             
             percentile_0_1 = np.percentile(final_prices, 0.1) # 99.9% confidence
             var_price_level = percentile_0_1
             
-            n_plot_paths = min(100, NUM_SIMULATIONS)
-            ax.plot(paths[:, :n_plot_paths], alpha=0.15, color='royalblue', linewidth=0.5)
+            ax.plot(paths, alpha=0.15, color='royalblue', linewidth=0.5)
             
             ax.axhline(y=var_price_level, color='red', linestyle='--', linewidth=2, label=f'VaR 99.9% Price')
             
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+
+STORE_DIR = "data/active_positions"
+
+# Column name -> on-disk dtype. Symbols are dictionary-encoded and users are
+# integer indices into user_ids, so every column is fixed-width and memory-mappable.
+COLUMNS = {
+    "user_index": "<i4",
+    "symbol_code": "<i4",
+    "collateral_amount": "<f8",
+    "debt_amount": "<f8",
+    "is_collateral": "|b1",
+    "price": "<f8"
+}
+USER_ID_DTYPE = "|S42"
+
+class PositionStoreWriter:
+    """
+    Append position records to a columnar store, one raw binary file per column.
+    Rows of a user must arrive together, as they do from bad_debt.iter_active_positions.
+    The store is built in `<store_dir>.partial` and moved into place by close().
+    """
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self.partial_dir = store_dir + ".partial"
+        shutil.rmtree(self.partial_dir, ignore_errors=True)
+        os.makedirs(self.partial_dir)
+
+        self.files = {name: open(os.path.join(self.partial_dir, f"{name}.bin"), 'wb') for name in COLUMNS}
+        self.user_file = open(os.path.join(self.partial_dir, "user_ids.bin"), 'wb')
+        self.symbol_codes = {}
+        self.n_rows = 0
+        self.n_users = 0
+        self.last_user_id = None
+
+    def append(self, positions):
+        """
+        Append a DataFrame of positions (bad_debt.POSITION_COLUMNS).
+        """
+        if positions.empty:
+            return
+
+        user_ids = positions["user_id"].to_numpy()
+        starts_user = np.empty(len(user_ids), dtype=bool)
+        starts_user[0] = user_ids[0] != self.last_user_id
+        starts_user[1:] = user_ids[1:] != user_ids[:-1]
+        user_index = self.n_users - 1 + np.cumsum(starts_user)
+
+        self.n_users += int(starts_user.sum())
+        self.last_user_id = user_ids[-1]
+
+        for symbol in pd.unique(positions["symbol"]):
+            self.symbol_codes.setdefault(symbol, len(self.symbol_codes))
+
+        columns = {
+            "user_index": user_index,
+            "symbol_code": positions["symbol"].map(self.symbol_codes).to_numpy(),
+            "collateral_amount": positions["collateral_amount"].to_numpy(),
+            "debt_amount": positions["debt_amount"].to_numpy(),
+            "is_collateral": positions["is_collateral"].to_numpy(),
+            "price": positions["price"].to_numpy()
+        }
+        for name, values in columns.items():
+            np.asarray(values, dtype=COLUMNS[name]).tofile(self.files[name])
+        np.asarray(user_ids[starts_user], dtype=USER_ID_DTYPE).tofile(self.user_file)
+
+        self.n_rows += len(positions)
+
+    def close(self):
+        for f in list(self.files.values()) + [self.user_file]:
+            f.close()
+
+        meta = {
+            "n_rows": self.n_rows,
+            "n_users": self.n_users,
+            "columns": COLUMNS,
+            "user_id_dtype": USER_ID_DTYPE,
+            "symbols": sorted(self.symbol_codes, key=self.symbol_codes.get)
+        }
+        with open(os.path.join(self.partial_dir, "meta.json"), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+        os.replace(self.partial_dir, self.store_dir)
+
+    def abort(self):
+        for f in list(self.files.values()) + [self.user_file]:
+            f.close()
+        shutil.rmtree(self.partial_dir, ignore_errors=True)
+
+def _map_column(path, dtype, n):
+    if n == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(n,))
+
+def load_position_store(store_dir=STORE_DIR):
+    """
+    Memory-map a columnar position store. Nothing is parsed or copied; columns
+    are read from the page cache on first access.
+    Returns: dict with the column arrays, plus symbols (list) and user_ids (bytes array)
+    """
+    with open(os.path.join(store_dir, "meta.json"), 'r') as f:
+        meta = json.load(f)
+
+    store = {
+        name: _map_column(os.path.join(store_dir, f"{name}.bin"), dtype, meta["n_rows"])
+        for name, dtype in meta["columns"].items()
+    }
+    store["symbols"] = meta["symbols"]
+    store["user_ids"] = _map_column(os.path.join(store_dir, "user_ids.bin"), meta["user_id_dtype"], meta["n_users"])
+    return store
@@ -0,0 +1,173 @@
+import pandas as pd
+import asyncio
+import os
+from io import StringIO
+from http_client import TokenBucket, make_session, request_with_backoff, gather_limited
+
+CACHE_DIR = "data/price_cache"
+CSV_EXPORT_URL = "https://www.coingecko.com/price_charts/export/{coin_id}/{currency}.csv"
+API_RANGE_URL = "https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart/range"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0"
+}
+# Shared CoinGecko request budget, across every concurrent fetch
+REQUESTS_PER_MINUTE = 30
+REQUEST_BURST = 5
+MAX_CONCURRENCY = 8
+# Days of history requested from the API when the CSV export is unavailable
+API_FALLBACK_DAYS = 365
+
+RATE_LIMITER = TokenBucket(REQUESTS_PER_MINUTE / 60.0, REQUEST_BURST)
+
+_session = None
+
+def shared_session():
+    global _session
+    if _session is None:
+        _session = make_session(MAX_CONCURRENCY)
+    return _session
+
+def cache_path(coin_id, currency="usd", cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{coin_id}_{currency}.csv")
+
+def load_cached_prices(coin_id, currency="usd", cache_dir=CACHE_DIR):
+    path = cache_path(coin_id, currency, cache_dir)
+    if not os.path.exists(path):
+        return None
+
+    df = pd.read_csv(path)
+    if df.empty:
+        return None
+
+    df['date'] = pd.to_datetime(df['date'], utc=True)
+    return df.set_index('date')['price']
+
+def save_cached_prices(series, coin_id, currency="usd", cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(coin_id, currency, cache_dir)
+
+    tmp_path = path + ".tmp"
+    series.rename('price').rename_axis('date').to_frame().to_csv(tmp_path)
+    os.replace(tmp_path, path)
+
+def _get(url, params=None, session=None):
+    session = session if session is not None else shared_session()
+    return request_with_backoff(session, "GET", url, limiter=RATE_LIMITER, params=params, headers=HEADERS, timeout=10)
+
+def to_daily(df, time_col, how='last'):
+    df['timestamp'] = pd.to_datetime(df[time_col], utc=True)
+    df.set_index('timestamp', inplace=True)
+    df.sort_index(inplace=True)
+    df = df.resample('D').agg({'price': how}).dropna(subset=['price'])
+    return df['price']
+
+def fetch_export_history(coin_id, currency="usd", csv_url=CSV_EXPORT_URL, session=None):
+    """
+    Full daily history from the CoinGecko CSV export.
+    """
+    try:
+        response = _get(csv_url.format(coin_id=coin_id, currency=currency), session=session)
+        if response.status_code != 200:
+            print(f"  Failed to fetch CSV for {coin_id}. Status: {response.status_code}")
+            return None
+
+        try:
+            df = pd.read_csv(StringIO(response.text))
+        except pd.errors.ParserError:
+            print(f"  Error parsing CSV for {coin_id}")
+            return None
+    except Exception as e:
+        print(f"  Error fetching {coin_id}: {e}")
+        return None
+
+    if df.empty:
+        return None
+
+    df.columns = [c.lower() for c in df.columns]
+    if 'snapped_at' in df.columns:
+        return to_daily(df, 'snapped_at')
+    if 'timestamp' in df.columns:
+        return to_daily(df, 'timestamp')
+
+    print(f"  Unknown columns for {coin_id}: {df.columns}")
+    return None
+
+def fetch_range_history(coin_id, start, end, currency="usd", api_url=API_RANGE_URL, session=None):
+    """
+    Daily prices between two timestamps from the CoinGecko market_chart/range API.
+    """
+    params = {
+        "vs_currency": currency,
+        "from": int(start.timestamp()),
+        "to": int(end.timestamp())
+    }
+
+    try:
+        response = _get(api_url.format(coin_id=coin_id), params=params, session=session)
+        if response.status_code != 200:
+            print(f"  API failed for {coin_id}. Status: {response.status_code}")
+            return None
+
+        data = response.json()
+    except Exception as e:
+        print(f"  API Error {coin_id}: {e}")
+        return None
+
+    if not data.get('prices'):
+        return None
+
+    df = pd.DataFrame(data['prices'], columns=["snapped_at", "price"])
+    df['snapped_at'] = pd.to_datetime(df['snapped_at'], unit='ms', utc=True)
+    # Intraday API points are reduced to the 00:00 UTC snapshot, as in the CSV export
+    return to_daily(df, 'snapped_at', how='first')
+
+def get_price_history(coin_id, currency="usd", cache_dir=CACHE_DIR, csv_url=CSV_EXPORT_URL,
+                      api_url=API_RANGE_URL, session=None):
+    """
+    Daily price series for a coin, served from the local cache.
+    A cold cache downloads the full history once; afterwards only the days after
+    the last cached date are requested, and a cache that already holds today's
+    price makes no request at all.
+    Returns: pd.Series of prices indexed by UTC date, or None
+    """
+    cached = load_cached_prices(coin_id, currency, cache_dir)
+    now = pd.Timestamp.now(tz='UTC')
+    today = now.normalize()
+
+    if cached is not None and cached.index[-1] >= today:
+        return cached
+
+    if cached is None:
+        series = fetch_export_history(coin_id, currency, csv_url, session)
+        if series is None:
+            series = fetch_range_history(coin_id, now - pd.Timedelta(days=API_FALLBACK_DAYS), now,
+                                         currency, api_url, session)
+    else:
+        recent = fetch_range_history(coin_id, cached.index[-1] + pd.Timedelta(days=1), now, currency, api_url, session)
+        if recent is None:
+            print(f"  Using cached prices for {coin_id} up to {cached.index[-1].date()}")
+            return cached
+
+        series = pd.concat([cached, recent])
+        series = series[~series.index.duplicated(keep='last')].sort_index()
+
+    if series is None or series.empty:
+        return cached
+
+    save_cached_prices(series, coin_id, currency, cache_dir)
+    return series
+
+def fetch_price_histories(coin_ids, currency="usd", max_concurrency=MAX_CONCURRENCY, **kwargs):
+    """
+    get_price_history for many coins concurrently over the shared connection pool.
+    Requests are paced by RATE_LIMITER, so wall time follows the API quota rather
+    than the number of coins.
+    Returns: dict of coin_id -> pd.Series (or None)
+    """
+    coin_ids = list(coin_ids)
+
+    def fetch(coin_id):
+        return get_price_history(coin_id, currency, **kwargs)
+
+    results = asyncio.run(gather_limited(fetch, coin_ids, max_concurrency))
+    return dict(zip(coin_ids, results))
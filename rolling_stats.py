@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+
+STATE_DIR = "data/rolling_stats"
+# Trailing windows (in daily returns) kept alongside the full-history statistics
+WINDOWS = (30, 90, 365)
+# RiskMetrics decay for the EWMA covariance
+EWMA_LAMBDA = 0.94
+
+class RollingMoments:
+    """
+    Incremental daily return statistics for a fixed list of assets: sums and
+    cross-products over all history and over each trailing window, plus a
+    zero-mean EWMA covariance. The last max(windows) returns are kept so the
+    ones leaving a window can be subtracted; a new day costs
+    O(n_windows x n_assets^2) and never rescans history.
+    kind: 'log' or 'simple' (pct_change) returns
+    """
+
+    def __init__(self, assets, windows=WINDOWS, kind="log", ewma_lambda=EWMA_LAMBDA):
+        n_assets = len(assets)
+        self.assets = list(assets)
+        self.windows = tuple(sorted(windows))
+        self.kind = kind
+        self.ewma_lambda = ewma_lambda
+
+        self.first_date = None
+        self.last_date = None
+        self.last_prices = None
+
+        self.count = 0
+        self.total = np.zeros(n_assets)
+        self.cross = np.zeros((n_assets, n_assets))
+        self.recent = np.empty((0, n_assets))
+        self.window_total = np.zeros((len(self.windows), n_assets))
+        self.window_cross = np.zeros((len(self.windows), n_assets, n_assets))
+        self.ewma_weight = 0.0
+        self.ewma_cross = np.zeros((n_assets, n_assets))
+
+    def update(self, prices):
+        """
+        Fold in daily prices: a DataFrame with the assets as columns, holding only
+        dates after last_date.
+        """
+        if prices.empty:
+            return
+
+        values = prices[self.assets].to_numpy(dtype=float)
+        if self.first_date is None:
+            self.first_date = prices.index[0]
+        if self.last_prices is not None:
+            values = np.vstack([self.last_prices, values])
+
+        ratio = values[1:] / values[:-1]
+        self._add_returns(np.log(ratio) if self.kind == "log" else ratio - 1)
+
+        self.last_prices = values[-1]
+        self.last_date = prices.index[-1]
+
+    def _add_returns(self, returns):
+        if len(returns) == 0:
+            return
+
+        self.count += len(returns)
+        self.total += returns.sum(axis=0)
+        self.cross += returns.T @ returns
+
+        # Each window gains the new returns and loses the ones now more than `window` back
+        history = np.vstack([self.recent, returns])
+        for i, window in enumerate(self.windows):
+            leaving = history[max(0, len(self.recent) - window):max(0, len(history) - window)]
+            self.window_total[i] += returns.sum(axis=0) - leaving.sum(axis=0)
+            self.window_cross[i] += returns.T @ returns - leaving.T @ leaving
+        self.recent = history[len(history) - max(self.windows, default=0):]
+
+        weights = self.ewma_lambda ** np.arange(len(returns) - 1, -1, -1)
+        decay = self.ewma_lambda ** len(returns)
+        self.ewma_cross = decay * self.ewma_cross + (1 - self.ewma_lambda) * (returns * weights[:, None]).T @ returns
+        self.ewma_weight = decay * self.ewma_weight + (1 - self.ewma_lambda) * weights.sum()
+
+    def covariance(self, window=None):
+        """
+        Daily return covariance (ddof=1) over all history (None), the last `window`
+        returns (one of self.windows), or 'ewma' (zero mean, bias corrected).
+        """
+        n_assets = len(self.assets)
+        if window == "ewma":
+            if self.ewma_weight == 0:
+                return np.full((n_assets, n_assets), np.nan)
+            return self.ewma_cross / self.ewma_weight
+
+        if window is None:
+            n, total, cross = self.count, self.total, self.cross
+        else:
+            i = self.windows.index(window)
+            n, total, cross = min(self.count, window), self.window_total[i], self.window_cross[i]
+
+        if n < 2:
+            return np.full((n_assets, n_assets), np.nan)
+        return (cross - np.outer(total, total) / n) / (n - 1)
+
+    def correlation(self, window=None):
+        covariance = self.covariance(window)
+        std = np.sqrt(np.diag(covariance))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return covariance / np.outer(std, std)
+
+    def volatility(self, window=None, periods_per_year=365):
+        """
+        Annualised volatility per asset (see covariance for `window`).
+        """
+        return np.sqrt(np.maximum(np.diag(self.covariance(window)), 0.0) * periods_per_year)
+
+    def matches(self, prices, windows, kind, ewma_lambda):
+        """
+        Whether `prices` extends the history this state was built from: same
+        assets and settings, same first date, and an unchanged price on last_date.
+        Earlier prices are assumed unchanged (the price cache only appends days).
+        """
+        if (self.assets != list(prices.columns) or self.windows != tuple(sorted(windows)) or self.kind != kind
+                or self.ewma_lambda != ewma_lambda or self.last_date is None):
+            return False
+        if prices.index[0] != self.first_date or self.last_date not in prices.index:
+            return False
+        return np.allclose(prices.loc[self.last_date, self.assets].to_numpy(dtype=float), self.last_prices,
+                           rtol=1e-12, atol=0.0)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        metadata = {
+            'assets': self.assets, 'windows': list(self.windows), 'kind': self.kind, 'ewma_lambda': self.ewma_lambda,
+            'count': self.count, 'ewma_weight': self.ewma_weight,
+            'first_date': None if self.first_date is None else str(self.first_date),
+            'last_date': None if self.last_date is None else str(self.last_date)
+        }
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f, metadata=json.dumps(metadata), last_prices=np.asarray(self.last_prices if self.last_prices is not None else []),
+                total=self.total, cross=self.cross, recent=self.recent, window_total=self.window_total,
+                window_cross=self.window_cross, ewma_cross=self.ewma_cross
+            )
+        os.replace(tmp_path, path)
+
+def load_moments(path):
+    """
+    RollingMoments saved at `path`, or None.
+    """
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path, allow_pickle=False) as data:
+        metadata = json.loads(str(data['metadata']))
+        moments = RollingMoments(metadata['assets'], metadata['windows'], metadata['kind'], metadata['ewma_lambda'])
+        moments.count = metadata['count']
+        moments.ewma_weight = metadata['ewma_weight']
+        if metadata['first_date'] is not None:
+            moments.first_date = pd.Timestamp(metadata['first_date'])
+            moments.last_date = pd.Timestamp(metadata['last_date'])
+            moments.last_prices = data['last_prices']
+        for name in ('total', 'cross', 'recent', 'window_total', 'window_cross', 'ewma_cross'):
+            setattr(moments, name, data[name])
+    return moments
+
+def updated_moments(prices, path, windows=WINDOWS, kind="log", ewma_lambda=EWMA_LAMBDA):
+    """
+    Statistics of the daily `prices` frame, updated from the state saved at `path`
+    with only the rows after its last date. The state is rebuilt from the full
+    history when it does not match (see RollingMoments.matches).
+    Returns: RollingMoments
+    """
+    moments = load_moments(path)
+    if moments is None or not moments.matches(prices, windows, kind, ewma_lambda):
+        moments = RollingMoments(list(prices.columns), windows, kind, ewma_lambda)
+
+    new_rows = prices if moments.last_date is None else prices[prices.index > moments.last_date]
+    moments.update(new_rows)
+    moments.save(path)
+    return moments
@@ -0,0 +1,109 @@
+import numpy as np
+import hashlib
+import json
+import os
+
+CACHE_DIR = "data/scenario_cache"
+# Least recently used scenario files are evicted above this total size
+MAX_CACHE_BYTES = 2 * 1024**3
+# Part of every key: bump whenever the samplers change the draws for the same inputs,
+# so matrices from older code are not served (2: t-copula mixing shared along each path)
+SCENARIO_CACHE_VERSION = 2
+
+def _seed_fingerprint(seed):
+    if isinstance(seed, np.random.SeedSequence):
+        return {'entropy': str(seed.entropy), 'spawn_key': list(seed.spawn_key)}
+    return {'entropy': str(seed)}
+
+def scenario_key(S0_list, mu_list, sigma_list, correlation_matrix, T, n_steps, n_sims, seed, mode, method, stream=""):
+    """
+    Content hash of everything that determines a scenario matrix: the market
+    inputs (bit-exact), horizon, number of steps and scenarios, seed (an int or a
+    SeedSequence), sampler mode and method, and SCENARIO_CACHE_VERSION. `stream`
+    separates draws that use the same seed in different ways.
+    """
+    digest = hashlib.sha256()
+    for values in (S0_list, mu_list, sigma_list, correlation_matrix):
+        array = np.ascontiguousarray(values, dtype='<f8')
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+
+    settings = {
+        'T': float(T), 'n_steps': int(n_steps), 'n_sims': int(n_sims), 'seed': _seed_fingerprint(seed),
+        'mode': mode, 'method': method, 'stream': stream, 'version': SCENARIO_CACHE_VERSION
+    }
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def _cache_path(key, cache_dir):
+    return os.path.join(cache_dir, f"{key}.npy")
+
+def load_scenarios(key, cache_dir=CACHE_DIR):
+    """
+    Memory-map a cached scenario matrix (read-only), or return None.
+    Loading marks the file as recently used.
+    """
+    path = _cache_path(key, cache_dir)
+    try:
+        scenarios = np.load(path, mmap_mode='r')
+    except (FileNotFoundError, ValueError):
+        return None
+
+    # Another process may evict the file once it is mapped; the mapping stays valid
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return scenarios
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, keep=None):
+    """
+    Delete the least recently used scenario files until the cache fits in `max_bytes`.
+    The file for `keep` is never deleted. Files removed meanwhile by another
+    process (e.g. a worker evicting at the same time) are skipped.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".npy"):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        if keep is not None and name == f"{keep}.npy":
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def save_scenarios(key, scenarios, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(key, cache_dir)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(scenarios, dtype=float))
+    os.replace(tmp_path, path)
+
+    evict(cache_dir, max_bytes, keep=key)
+
+def cached_scenarios(key, generate, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Scenario matrix for `key` from the cache, or from `generate()` (then cached).
+    Returns: read-only memory-mapped array on a hit, the generated array otherwise
+    """
+    scenarios = load_scenarios(key, cache_dir)
+    if scenarios is not None:
+        return scenarios
+
+    scenarios = generate()
+    save_scenarios(key, scenarios, cache_dir, max_bytes)
+    return scenarios
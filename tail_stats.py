@@ -0,0 +1,255 @@
+import warnings
+
+import numpy as np
+from scipy.stats import norm
+
+# t-digest compression: roughly the number of centroids kept for the body of the distribution
+SKETCH_COMPRESSION = 200
+
+def rank_bounds(num_values, percentile, confidence):
+    """
+    0-based ranks (ascending) of the order statistics bounding a distribution-free
+    `confidence` interval for the `percentile` quantile (normal approximation of
+    the binomial count of values below the quantile).
+    """
+    p = percentile / 100.0
+    half_width = norm.ppf(0.5 + confidence / 2) * np.sqrt(num_values * p * (1 - p))
+    lo = max(0, int(np.floor(num_values * p - half_width)) - 1)
+    hi = min(num_values - 1, int(np.ceil(num_values * p + half_width)) - 1)
+    return lo, hi
+
+def tail_capacity(num_values, percentile, confidence=None):
+    """
+    Number of largest values needed to resolve `percentile` of `num_values`
+    exactly with np.percentile's linear interpolation, and with `confidence`
+    also the order statistics of its confidence interval.
+    """
+    lo = int(np.floor((num_values - 1) * percentile / 100.0))
+    if confidence is not None:
+        lo = min(lo, rank_bounds(num_values, percentile, confidence)[0])
+    return num_values - lo
+
+def weighted_tail_stats(values, weights, percentile):
+    """
+    VaR and expected shortfall from likelihood-ratio weighted samples
+    (importance sampling). Weights are normalised by the number of samples,
+    so the estimated tail probability above x is sum(w[values > x]) / n.
+    When the weights never add up to the tail probability, or the largest sample
+    alone carries all of it, the samples do not resolve the quantile (the shift put
+    the weight in the wrong place): both are NaN and a RuntimeWarning is issued.
+    Returns: (var, expected_shortfall)
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    n = values.size
+    alpha = 1.0 - percentile / 100.0
+
+    order = np.argsort(values)[::-1]
+    sorted_values = values[order]
+    tail_probability = np.cumsum(weights[order]) / n
+
+    if n == 0 or tail_probability[-1] < alpha:
+        covered = tail_probability[-1] if n else 0.0
+        warnings.warn(f"Weighted samples cover a tail probability of {covered:.3g}, below {alpha:.3g}; "
+                      f"VaR and expected shortfall are undefined", RuntimeWarning)
+        return np.nan, np.nan
+    if tail_probability[0] >= alpha:
+        warnings.warn(f"The largest sample alone carries a tail probability of {tail_probability[0]:.3g}, above "
+                      f"{alpha:.3g}; VaR and expected shortfall lie beyond the samples", RuntimeWarning)
+        return np.nan, np.nan
+
+    k = np.searchsorted(tail_probability, alpha)
+    var = sorted_values[k]
+
+    above = tail_probability[k - 1] if k > 0 else 0.0
+    tail_sum = np.sum(weights[order][:k] * sorted_values[:k]) / n
+    expected_shortfall = (tail_sum + (alpha - above) * var) / alpha
+    return var, expected_shortfall
+
+class QuantileSketch:
+    """
+    Mergeable t-digest style sketch of a distribution: sorted weighted centroids
+    that stay small near both ends (k1 scale function) and grow in the middle.
+    Memory is O(compression) regardless of how many values are pushed.
+    """
+
+    def __init__(self, compression=SKETCH_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._compress(np.concatenate([self.means, values]), np.concatenate([self.weights, np.ones(values.size)]))
+
+    def merge(self, other):
+        if other.weights.size == 0:
+            return
+
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+
+    def _compress(self, means, weights):
+        # Centroids are grouped by the integer part of the scale function at their left
+        # edge, so each covers at most about one unit of k and there are ~compression of them
+        order = np.argsort(means, kind='stable')
+        means = means[order]
+        weights = weights[order]
+
+        q_left = (np.cumsum(weights) - weights) / weights.sum()
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q_left - 1))
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, p):
+        """
+        Value below which a share `p` of the weight lies, interpolating between centroid centres.
+        A centroid spans at most one unit of k, so the rank error is about
+        2 * pi * sqrt(p * (1 - p)) / compression, shrinking to single values at the ends.
+        """
+        if self.weights.size == 0:
+            return np.nan
+
+        total = self.weights.sum()
+        centres = np.cumsum(self.weights) - self.weights / 2
+        return np.interp(p * total, np.r_[0.0, centres, total], np.r_[self.min, self.means, self.max])
+
+    def tail_moments(self, p):
+        """
+        Mean and variance of the values above the `p` quantile; the centroid
+        straddling it counts pro rata.
+        """
+        if self.weights.size == 0:
+            return np.nan, np.nan
+
+        upper = np.cumsum(self.weights)
+        share = np.clip((upper - p * upper[-1]) / self.weights, 0.0, 1.0) * self.weights
+        mean = (share * self.means).sum() / share.sum()
+        return mean, (share * (self.means - mean)**2).sum() / share.sum()
+
+class TailAccumulator:
+    """
+    Streaming summary of a distribution: running count, sum and max, the
+    exact largest `capacity` values for upper percentiles and expected
+    shortfall, and a QuantileSketch of the rest of the distribution.
+    Memory is O(capacity + compression) regardless of how many values are pushed,
+    and accumulators from separate chunks or processes merge exactly.
+    """
+
+    def __init__(self, capacity, compression=SKETCH_COMPRESSION):
+        self.capacity = int(capacity)
+        self.count = 0
+        self.total = 0.0
+        self.max = -np.inf
+        self.tail = np.empty(0)
+        self.sketch = QuantileSketch(compression)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+
+        self.count += values.size
+        self.total += values.sum()
+        self.max = max(self.max, values.max())
+
+        merged = np.concatenate([self.tail, values])
+        if merged.size > self.capacity:
+            merged = np.partition(merged, merged.size - self.capacity)[-self.capacity:]
+        self.tail = merged
+        self.sketch.update(values)
+
+    def merge(self, other):
+        """
+        Fold another accumulator (e.g. from a worker process) into this one.
+        """
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+        merged = np.concatenate([self.tail, other.tail])
+        if merged.size > self.capacity:
+            merged = np.partition(merged, merged.size - self.capacity)[-self.capacity:]
+        self.tail = merged
+        self.sketch.merge(other.sketch)
+
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+    def _order_statistics(self, ranks):
+        # Values at 0-based ascending ranks: exact inside the retained tail, sketched below it
+        ranks = np.asarray(ranks)
+        offset = self.count - self.tail.size
+        tail = np.sort(self.tail)
+
+        values = np.empty(ranks.shape)
+        exact = ranks >= offset
+        values[exact] = tail[ranks[exact] - offset]
+        values[~exact] = self.sketch.quantile((ranks[~exact] + 0.5) / self.count)
+        return values
+
+    def percentile(self, q):
+        """
+        np.percentile of everything pushed: exact while the two order statistics it
+        interpolates between are in the retained tail, from the sketch otherwise.
+        """
+        if self.count == 0:
+            return np.nan
+
+        h = (self.count - 1) * q / 100.0
+        lo = int(np.floor(h))
+        hi = min(lo + 1, self.count - 1)
+
+        v_lo, v_hi = self._order_statistics([lo, hi])
+        return v_lo + (h - lo) * (v_hi - v_lo)
+
+    def _tail_moments(self, q):
+        # Size, mean and variance of the worst ceil(count * (1 - q)) values
+        n_tail = max(1, int(np.ceil(self.count * (1 - q / 100.0))))
+        if n_tail <= self.tail.size:
+            worst = np.partition(self.tail, self.tail.size - n_tail)[-n_tail:]
+            return n_tail, worst.mean(), worst.var()
+        return (n_tail,) + self.sketch.tail_moments(q / 100.0)
+
+    def expected_shortfall(self, q):
+        """
+        Mean of the worst ceil(count * (1 - q)) values (exact when they are all retained).
+        """
+        if self.count == 0:
+            return np.nan
+        return self._tail_moments(q)[1]
+
+    def var_confidence_interval(self, q, confidence):
+        """
+        Distribution-free `confidence` interval for the `q` percentile, from the
+        order statistics at tail_stats.rank_bounds.
+        Returns: (lower, upper)
+        """
+        if self.count == 0:
+            return np.nan, np.nan
+        lower, upper = self._order_statistics(list(rank_bounds(self.count, q, confidence)))
+        return lower, upper
+
+    def es_confidence_interval(self, q, confidence):
+        """
+        Asymptotic normal `confidence` interval for the expected shortfall, with
+        variance (Var[X | X > VaR] + p * (ES - VaR)^2) / (n * (1 - p)).
+        Returns: (lower, upper)
+        """
+        if self.count == 0:
+            return np.nan, np.nan
+
+        n_tail, es, tail_variance = self._tail_moments(q)
+        var = self.percentile(q)
+        half_width = norm.ppf(0.5 + confidence / 2) * np.sqrt((tail_variance + q / 100.0 * (es - var)**2) / n_tail)
+        return es - half_width, es + half_width
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ASSETS = ["WETH", "USDC", "WBTC"]
+PRICES = {"WETH": 3000.0, "USDC": 1.0, "WBTC": 60000.0}
+
+@pytest.fixture
+def market_data():
+    return {
+        'assets': ASSETS,
+        'latest_prices': PRICES,
+        'annual_volatility': {"WETH": 0.8, "USDC": 0.02, "WBTC": 0.6},
+        'correlation_matrix': [[1.0, 0.1, 0.7], [0.1, 1.0, 0.05], [0.7, 0.05, 1.0]]
+    }
+
+@pytest.fixture
+def positions():
+    """
+    Active positions shaped like bad_debt.py output: single-pair users (threshold
+    index path), multi-asset users, collateral that is not enabled, and a symbol
+    outside the modeled assets (kept at its snapshot price).
+    """
+    rng = np.random.default_rng(0)
+    symbols = ASSETS + ["AAVE"]
+    prices = dict(PRICES, AAVE=100.0)
+
+    rows = []
+    for user in range(300):
+        n_positions = 2 if user % 3 else 4
+        for symbol in rng.choice(symbols, size=n_positions, replace=False):
+            collateral_usd = rng.uniform(0, 50_000) if rng.random() < 0.6 else 0.0
+            debt_usd = rng.uniform(0, 40_000) if collateral_usd == 0 else 0.0
+            rows.append({
+                'user_id': f"0x{user:040x}",
+                'symbol': symbol,
+                'collateral_amount': collateral_usd / prices[symbol],
+                'debt_amount': debt_usd / prices[symbol],
+                'is_collateral': bool(rng.random() < 0.9),
+                'price': prices[symbol]
+            })
+    return pd.DataFrame(rows)
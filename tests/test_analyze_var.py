@@ -0,0 +1,168 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analyze_var
+from analyze_var import calculate_user_equity, evaluate_bad_debt, prepare_position_book
+from liquidation import (CLOSE_FACTOR, DEFAULT_LIQUIDATION_THRESHOLD, LIQUIDATION_BONUS, LIQUIDATION_THRESHOLDS,
+                         liquidation_book, simulate_liquidations)
+from monte_carlo import correlated_gbm_blocks
+
+def loop_bad_debt(positions, assets, final_prices_matrix):
+    # Per-scenario, per-user loop of the original simulate_bad_debt
+    users = [group.to_dict('records') for _, group in positions.groupby('user_id')]
+    bad_debts = []
+    for scenario_prices in final_prices_matrix:
+        price_map = dict(zip(assets, scenario_prices))
+        total = 0.0
+        for user_positions in users:
+            _, _, net_value = calculate_user_equity(user_positions, price_map)
+            if net_value < 0:
+                total += -net_value
+        bad_debts.append(total)
+    return np.array(bad_debts)
+
+@pytest.mark.parametrize("threshold_index", [False, True])
+def test_vectorized_bad_debt_matches_loop(positions, market_data, threshold_index):
+    assets = market_data['assets']
+    S0 = np.array([market_data['latest_prices'][a] for a in assets])
+    final_prices_matrix = S0 * np.exp(np.random.default_rng(1).normal(0, 0.6, size=(200, len(assets))))
+
+    book = prepare_position_book(positions, assets, threshold_index=threshold_index)
+    expected = loop_bad_debt(positions, assets, final_prices_matrix)
+
+    assert expected.max() > 0
+    np.testing.assert_allclose(evaluate_bad_debt(final_prices_matrix, book), expected, rtol=1e-9, atol=1e-6)
+    np.testing.assert_allclose(evaluate_bad_debt(final_prices_matrix, book, batch_cells=50), expected,
+                               rtol=1e-9, atol=1e-6)
+
+def dense_liquidations(positions, assets, paths):
+    # Every (scenario, user) pair checked at every step, with the book rebuilt from the raw positions
+    user_ids, user_index = np.unique(positions['user_id'], return_inverse=True)
+    shape = (len(user_ids), len(assets))
+    collateral, lt_collateral, debt = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    static_collateral, static_debt = np.zeros(len(user_ids)), np.zeros(len(user_ids))
+    for u, row in zip(user_index, positions.itertuples()):
+        amount = row.collateral_amount if row.is_collateral else 0.0
+        if row.symbol in assets:
+            a = assets.index(row.symbol)
+            collateral[u, a] += amount
+            lt_collateral[u, a] += amount * LIQUIDATION_THRESHOLDS.get(row.symbol, DEFAULT_LIQUIDATION_THRESHOLD)
+            debt[u, a] += row.debt_amount
+        else:
+            static_collateral[u] += amount * row.price
+            static_debt[u] += row.debt_amount * row.price
+
+    n_sims = paths.shape[1]
+    coll_scale, debt_scale = np.ones((n_sims, len(user_ids))), np.ones((n_sims, len(user_ids)))
+    realised, liquidations = np.zeros(n_sims), np.zeros(n_sims, dtype=int)
+    for prices in paths:
+        collateral_value = coll_scale * (prices @ collateral.T + static_collateral)
+        lt_value = coll_scale * (prices @ lt_collateral.T + static_collateral * DEFAULT_LIQUIDATION_THRESHOLD)
+        debt_value = debt_scale * (prices @ debt.T + static_debt)
+        for s, u in zip(*np.nonzero(lt_value < debt_value)):
+            liquidations[s] += 1
+            seized = CLOSE_FACTOR * debt_value[s, u] * (1 + LIQUIDATION_BONUS)
+            if seized >= collateral_value[s, u]:
+                realised[s] += debt_value[s, u] - collateral_value[s, u] / (1 + LIQUIDATION_BONUS)
+                coll_scale[s, u] = debt_scale[s, u] = 0.0
+            else:
+                coll_scale[s, u] *= 1 - seized / collateral_value[s, u]
+                debt_scale[s, u] *= 1 - CLOSE_FACTOR
+
+    shortfall = debt_value - collateral_value
+    return realised + np.maximum(shortfall, 0).sum(axis=1), liquidations
+
+def test_liquidations_match_dense_loop(positions, market_data):
+    assets = market_data['assets']
+    S0 = [market_data['latest_prices'][a] for a in assets]
+    sigma = [market_data['annual_volatility'][a] for a in assets]
+    blocks = list(correlated_gbm_blocks(S0, [0.0] * len(assets), sigma, market_data['correlation_matrix'], 1.0, 365,
+                                        40, 30, rng=np.random.default_rng(8)))
+
+    book = liquidation_book(prepare_position_book(positions, assets))
+    bad_debts, liquidations = simulate_liquidations(book, iter(blocks), 40)
+    expected_bad_debts, expected_liquidations = dense_liquidations(positions, assets, np.concatenate(blocks))
+
+    assert expected_liquidations.sum() > 40 * 100
+    np.testing.assert_array_equal(liquidations, expected_liquidations)
+    np.testing.assert_allclose(bad_debts, expected_bad_debts, rtol=1e-9, atol=1e-6)
+
+def test_streaming_results_do_not_depend_on_workers(positions, market_data, monkeypatch, tmp_path):
+    monkeypatch.setattr(analyze_var, "SCENARIO_CACHE_DIR", str(tmp_path))
+    runs = [
+        analyze_var.simulate_bad_debt_streaming(positions, market_data, num_simulations=6000, chunk_size=1000, seed=7,
+                                                n_workers=n_workers)
+        for n_workers in (1, 3)
+    ]
+
+    for key in ('var', 'var_ci', 'es', 'es_ci', 'mean', 'max', 'num_simulations'):
+        assert runs[0][key] == runs[1][key]
+    np.testing.assert_array_equal(runs[0]['sample'], runs[1]['sample'])
+
+def test_historical_scenarios_replay_every_window(market_data):
+    assets = market_data['assets']
+    dates = pd.date_range("2024-01-01", periods=40, freq='D')
+    price_history = pd.DataFrame(np.random.default_rng(3).uniform(1, 2, size=(40, len(assets))), index=dates,
+                                 columns=assets)
+    S0 = [market_data['latest_prices'][a] for a in assets]
+
+    scenarios, window_starts = analyze_var.historical_scenarios(price_history, assets, S0, window_days=30)
+
+    assert scenarios.shape == (10, len(assets))
+    assert list(window_starts) == list(dates[:10])
+    np.testing.assert_allclose(scenarios[4], np.array(S0) * price_history.iloc[34] / price_history.iloc[4])
+
+@pytest.mark.parametrize("window_days", [0, 40, 60])
+def test_historical_scenarios_reject_windows_longer_than_history(market_data, window_days):
+    assets = market_data['assets']
+    price_history = pd.DataFrame(1.0, index=pd.date_range("2024-01-01", periods=40, freq='D'), columns=assets)
+
+    with pytest.raises(ValueError, match="price history"):
+        analyze_var.historical_scenarios(price_history, assets, [1.0] * len(assets), window_days)
+
+def test_horizons_use_the_sampler_model(positions, market_data, monkeypatch, tmp_path):
+    monkeypatch.setattr(analyze_var, "SCENARIO_CACHE_DIR", str(tmp_path))
+    horizons = analyze_var.simulate_bad_debt_horizons(positions, market_data, [30, 365], 4000, mode="paths", seed=2,
+                                                      model="t_copula")
+    plain = analyze_var.simulate_bad_debt_streaming(positions, market_data, 4000, mode="paths", seed=2, model="t_copula")
+
+    year = horizons['table'].set_index('horizon_days').loc[365]
+    np.testing.assert_allclose([year['bad_debt_var'], year['bad_debt_es']], [plain['var'], plain['es']], rtol=1e-9)
+
+def test_gaussian_only_modes_reject_other_models(positions, market_data):
+    with pytest.raises(ValueError, match="t_copula"):
+        analyze_var.simulate_bad_debt_importance(positions, market_data, 1000, model="t_copula")
+
+    book = prepare_position_book(positions, market_data['assets'])
+    with pytest.raises(ValueError, match="jump"):
+        analyze_var.revalue_market_grid(book, [market_data], num_simulations=1000, model="jump")
+
+def test_main_headline_is_the_365_day_row(positions, market_data, monkeypatch, tmp_path, capsys):
+    positions.to_csv(tmp_path / "positions.csv", index=False)
+    (tmp_path / "market.json").write_text(json.dumps(market_data))
+    (tmp_path / "results").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(analyze_var, "POSITION_STORE_DIR", str(tmp_path / "store"))
+    monkeypatch.setattr(analyze_var, "ACTIVE_POSITIONS_FILE", str(tmp_path / "positions.csv"))
+    monkeypatch.setattr(analyze_var, "MARKET_DATA_FILE", str(tmp_path / "market.json"))
+    monkeypatch.setattr(analyze_var, "HISTORICAL_REPLAY", False)
+    monkeypatch.setattr(analyze_var, "HORIZONS_DAYS", [30, 365])
+    monkeypatch.setattr(analyze_var, "NUM_SIMULATIONS", 3000)
+    monkeypatch.setattr(analyze_var, "SCENARIO_SEED", 5)
+    horizons = analyze_var.simulate_bad_debt_horizons
+    calls = []
+
+    def counted_horizons(*args, **kwargs):
+        calls.append(args)
+        return horizons(*args, **kwargs)
+
+    monkeypatch.setattr(analyze_var, "simulate_bad_debt_horizons", counted_horizons)
+
+    analyze_var.main()
+
+    expected = horizons(positions, market_data, [30, 365], 3000, seed=5)['table'].set_index('horizon_days').loc[365]
+    assert len(calls) == 1
+    assert f"VaR (99.9%): ${expected['bad_debt_var']:,.2f}" in capsys.readouterr().out
@@ -0,0 +1,175 @@
+import random
+import threading
+import time
+from fractions import Fraction
+
+import numpy as np
+import pytest
+import requests
+
+import bad_debt
+import http_client
+from bad_debt import (SubgraphError, crawl_users, iter_snapshot_pages, iter_user_pages, load_checkpoint, post_query,
+                      scale_balances)
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.text = "" if payload is not None else "unavailable"
+
+    def json(self):
+        if self.payload is None:
+            raise ValueError("Expecting value: line 1 column 1 (char 0)")
+        return self.payload
+
+class FakeSubgraph:
+    """
+    In-memory stand-in for the subgraph endpoint, answering USERS_QUERY pages from
+    a fixed set of users. After `fail_after` requests the server goes down and
+    answers HTTP 500. Pages hold at most `page_limit` users, as
+    the real endpoint caps `first`, and `max_delay` adds a random response time.
+    """
+
+    def __init__(self, user_ids, fail_after=None, page_limit=None, max_delay=0.0):
+        self.users = [{"id": user_id, "reserves": []} for user_id in sorted(user_ids)]
+        self.fail_after = fail_after
+        self.page_limit = page_limit
+        self.max_delay = max_delay
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, json=None, **kwargs):
+        variables = json["variables"]
+        with self.lock:
+            self.requests.append(variables)
+            if self.fail_after is not None and len(self.requests) > self.fail_after:
+                return FakeResponse(500)
+
+        time.sleep(random.uniform(0, self.max_delay))
+        page = [user for user in self.users
+                if user["id"] > variables["lastId"] and variables["lower"] <= user["id"] < variables["upper"]]
+        return FakeResponse(200, {"data": {"users": page[:min(variables["first"], self.page_limit or variables["first"])]}})
+
+def random_user_ids(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return {"0x" + bytes(rng.integers(0, 256, 20, dtype=np.uint8)).hex() for _ in range(n)}
+
+class ScriptedSession:
+    """
+    Answers each request with the next item of `script`, raising it if it is an exception.
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+
+    def request(self, method, url, **kwargs):
+        item = self.script.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bad_debt, "backoff_delay", lambda attempt, response=None: 0.0)
+    monkeypatch.setattr(http_client, "backoff_delay", lambda attempt, response=None: 0.0)
+
+def test_crawl_resumes_from_checkpoint(tmp_path):
+    user_ids = random_user_ids(500)
+    snapshot_dir = str(tmp_path)
+
+    # The server goes down after 11 queries, so the crawl stops with a partition half done
+    failing_server = FakeSubgraph(user_ids, fail_after=11)
+    with pytest.raises(SubgraphError):
+        crawl_users(snapshot_dir, url="mock://subgraph", session=failing_server, page_size=7, n_partitions=16,
+                    max_concurrency=1)
+
+    checkpoint = load_checkpoint(snapshot_dir)
+    assert not checkpoint["complete"]
+    pending = {p["lower"]: p["last_id"] for p in checkpoint["partitions"] if not p["complete"]}
+    crawled_before = [user["id"] for users in iter_snapshot_pages(snapshot_dir) for user in users]
+    assert any(pending.values()) and 0 < len(crawled_before) < len(user_ids)
+
+    server = FakeSubgraph(user_ids)
+    crawl_users(snapshot_dir, url="mock://subgraph", session=server, page_size=7, n_partitions=16, max_concurrency=4)
+
+    # Finished partitions are not queried again, and pending ones restart from their cursor
+    first_requests = {}
+    for variables in server.requests:
+        first_requests.setdefault(variables["lower"], variables["lastId"])
+    assert first_requests == pending
+
+    checkpoint = load_checkpoint(snapshot_dir)
+    assert checkpoint["complete"]
+    crawled = [user["id"] for users in iter_snapshot_pages(snapshot_dir) for user in users]
+    assert crawled == sorted(user_ids)
+
+def test_streamed_pages_come_in_id_order(tmp_path):
+    user_ids = random_user_ids(400, seed=1)
+    server = FakeSubgraph(user_ids, page_limit=5, max_delay=0.002)
+
+    pages = list(iter_user_pages(snapshot_dir=str(tmp_path), url="mock://subgraph", session=server))
+
+    assert [user["id"] for users in pages for user in users] == sorted(user_ids)
+    assert pages == list(iter_snapshot_pages(str(tmp_path)))
+
+def test_resumed_stream_comes_in_id_order(tmp_path):
+    user_ids = random_user_ids(400, seed=2)
+    failing_server = FakeSubgraph(user_ids, fail_after=40, page_limit=5)
+    with pytest.raises(SubgraphError):
+        list(iter_user_pages(snapshot_dir=str(tmp_path), url="mock://subgraph", session=failing_server))
+
+    server = FakeSubgraph(user_ids, page_limit=5, max_delay=0.002)
+    pages = list(iter_user_pages(snapshot_dir=str(tmp_path), url="mock://subgraph", session=server))
+
+    assert [user["id"] for users in pages for user in users] == sorted(user_ids)
+
+def test_snapshot_pages_keep_partition_order_past_999_partitions(tmp_path):
+    pages = [(99, 0), (99, 1), (100, 0), (999, 0), (1000, 0), (4095, 0)]
+    for partition, page in reversed(pages):
+        bad_debt._write_json(bad_debt._crawl_page_path(str(tmp_path), partition, page), [{"id": f"{partition}/{page}"}])
+
+    read_back = [users[0]["id"] for users in iter_snapshot_pages(str(tmp_path))]
+    assert read_back == [f"{partition}/{page}" for partition, page in pages]
+
+def test_post_query_retries_timeouts_and_invalid_json():
+    ok = FakeResponse(200, {"data": {"users": []}})
+    timeouts = [requests.ReadTimeout("read timed out")] * (http_client.MAX_RETRIES + 1)
+    session = ScriptedSession(timeouts + [FakeResponse(200), ok])
+
+    assert post_query("query", {}, url="mock://subgraph", session=session) == {"users": []}
+
+def test_post_query_raises_subgraph_error_once_retries_run_out():
+    session = ScriptedSession([requests.ReadTimeout("read timed out")] * 20)
+
+    with pytest.raises(SubgraphError, match="ReadTimeout"):
+        post_query("query", {}, url="mock://subgraph", session=session, max_retries=2)
+
+@pytest.mark.parametrize("decimals, min_digits, max_digits", [
+    (6, 1, 15), (8, 8, 14), (18, 1, 19), (18, 16, 27), (18, 37, 39), (30, 10, 40)
+])
+def test_scale_balances_is_correctly_rounded(decimals, min_digits, max_digits):
+    rng = np.random.default_rng(decimals * 100 + min_digits)
+    lengths = rng.integers(min_digits, max_digits + 1, 2000)
+    raw = [str(rng.integers(1, 10)) + "".join(map(str, rng.integers(0, 10, n - 1))) for n in lengths] + ["0"]
+
+    amounts = scale_balances(raw, [decimals] * len(raw))
+
+    expected = [float(Fraction(int(r), 10**decimals)) for r in raw]
+    assert amounts.tolist() == expected
+
+def test_scale_balances_rounds_ties_and_near_ties():
+    # 2**53 + 1, 2**53 + 3, ... are exact midpoints between neighbouring floats
+    midpoints = [2**53 + 1, 2**53 + 3, 2**56 + 8, 10**16 + 1]
+    raw = [str(m * 10**18 + offset) for m in midpoints for offset in (-1, 0, 1)]
+
+    expected = [float(Fraction(int(r), 10**18)) for r in raw]
+    assert scale_balances(raw, [18] * len(raw)).tolist() == expected
+
+def test_scale_balances_mixes_decimals():
+    raw = ["1", "123456789012345678901", "9007199254740993", "5"]
+    decimals = [0, 18, 6, 40]
+
+    expected = [float(Fraction(int(r), 10**d)) for r, d in zip(raw, decimals)]
+    assert scale_balances(raw, decimals).tolist() == expected
+    assert len(scale_balances([], [])) == 0
@@ -0,0 +1,40 @@
+import numpy as np
+
+import correlation_factor
+from correlation_factor import correlation_factor as factor_of, nearest_correlation
+
+INDEFINITE = np.array([[1.0, 0.9, 0.1],
+                       [0.9, 1.0, 0.9],
+                       [0.1, 0.9, 1.0]])
+
+def test_nearest_correlation_repairs_indefinite_matrix():
+    assert np.linalg.eigvalsh(INDEFINITE)[0] < 0
+
+    repaired = nearest_correlation(INDEFINITE)
+
+    np.testing.assert_allclose(repaired, repaired.T)
+    np.testing.assert_allclose(np.diag(repaired), 1.0)
+    assert np.linalg.eigvalsh(repaired)[0] > -1e-8
+
+    # Closer than clipping the negative eigenvalue and rescaling to a unit diagonal
+    clipped = correlation_factor._psd_projection(INDEFINITE)
+    clipped /= np.sqrt(np.outer(np.diag(clipped), np.diag(clipped)))
+    assert np.linalg.norm(repaired - INDEFINITE) < np.linalg.norm(clipped - INDEFINITE)
+
+def test_factor_of_indefinite_matrix_is_the_repaired_correlation():
+    L = factor_of(INDEFINITE)
+
+    np.testing.assert_allclose(np.linalg.norm(L, axis=1), 1.0)
+    np.testing.assert_allclose(L @ L.T, nearest_correlation(INDEFINITE), atol=1e-6)
+
+def test_factor_cache_returns_the_same_read_only_factor(monkeypatch):
+    monkeypatch.setattr(correlation_factor, '_factor_cache', correlation_factor.OrderedDict())
+    corr = np.array([[1.0, 0.3], [0.3, 1.0]])
+
+    first = factor_of(corr)
+    second = factor_of(corr.copy())
+
+    assert second is first
+    assert not first.flags.writeable
+    np.testing.assert_allclose(first, np.linalg.cholesky(corr))
+    assert factor_of(corr, variance_kept=0.5) is not first
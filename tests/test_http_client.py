@@ -0,0 +1,54 @@
+import pytest
+import requests
+
+import http_client
+from http_client import request_with_backoff
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+class ScriptedSession:
+    """
+    Answers each request with the next item of `script`, raising it if it is an exception.
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        item = self.script.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(http_client.time, "sleep", lambda seconds: None)
+
+@pytest.mark.parametrize("error", [requests.ReadTimeout(), requests.ConnectTimeout(),
+                                   requests.exceptions.ChunkedEncodingError(), requests.ConnectionError()])
+def test_transient_request_errors_are_retried(error):
+    session = ScriptedSession([error, FakeResponse(503), FakeResponse(200)])
+
+    response = request_with_backoff(session, "GET", "https://example.com")
+
+    assert response.status_code == 200
+    assert session.calls == 3
+
+def test_last_request_error_is_raised():
+    session = ScriptedSession([requests.ReadTimeout()] * 3)
+
+    with pytest.raises(requests.ReadTimeout):
+        request_with_backoff(session, "GET", "https://example.com", max_retries=2)
+    assert session.calls == 3
+
+def test_invalid_requests_are_not_retried():
+    session = ScriptedSession([requests.exceptions.InvalidURL(), FakeResponse(200)])
+
+    with pytest.raises(requests.exceptions.InvalidURL):
+        request_with_backoff(session, "GET", "https://example.com")
+    assert session.calls == 1
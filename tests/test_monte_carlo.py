@@ -0,0 +1,54 @@
+import warnings
+
+import numpy as np
+
+from monte_carlo import (correlated_gbm_blocks, correlated_model_at_horizons, correlated_model_paths,
+                         correlated_model_terminal_prices, standard_normals)
+
+S0, MU, SIGMA = [3000.0, 60000.0], [0.0, 0.0], [0.8, 0.6]
+CORRELATION = [[1.0, 0.7], [0.7, 1.0]]
+
+def lower_tail_dependence(log_returns, q=0.02):
+    both = (log_returns < np.quantile(log_returns, q, axis=0)).all(axis=1)
+    return both.mean() / q
+
+def test_sobol_draws_any_count_from_a_balanced_block():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        Z = standard_normals((5, 1000, 2), sim_axis=1, rng=np.random.default_rng(0), method="sobol")
+    full = standard_normals((5, 1024, 2), sim_axis=1, rng=np.random.default_rng(0), method="sobol")
+
+    assert Z.shape == (5, 1000, 2)
+    np.testing.assert_array_equal(Z, full[:, :1000])
+    assert abs(full.mean()) < 1e-3
+
+def test_t_copula_paths_keep_the_terminal_tail_dependence():
+    terminal = correlated_model_terminal_prices(S0, MU, SIGMA, CORRELATION, 1.0, 100_000, model="t_copula",
+                                                rng=np.random.default_rng(0))
+    paths = correlated_model_paths(S0, MU, SIGMA, CORRELATION, 1.0, 24, 100_000, model="t_copula",
+                                   rng=np.random.default_rng(1))
+    gbm = correlated_model_terminal_prices(S0, MU, SIGMA, CORRELATION, 1.0, 100_000, rng=np.random.default_rng(2))
+
+    terminal_tail = lower_tail_dependence(np.log(terminal / S0))
+    paths_tail = lower_tail_dependence(np.log(paths[-1] / S0))
+    assert terminal_tail > lower_tail_dependence(np.log(gbm / S0)) + 0.1
+    assert abs(paths_tail - terminal_tail) < 0.05
+    np.testing.assert_allclose(np.log(paths[-1] / S0).std(axis=0), SIGMA, rtol=0.02)
+
+def test_t_copula_blocks_reproduce_paths():
+    paths = correlated_model_paths(S0, MU, SIGMA, CORRELATION, 1.0, 30, 2000, model="t_copula",
+                                   rng=np.random.default_rng(3))
+    blocks = correlated_gbm_blocks(S0, MU, SIGMA, CORRELATION, 1.0, 30, 2000, 7, rng=np.random.default_rng(3),
+                                   model="t_copula")
+
+    np.testing.assert_allclose(np.concatenate(list(blocks)), paths[1:], rtol=1e-12)
+
+def test_t_copula_horizons_extend_the_terminal_law():
+    terminal = correlated_model_terminal_prices(S0, MU, SIGMA, CORRELATION, 1.0, 100_000, model="t_copula",
+                                                rng=np.random.default_rng(0))
+    horizons = correlated_model_at_horizons(S0, MU, SIGMA, CORRELATION, [7 / 365, 90 / 365, 1.0], 100_000,
+                                            model="t_copula", rng=np.random.default_rng(4))
+
+    assert horizons.shape == (3, 100_000, 2)
+    assert abs(lower_tail_dependence(np.log(horizons[-1] / S0)) - lower_tail_dependence(np.log(terminal / S0))) < 0.05
+    np.testing.assert_allclose(np.log(horizons[1] / S0).std(axis=0), np.array(SIGMA) * np.sqrt(90 / 365), rtol=0.02)
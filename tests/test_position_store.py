@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from analyze_var import evaluate_bad_debt, prepare_position_book
+from position_store import PositionStoreWriter, load_position_store
+
+def write_store(positions, store_dir, n_batches=7):
+    writer = PositionStoreWriter(store_dir)
+    # Uneven batches, so some users are split across appends
+    bounds = np.linspace(0, len(positions), n_batches + 1).astype(int)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        writer.append(positions.iloc[start:end])
+    writer.close()
+
+def test_store_round_trips_positions(positions, tmp_path):
+    store_dir = str(tmp_path / "store")
+    write_store(positions, store_dir)
+
+    store = load_position_store(store_dir)
+
+    assert not os.path.exists(store_dir + ".partial")
+    user_ids = np.asarray(store["user_ids"]).astype(str)
+    np.testing.assert_array_equal(user_ids[store["user_index"]], positions["user_id"])
+    assert list(user_ids) == list(pd.unique(positions["user_id"]))
+    np.testing.assert_array_equal(np.asarray(store["symbols"])[store["symbol_code"]], positions["symbol"])
+    for column in ("collateral_amount", "debt_amount", "is_collateral", "price"):
+        np.testing.assert_array_equal(store[column], positions[column])
+
+def test_store_values_the_same_book(positions, market_data, tmp_path):
+    store_dir = str(tmp_path / "store")
+    write_store(positions, store_dir)
+    assets = market_data['assets']
+    prices = np.random.default_rng(0).lognormal(0, 0.5, size=(100, len(assets))) * [3000.0, 1.0, 60000.0]
+
+    from_store = evaluate_bad_debt(prices, prepare_position_book(load_position_store(store_dir), assets))
+    from_frame = evaluate_bad_debt(prices, prepare_position_book(positions, assets))
+
+    np.testing.assert_allclose(from_store, from_frame, rtol=1e-12)
+
+def test_aborted_store_leaves_the_previous_one(positions, tmp_path):
+    store_dir = str(tmp_path / "store")
+    write_store(positions.iloc[:10], store_dir)
+
+    writer = PositionStoreWriter(store_dir)
+    writer.append(positions)
+    writer.abort()
+
+    assert not os.path.exists(store_dir + ".partial")
+    assert len(load_position_store(store_dir)["price"]) == 10
+
+def test_empty_store(tmp_path):
+    store_dir = str(tmp_path / "store")
+    PositionStoreWriter(store_dir).close()
+
+    store = load_position_store(store_dir)
+
+    assert len(store["user_ids"]) == 0 and len(store["price"]) == 0
@@ -0,0 +1,62 @@
+import pandas as pd
+
+import price_cache
+from price_cache import get_price_history, load_cached_prices, save_cached_prices
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.status_code = 200
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+class RecordingSession:
+    """
+    Stands in for requests.Session: records every request and answers range
+    queries with one price per day at 00:00 UTC.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def request(self, method, url, params=None, **kwargs):
+        self.calls.append((url, params))
+        days = pd.date_range(pd.Timestamp(params['from'], unit='s', tz='UTC').ceil('D'),
+                             pd.Timestamp(params['to'], unit='s', tz='UTC'), freq='D')
+        return FakeResponse({'prices': [[int(day.timestamp() * 1000), 100.0 + i] for i, day in enumerate(days)]})
+
+def cached_series(last_day, n_days=10):
+    dates = pd.date_range(end=last_day, periods=n_days, freq='D', tz='UTC')
+    return pd.Series(range(n_days), index=dates, dtype=float)
+
+def test_cache_holding_today_makes_no_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(price_cache, "RATE_LIMITER", None)
+    today = pd.Timestamp.now(tz='UTC').normalize()
+    save_cached_prices(cached_series(today), "weth", cache_dir=str(tmp_path))
+    session = RecordingSession()
+
+    prices = get_price_history("weth", cache_dir=str(tmp_path), session=session)
+
+    assert session.calls == []
+    assert prices.index[-1] == today
+    assert len(prices) == 10
+
+def test_stale_cache_requests_only_missing_days(tmp_path, monkeypatch):
+    monkeypatch.setattr(price_cache, "RATE_LIMITER", None)
+    today = pd.Timestamp.now(tz='UTC').normalize()
+    last_cached = today - pd.Timedelta(days=3)
+    save_cached_prices(cached_series(last_cached), "weth", cache_dir=str(tmp_path))
+    session = RecordingSession()
+
+    prices = get_price_history("weth", cache_dir=str(tmp_path), session=session)
+
+    assert len(session.calls) == 1
+    url, params = session.calls[0]
+    assert url == price_cache.API_RANGE_URL.format(coin_id="weth")
+    assert params['from'] == int((last_cached + pd.Timedelta(days=1)).timestamp())
+    assert prices.index[-1] == today
+    assert len(prices) == 13
+    assert prices.index.is_unique
+    pd.testing.assert_series_equal(load_cached_prices("weth", cache_dir=str(tmp_path)), prices, check_names=False,
+                                   check_freq=False)
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from rolling_stats import load_moments, updated_moments
+
+def price_frame(n_days, seed=0):
+    dates = pd.date_range("2023-01-01", periods=n_days, freq='D', tz='UTC')
+    returns = np.random.default_rng(seed).normal(0, 0.03, size=(n_days, 3))
+    return pd.DataFrame(100 * np.exp(np.cumsum(returns, axis=0)), index=dates, columns=["WETH", "USDC", "WBTC"])
+
+def test_incremental_update_matches_full_history(tmp_path):
+    prices = price_frame(400)
+    path = str(tmp_path / "moments.npz")
+
+    updated_moments(prices.iloc[:300], path, windows=(30, 90))
+    incremental = updated_moments(prices, path, windows=(30, 90))
+    rebuilt = updated_moments(prices, str(tmp_path / "fresh.npz"), windows=(30, 90))
+
+    log_returns = np.log(prices / prices.shift(1)).dropna()
+    for window in (None, 30, 90):
+        expected = (log_returns if window is None else log_returns.iloc[-window:]).cov().to_numpy()
+        np.testing.assert_allclose(incremental.covariance(window), expected, rtol=1e-9, atol=1e-15)
+        np.testing.assert_allclose(incremental.covariance(window), rebuilt.covariance(window), rtol=1e-9, atol=1e-15)
+
+    saved = load_moments(path)
+    assert saved.last_date == prices.index[-1]
+    assert saved.count == len(log_returns)
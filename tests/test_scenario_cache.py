@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+import scenario_cache
+from scenario_cache import evict, load_scenarios, save_scenarios, scenario_key
+
+def test_load_survives_eviction_by_another_process(tmp_path, monkeypatch):
+    save_scenarios("a", np.arange(6.0).reshape(3, 2), cache_dir=str(tmp_path))
+    utime = os.utime
+
+    def evicted_then_touched(path, *args, **kwargs):
+        os.remove(path)
+        return utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(scenario_cache.os, "utime", evicted_then_touched)
+
+    scenarios = load_scenarios("a", cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(scenarios, np.arange(6.0).reshape(3, 2))
+
+def test_evict_skips_files_removed_meanwhile(tmp_path, monkeypatch):
+    for i, key in enumerate("abc"):
+        save_scenarios(key, np.zeros(1000), cache_dir=str(tmp_path))
+        os.utime(tmp_path / f"{key}.npy", (i, i))
+    stat = os.stat
+
+    def removed_before_stat(path, *args, **kwargs):
+        if str(path).endswith("a.npy"):
+            os.remove(path)
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(scenario_cache.os, "stat", removed_before_stat)
+
+    evict(str(tmp_path), max_bytes=9000, keep="c")
+    assert sorted(os.listdir(tmp_path)) == ["c.npy"]
+
+def test_key_changes_with_the_cache_version(monkeypatch):
+    inputs = ([100.0, 1.0], [0.0, 0.0], [0.8, 0.02], np.eye(2), 1.0, 365, 1000, 7, "terminal", "pseudo")
+    key = scenario_key(*inputs)
+
+    assert scenario_key(*inputs) == key
+    monkeypatch.setattr(scenario_cache, "SCENARIO_CACHE_VERSION", scenario_cache.SCENARIO_CACHE_VERSION + 1)
+    assert scenario_key(*inputs) != key
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from tail_stats import QuantileSketch, TailAccumulator, tail_capacity, weighted_tail_stats
+
+def test_weighted_tail_stats_with_unit_weights():
+    values = np.random.default_rng(0).permutation(1000).astype(float)
+
+    var, expected_shortfall = weighted_tail_stats(values, np.ones(1000), 99.5)
+
+    assert var == 994.0
+    assert expected_shortfall == pytest.approx(np.sort(values)[-5:].mean())
+
+@pytest.mark.parametrize("weights", [np.full(1000, 1e-4), np.r_[np.full(999, 1.0), 20.0]])
+def test_weighted_tail_stats_refuses_unresolved_tails(weights):
+    values = np.arange(1000.0)
+
+    with pytest.warns(RuntimeWarning, match="VaR and expected shortfall"):
+        var, expected_shortfall = weighted_tail_stats(values, weights, 99.9)
+
+    assert np.isnan(var) and np.isnan(expected_shortfall)
+
+def test_chunked_accumulator_matches_full_sort():
+    values = np.random.default_rng(2).lognormal(0, 2, 50_000)
+    chunks = np.array_split(values, 13)
+    capacity = tail_capacity(values.size, 99.0, 0.95)
+
+    first, second = TailAccumulator(capacity), TailAccumulator(capacity)
+    for chunk in chunks[:6]:
+        first.update(chunk)
+    for chunk in chunks[6:]:
+        second.update(chunk)
+    first.merge(second)
+
+    worst = np.sort(values)[-int(np.ceil(values.size * (1 - 99.0 / 100))):]
+    assert first.count == values.size
+    assert first.percentile(99.0) == np.percentile(values, 99.0)
+    assert first.expected_shortfall(99.0) == pytest.approx(worst.mean(), rel=1e-12)
+    assert first.max == values.max()
+
+def test_sketch_quantile_rank_error_within_bound():
+    values = np.random.default_rng(3).lognormal(0, 2, 200_000)
+    sketch, other = QuantileSketch(), QuantileSketch()
+    for i, chunk in enumerate(np.array_split(values, 37)):
+        (sketch if i % 2 else other).update(chunk)
+    sketch.merge(other)
+
+    p = np.array([0.001, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999])
+    rank = np.searchsorted(np.sort(values), sketch.quantile(p)) / values.size
+    bound = 2 * np.pi * np.sqrt(p * (1 - p)) / sketch.compression + 1.0 / values.size
+
+    assert sketch.weights.size <= sketch.compression
+    assert np.all(np.abs(rank - p) <= bound)